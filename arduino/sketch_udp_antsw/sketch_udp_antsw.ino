@@ -28,7 +28,9 @@ IPAddress ip(192, 168, 1, 178);
 unsigned int localPort = 8888;
 
 // Buffers for receiving and sending data
-char packetBuffer[UDP_TX_PACKET_MAX_SIZE]; // Buffer to hold incoming packet,
+// UDP_TX_PACKET_MAX_SIZE is only 24 which is too small for a relay batch
+#define PACKET_MAX_SIZE 128
+char packetBuffer[PACKET_MAX_SIZE];       // Buffer to hold incoming packet,
 char  ReplyBuffer[128];                   // The response
 char  StatusBuffer[128];                  // Interim data
 int counter;
@@ -36,6 +38,24 @@ int counter;
 // An EthernetUDP instance to let us send and receive packets over UDP
 EthernetUDP Udp;
 
+// Duplicate suppression
+// The last SEQ_WINDOW sequence numbers seen from each recent client.
+// Pings and read backs go out between a relay command and its retransmit
+// so the last one alone is not enough.
+#define MAX_CLIENTS 4
+#define SEQ_WINDOW 8
+IPAddress client_ip[MAX_CLIENTS];
+unsigned int client_port[MAX_CLIENTS];
+long client_seq[MAX_CLIENTS][SEQ_WINDOW];
+int client_next_seq[MAX_CLIENTS];
+int next_client = 0;
+
+// Binary frame, see relayframe.py
+// version, seq (2), energise mask (2), de-energise mask (2), CRC-8
+#define FRAME_VERSION 0xA1
+#define FRAME_SIZE 8
+byte frameBuffer[FRAME_SIZE];
+
 //////////////////////////////////////////////////////////////////////////
 // Relay section
 // Pin allocation
@@ -56,6 +76,11 @@ const int relay_13 = 13;
 const int relay_14 = 14;
 const int relay_15 = 15;
 const int relay_16 = 16;
+// Pins 22-29 are PORTA bits 0-7 (relays 1-8), pins 30-37 are PORTC bits 7-0 (relays 9-16).
+// Relays are applied with one write to each port. When a change both releases
+// and operates relays those released go first and the rest follow after this delay
+// so two antennas are never connected at once.
+#define BREAK_BEFORE_MAKE_MS 20
 
 //////////////////////////////////////////////////////////////////////////
 void setup() {
@@ -63,6 +88,9 @@ void setup() {
   Ethernet.begin(mac, ip);
   Udp.begin(localPort);
   
+  // Relays are active LOW so ensure all will be de-energised
+  // before the pins become outputs
+  reset_relays();
   // Configure the pins used to drive the relays
   pinMode(relay_base + relay_1, OUTPUT);
   pinMode(relay_base + relay_2, OUTPUT);
@@ -80,8 +108,6 @@ void setup() {
   pinMode(relay_base + relay_14, OUTPUT);
   pinMode(relay_base + relay_15, OUTPUT);
   pinMode(relay_base + relay_16, OUTPUT);
-  // Relays are active LOW so ensure all are de-energised
-  reset_relays();
 
   // Initialise serial port to be used for debug
   Serial.begin(9600);
@@ -96,12 +122,38 @@ void loop() {
   // If there's data available, read a packet
   if (packetSize) {
     // Read and reply
-    doRead(packetSize);   
-    // Execute command
-    execute(packetBuffer);
+    packetSize = doRead(packetSize);
+    if (packetSize == FRAME_SIZE && (byte)packetBuffer[0] == FRAME_VERSION) {
+      // Binary frame, replies with a frame
+      do_frame();
+      delay(100);
+      return;
+    }
+    // Split off any sequence number, "#<seq>:<command>"
+    char *command = packetBuffer;
+    long seq = -1;
+    if (*command == '#') {
+      seq = 0;
+      for (command++; *command >= '0' && *command <= '9'; command++) {
+        seq = seq*10 + *command - '0';
+      }
+      if (*command == ':') command++;
+    }
+    if (seq >= 0 && is_duplicate(seq)) {
+      // Already executed, our reply was lost so just repeat it
+      if (strcmp(command, "ping") == 0) {
+        reply("awake", seq);
+      } else if (strcmp(command, "status") == 0) {
+        send_status(seq);
+      } else if (strcmp(command, "binary") == 0) {
+        send_binary(seq);
+      }
+    } else {
+      // Execute command
+      execute(command, seq);
+    }
     // Reply
-    strcpy(ReplyBuffer, "ack");
-    sendResponse();
+    reply("ack", seq);
   }
   delay(100);
 }
@@ -121,9 +173,11 @@ int queryPacket() {
 int doRead(int packetSize) {
   
   // Read the packet into packetBufffer
-  Udp.read(packetBuffer, UDP_TX_PACKET_MAX_SIZE);
+  if (packetSize > PACKET_MAX_SIZE - 1) packetSize = PACKET_MAX_SIZE - 1;
+  Udp.read(packetBuffer, packetSize);
   // Terminate buffer
   packetBuffer[packetSize] = '\0'; 
+  return packetSize;
 }
 
 //////////////////////////////////////////////////////////////////////////
@@ -136,64 +190,211 @@ int sendResponse() {
 }
 
 //////////////////////////////////////////////////////////////////////////
-void execute(char *command) {
+void reply(const char *text, long seq) {
+
+  // Send a reply, tagged with the sequence number if the command had one
+  if (seq >= 0) {
+    sprintf(ReplyBuffer, "%s:%ld", text, seq);
+  } else {
+    strcpy(ReplyBuffer, text);
+  }
+  sendResponse();
+}
+
+//////////////////////////////////////////////////////////////////////////
+bool is_duplicate(long seq) {
+
+  // True if this is one of the recent sequence numbers from this client.
+  // Otherwise remember it in place of the oldest, replacing the oldest
+  // client if this one is new.
+  int i, j;
+  for (i = 0; i < MAX_CLIENTS; i++) {
+    if (client_ip[i] == Udp.remoteIP() && client_port[i] == Udp.remotePort()) {
+      for (j = 0; j < SEQ_WINDOW; j++) {
+        if (client_seq[i][j] == seq) {
+          return true;
+        }
+      }
+      client_seq[i][client_next_seq[i]] = seq;
+      client_next_seq[i] = (client_next_seq[i] + 1) % SEQ_WINDOW;
+      return false;
+    }
+  }
+  i = next_client;
+  client_ip[i] = Udp.remoteIP();
+  client_port[i] = Udp.remotePort();
+  for (j = 0; j < SEQ_WINDOW; j++) {
+    client_seq[i][j] = -1;
+  }
+  client_seq[i][0] = seq;
+  client_next_seq[i] = 1;
+  next_client = (next_client + 1) % MAX_CLIENTS;
+  return false;
+}
+
+//////////////////////////////////////////////////////////////////////////
+void execute(char *command, long seq) {
   
   /*
   * The command set is as follows. Commands are terminated strings.
+  * Any command may be prefixed "#<seq>:" in which case the replies
+  * are "awake:<seq>" and "ack:<seq>" and a repeat of any of the last
+  * SEQ_WINDOW sequence numbers from the same client is not executed again.
   * Ping        - "ping"      -  connectivity test
+  * Status      - "status"    -  reply "status=XXXX", hex mask of energised relays, bit 0 = relay 1
+  * Binary      - "binary"    -  reply "binary=<version>", binary frames are understood
   * Relay on    - "[1-16]e"    -  energise relay 1-16
   * Relay off   - "[1-16]d"    -  de-energise relay 1-16
+  * Relay batch - "1e2d3e..."  -  any number of relay commands in one packet, applied together
   */ 
-  char *p;
-  int value = 0;
+  unsigned int energise = 0;
+  unsigned int de_energise = 0;
   
   // Execute command type
   if (strcmp(command, "ping") == 0) {
-    strcpy(ReplyBuffer, "awake");
-    sendResponse();
+    reply("awake", seq);
+  } else if (strcmp(command, "status") == 0) {
+    send_status(seq);
+  } else if (strcmp(command, "binary") == 0) {
+    send_binary(seq);
   } else {
-    // A numeric command
-    for(p=command; *p; p++) {
-     if(*p >= '0' && *p <= '9') {
-        // Numeric entered, so accumulate numeric value
-        value = value*10 + *p - '0';
-     } else if(*p == 'e') {
-        energise_relay(value);
-     } else if(*p == 'd') {
-        de_energise_relay(value);
-     }
+    // A numeric command, possibly several concatenated
+    parse_relays(command, &energise, &de_energise);
+    apply_relays(energise, de_energise);
+  }
+}
+
+//////////////////////////////////////////////////////////////////////////
+void parse_relays(char *p, unsigned int *energise, unsigned int *de_energise) {
+
+  // Accumulate "1e2d3e..." into masks, bit 0 = relay 1.
+  // A later command for the same relay overrides an earlier one.
+  int value = 0;
+  unsigned int bit;
+  for(; *p; p++) {
+    if(*p >= '0' && *p <= '9') {
+      // Numeric entered, so accumulate numeric value
+      value = value*10 + *p - '0';
+    } else if(*p == 'e' || *p == 'd') {
+      if (value >= relay_1 && value <= relay_16) {
+        bit = 1u << (value - 1);
+        if (*p == 'e') {
+          *energise |= bit;
+          *de_energise &= ~bit;
+        } else {
+          *de_energise |= bit;
+          *energise &= ~bit;
+        }
+      }
+      value = 0;
     }
   }
 }
 
 //////////////////////////////////////////////////////////////////////////
-void reset_relays() {
-  
-  digitalWrite(relay_base + relay_1, HIGH);
-  digitalWrite(relay_base + relay_2, HIGH);
-  digitalWrite(relay_base + relay_3, HIGH);
-  digitalWrite(relay_base + relay_4, HIGH);
-  digitalWrite(relay_base + relay_5, HIGH);
-  digitalWrite(relay_base + relay_6, HIGH);
-  digitalWrite(relay_base + relay_7, HIGH);
-  digitalWrite(relay_base + relay_8, HIGH);
-  digitalWrite(relay_base + relay_9, HIGH);
-  digitalWrite(relay_base + relay_10, HIGH);
-  digitalWrite(relay_base + relay_11, HIGH);
-  digitalWrite(relay_base + relay_12, HIGH);
-  digitalWrite(relay_base + relay_13, HIGH);
-  digitalWrite(relay_base + relay_14, HIGH);
-  digitalWrite(relay_base + relay_15, HIGH);
-  digitalWrite(relay_base + relay_16, HIGH);
+void apply_relays(unsigned int energise, unsigned int de_energise) {
+
+  // Apply a change in at most two port writes, break before make.
+  // Energise wins if a relay is in both masks.
+  unsigned int current = relay_mask();
+  unsigned int released = current & ~de_energise;
+  if (released != current && (energise & ~released) != 0) {
+    write_relays(released);
+    delay(BREAK_BEFORE_MAKE_MS);
+  }
+  write_relays(released | energise);
 }
 
 //////////////////////////////////////////////////////////////////////////
-void energise_relay(int relay_id) {
-  digitalWrite(relay_id + relay_base, LOW);
+void write_relays(unsigned int mask) {
+
+  // Set all 16 relays from a mask, bit 0 = relay 1. Relays are active LOW.
+  byte port_a = ~(mask & 0xFF);
+  byte port_c = ~reverse_bits((mask >> 8) & 0xFF);
+  // No interrupt between the two port writes
+  byte sreg = SREG;
+  cli();
+  PORTA = port_a;
+  PORTC = port_c;
+  SREG = sreg;
+}
+
+//////////////////////////////////////////////////////////////////////////
+byte reverse_bits(byte b) {
+
+  // PORTC runs the opposite way to the relay numbering
+  b = (b & 0xF0) >> 4 | (b & 0x0F) << 4;
+  b = (b & 0xCC) >> 2 | (b & 0x33) << 2;
+  b = (b & 0xAA) >> 1 | (b & 0x55) << 1;
+  return b;
+}
+
+//////////////////////////////////////////////////////////////////////////
+void send_status(long seq) {
+
+  sprintf(StatusBuffer, "status=%04X", relay_mask());
+  reply(StatusBuffer, seq);
+}
+
+//////////////////////////////////////////////////////////////////////////
+void send_binary(long seq) {
+
+  sprintf(StatusBuffer, "binary=%d", FRAME_VERSION);
+  reply(StatusBuffer, seq);
+}
+
+//////////////////////////////////////////////////////////////////////////
+unsigned int relay_mask() {
+
+  // Read back the relay outputs from the port registers, relays are active LOW
+  return (byte)~PORTA | ((unsigned int)reverse_bits(~PORTC) << 8);
 }
 
 //////////////////////////////////////////////////////////////////////////
-void de_energise_relay(int relay_id) {
-  digitalWrite(relay_id + relay_base, HIGH);
+void do_frame() {
+
+  // Execute a binary frame, apply both masks in one pass and
+  // reply with a frame carrying the relay state.
+  // A corrupt frame gets no reply so the client retransmits.
+  byte *frame = (byte *)packetBuffer;
+  if (crc8(frame, FRAME_SIZE - 1) != frame[FRAME_SIZE - 1]) return;
+  long seq = ((unsigned int)frame[1] << 8) | frame[2];
+  unsigned int energise = ((unsigned int)frame[3] << 8) | frame[4];
+  unsigned int de_energise = ((unsigned int)frame[5] << 8) | frame[6];
+  if (!is_duplicate(seq)) {
+    apply_relays(energise, de_energise);
+  }
+  unsigned int mask = relay_mask();
+  frameBuffer[0] = FRAME_VERSION;
+  frameBuffer[1] = seq >> 8;
+  frameBuffer[2] = seq & 0xFF;
+  frameBuffer[3] = mask >> 8;
+  frameBuffer[4] = mask & 0xFF;
+  frameBuffer[5] = 0;
+  frameBuffer[6] = 0;
+  frameBuffer[7] = crc8(frameBuffer, FRAME_SIZE - 1);
+  Udp.beginPacket(Udp.remoteIP(), Udp.remotePort());
+  Udp.write(frameBuffer, FRAME_SIZE);
+  Udp.endPacket();
 }
+
+//////////////////////////////////////////////////////////////////////////
+byte crc8(byte *data, int len) {
+
+  // CRC-8, poly 0x07, initial 0
+  byte crc = 0;
+  int i, j;
+  for (i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (j = 0; j < 8; j++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+//////////////////////////////////////////////////////////////////////////
+void reset_relays() {
   
+  write_relays(0);
+}
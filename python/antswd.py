@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# antswd.py
+#
+# Headless daemon for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Qt free imports only
+from coreimports import *
+import argparse
+import signal
+
+"""
+
+Headless switch.
+Runs the switch core without a GUI, e.g. on a Pi at the mast, and serves
+it on CORE_PORT and, for WebSocket clients, CORE_WS_PORT. The GUI attaches
+with antswui.py --attach <ip>[:<port>].
+Nothing here imports Qt.
+
+"""
+
+def log_event(event, data):
+    """
+    Core listener, print what the user would see in the status bar
+
+    Arguments:
+        event   --  CORE_ event type
+        data    --  associated data, event specific
+
+    """
+
+    if event == CORE_STATUS:
+        online, message = data
+        print('%s %s' % ('Connected' if online else 'Disconnected', message))
+    elif event == CORE_COMPLETED:
+        cmd_id, success, message = data
+        if not success:
+            print(message)
+    elif event == CORE_MESSAGE:
+        print(data)
+    elif event == CORE_MACRO:
+        print('Macro %d: %d relays switched, %d already set' % (data[0] + 1, data[1], data[2]))
+    elif event == CORE_TX:
+        transmitting, held, holdtime = data
+        if transmitting:
+            print('Transmitting, %d relay changes held' % held)
+        else:
+            print('Receiving, %d relay changes held for %.1fs' % (held, holdtime))
+
+#======================================================================================================================
+# Main code
+def main():
+
+    try:
+        parser = argparse.ArgumentParser(description='Antenna switch daemon')
+        parser.add_argument('--ip', default=CORE_IP, help='address to serve on, 0.0.0.0 for all')
+        parser.add_argument('--port', type=int, default=CORE_PORT, help='TCP port to serve on')
+        parser.add_argument('--ws-port', type=int, default=CORE_WS_PORT, help='WebSocket port to serve on, 0 for none')
+        parser.add_argument('--settings', default=SETTINGS_PATH, help='settings file')
+        parser.add_argument('--state', default=STATE_PATH, help='state file')
+        parser.add_argument('--ext-coalesce', choices=(EXT_EXECUTE_ALL, EXT_LATEST_MACRO), default=EXT_EXECUTE_ALL, help='queued external macros, all run or just the latest')
+        args = parser.parse_args()
+
+        core = switchcore.SwitchCore(args.settings, args.state, ext_coalesce=args.ext_coalesce)
+        server = coreserver.CoreServer(core, args.ip, args.port, args.ws_port if args.ws_port > 0 else None)
+        core.start()
+        core.attach(log_event)
+        server.start()
+        print("Flexi-Switch daemon running on %s:%d..." % server.address())
+        if server.ws_address() != None:
+            print("WebSocket clients on %s:%d" % server.ws_address())
+
+        # Run until told to stop
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            while not stop.is_set():
+                stop.wait(1.0)
+        except KeyboardInterrupt:
+            pass
+
+        print("Flexi-Switch daemon closing...")
+        server.terminate()
+        server.join()
+        core.terminate()
+
+    except Exception as e:
+        print ('Exception [%s][%s]' % (str(e), traceback.format_exc()))
+
+# Entry point
+if __name__ == '__main__':
+    main()
@@ -25,24 +25,31 @@
 
 # All imports
 from imports import *
+import argparse
 
 """
-GUI UI for antenna switch
+GUI UI for antenna switch.
+The switch itself is a SwitchCore, run here or in the daemon (antswd.py)
+and reached through a CoreClient. Either way the GUI keeps a copy of the
+settings and state, kept up to date by the changes the core reports, and
+asks the core to make any change.
 """
 class AntSwUI(QMainWindow):
     
-    def __init__(self, qt_app):
+    def __init__(self, qt_app, core):
         """
         Constructor
         
         Arguments:
             qt_app  --  the Qt appplication object
+            core    --  a started SwitchCore or CoreClient
             
         """
         
         super(AntSwUI, self).__init__()
         
         self.__qt_app = qt_app
+        self.__core = core
         
         # Set the back colour
         palette = QPalette()
@@ -50,22 +57,27 @@ class AntSwUI(QMainWindow):
         self.setPalette(palette)
         
         # Class variables
-        self.__online = False
-        self.__statusMessage = ''
-        self.__lastStatus = ''
-        self.__temp_settings = None
-        self.__temp_state = None
-        # Nominally 50 ticks == 5s
-        self.__tickcount = TICKS_TO_CLEAR
-        self.__pollcount = POLL_TICKS
-        # External command
-        self.__doMacro = None
-        
-        # Retrieve settings and state ( see common.py DEFAULTS for strcture)
-        self.__settings = persist.getSavedCfg(SETTINGS_PATH)
-        if self.__settings == None: self.__settings = DEFAULT_SETTINGS
-        self.__state = persist.getSavedCfg(STATE_PATH)
-        if self.__state == None: self.__state = DEFAULT_STATE
+        self.__online = None
+        # Configuration transactions while the configurator is open
+        self.__settings_tx = None
+        self.__state_tx = None
+        self.__config_template = None
+        
+        # Core events reach the main thread through these signals. All are queued,
+        # even from the main thread, so changes are applied in the order they were made.
+        self.__signals = WorkerSignals()
+        self.__signals.completed.connect(self.__engine_completed, Qt.QueuedConnection)
+        self.__signals.status.connect(self.__on_status, Qt.QueuedConnection)
+        self.__signals.macro.connect(self.__on_macro, Qt.QueuedConnection)
+        self.__signals.tx.connect(self.__on_tx, Qt.QueuedConnection)
+        self.__signals.message.connect(self.__set_status_message, Qt.QueuedConnection)
+        self.__signals.change.connect(self.__on_change, Qt.QueuedConnection)
+        
+        # Our copy of the settings and state ( see common.py DEFAULTS for strcture)
+        # is delivered before attach returns
+        self.__settings = None
+        self.__state = None
+        self.__core.attach(self.__core_callback)
         
         # Create the configuration dialog
         self.__config_dialog = configurationdialog.ConfigurationDialog(self.__settings, self.__state[TEMPLATE], self.__config_callback)
@@ -78,17 +90,7 @@ class AntSwUI(QMainWindow):
         else:
             path = None
         self.__image_widget = graphics.HotImageWidget(path, self.__graphics_callback, self.__config_dialog.graphics_callback)
-        
-        # Create the controller API
-        if len(self.__current_template) > 0:
-            relay_state = self.__state[RELAYS][self.__current_template]
-        else:
-            relay_state = None
-        self.__api = antcontrol.AntControl(self.__settings[ARDUINO_SETTINGS][NETWORK], relay_state, self.__api_callback, self.__get_relay_state)
-        
-        # Create the external command thread
-        self.__extCmd = ExtCmdThrd(self.__extCmdCallback)
-        self.__extCmd.start()
+        self.__image_widget.dims_changed.connect(self.__on_image_dims, Qt.QueuedConnection)
         
         # Initialise the GUI
         self.initUI()
@@ -97,11 +99,8 @@ class AntSwUI(QMainWindow):
         self.show()
         self.repaint()
         
-        # Startup active
-        self.__startup = True
-        
-        # Start idle processing
-        QTimer.singleShot(IDLE_TICKER, self.__idleProcessing)
+        # Check configuration once the event loop is running
+        QTimer.singleShot(0, self.__startup_checks)
     
     def run(self, ):
         """ Run the application """
@@ -110,10 +109,6 @@ class AntSwUI(QMainWindow):
         print("Flexi-Switch running...")
         return self.__qt_app.exec_()
     
-    def __get_relay_state(self):
-        # Returne current relay state
-        return self.__state[RELAYS][self.__current_template]
-    
     # UI initialisation and window event handlers =====================================================================
     def initUI(self):
         """ Configure the GUI interface """
@@ -127,6 +122,11 @@ class AntSwUI(QMainWindow):
         self.statusmsg = QLabel('')
         self.statusbar.addPermanentWidget(self.statusmsg, stretch=1)
         self.setStatusBar(self.statusbar)
+        self.__set_online(False)
+        # Status messages are cleared after a while
+        self.__status_timer = QTimer(self)
+        self.__status_timer.setSingleShot(True)
+        self.__status_timer.timeout.connect(self.statusmsg.clear)
         
         # Set the tooltip font
         QToolTip.setFont(QFont('SansSerif', 10))
@@ -168,62 +168,48 @@ class AntSwUI(QMainWindow):
         macro_widget = QWidget()
         self.__grid.addWidget(macro_widget, 0, 0)
         macro_widget.setLayout(macro_grid)
-        # We want an array of 6 buttons for both set and execute
-        # Set and execute button groups
-        self.__set_btn_array = [None] * 6
-        self.__ex_btn_array = [None] * 6
-        # 1
-        self.__set_btn_array[0] = QPushButton('Set', self)
-        macro_grid.addWidget(self.__set_btn_array[0], 0, 0)
-        self.__set_btn_array[0].clicked.connect(self.on_set1btn)
-        self.__ex_btn_array[0] = QPushButton('1', self)
-        macro_grid.addWidget(self.__ex_btn_array[0], 1, 0)
-        self.__ex_btn_array[0].clicked.connect(self.on_ex1btn)
-        self.__ex_btn_array[0].setEnabled(False)
-        # 2
-        self.__set_btn_array[1] = QPushButton('Set', self)
-        macro_grid.addWidget(self.__set_btn_array[1], 0, 1)
-        self.__set_btn_array[1].clicked.connect(self.on_set2btn)
-        self.__ex_btn_array[1] = QPushButton('2', self)
-        macro_grid.addWidget(self.__ex_btn_array[1], 1, 1)
-        self.__ex_btn_array[1].clicked.connect(self.on_ex2btn)
-        self.__ex_btn_array[1].setEnabled(False)
-        # 3
-        self.__set_btn_array[2] = QPushButton('Set', self)
-        macro_grid.addWidget(self.__set_btn_array[2], 0, 2)
-        self.__set_btn_array[2].clicked.connect(self.on_set3btn)
-        self.__ex_btn_array[2] = QPushButton('3', self)
-        macro_grid.addWidget(self.__ex_btn_array[2], 1, 2)
-        self.__ex_btn_array[2].clicked.connect(self.on_ex3btn)
-        self.__ex_btn_array[2].setEnabled(False)
-        # 4
-        self.__set_btn_array[3] = QPushButton('Set', self)
-        macro_grid.addWidget(self.__set_btn_array[3], 0, 3)
-        self.__set_btn_array[3].clicked.connect(self.on_set4btn)
-        self.__ex_btn_array[3] = QPushButton('4', self)
-        macro_grid.addWidget(self.__ex_btn_array[3], 1, 3)
-        self.__ex_btn_array[3].clicked.connect(self.on_ex4btn)
-        self.__ex_btn_array[3].setEnabled(False)
-        # 5
-        self.__set_btn_array[4] = QPushButton('Set', self)
-        macro_grid.addWidget(self.__set_btn_array[4], 0, 4)
-        self.__set_btn_array[4].clicked.connect(self.on_set5btn)
-        self.__ex_btn_array[4] = QPushButton('5', self)
-        macro_grid.addWidget(self.__ex_btn_array[4], 1, 4)
-        self.__ex_btn_array[4].clicked.connect(self.on_ex5btn)
-        self.__ex_btn_array[4].setEnabled(False)
-        # 6
-        self.__set_btn_array[5] = QPushButton('Set', self)
-        macro_grid.addWidget(self.__set_btn_array[5], 0, 5)
-        self.__set_btn_array[5].clicked.connect(self.on_set6btn)
-        self.__ex_btn_array[5] = QPushButton('6', self)
-        macro_grid.addWidget(self.__ex_btn_array[5], 1, 5)
-        self.__ex_btn_array[5].clicked.connect(self.on_ex6btn)
-        self.__ex_btn_array[5].setEnabled(False)
+        # An array of MAX_MACROS buttons for both set and execute
+        self.__set_btn_array = []
+        self.__ex_btn_array = []
+        for macro_id in range(MAX_MACROS):
+            set_btn = QPushButton('Set', self)
+            macro_grid.addWidget(set_btn, 0, macro_id)
+            set_btn.clicked.connect(lambda checked, macro_id=macro_id: self.__do_setbtn(macro_id))
+            self.__set_btn_array.append(set_btn)
+            ex_btn = QPushButton(str(macro_id + 1), self)
+            macro_grid.addWidget(ex_btn, 1, macro_id)
+            ex_btn.clicked.connect(lambda checked, macro_id=macro_id: self.__do_exbtn(macro_id))
+            ex_btn.setEnabled(False)
+            self.__ex_btn_array.append(ex_btn)
         # Set default background
         for button_id in range(len(self.__ex_btn_array)):
             self.__ex_btn_array[button_id].setStyleSheet("QPushButton {background-color: rgb(177,177,177)}")
         
+        # Quick launch for the rest of the library, "name #tag" words find macros
+        self.__macro_index = macrolib.MacroIndex({})
+        quick_box = QHBoxLayout()
+        macro_grid.addLayout(quick_box, 2, 0, 1, MAX_MACROS)
+        self.__quick_edit = QLineEdit(self)
+        self.__quick_edit.setPlaceholderText('Macro name or #tag')
+        self.__quick_completer = QCompleter([], self)
+        self.__quick_completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.__quick_completer.setFilterMode(Qt.MatchContains)
+        self.__quick_edit.setCompleter(self.__quick_completer)
+        self.__quick_edit.returnPressed.connect(self.__do_quick_run)
+        quick_box.addWidget(self.__quick_edit)
+        self.__quick_run_btn = QPushButton('Run', self)
+        self.__quick_run_btn.setToolTip('Run the first macro found')
+        self.__quick_run_btn.clicked.connect(self.__do_quick_run)
+        quick_box.addWidget(self.__quick_run_btn)
+        self.__quick_save_btn = QPushButton('Save', self)
+        self.__quick_save_btn.setToolTip('Save the relays as the macro with this name and #tags')
+        self.__quick_save_btn.clicked.connect(self.__do_quick_save)
+        quick_box.addWidget(self.__quick_save_btn)
+        self.__quick_delete_btn = QPushButton('Delete', self)
+        self.__quick_delete_btn.setToolTip('Delete the macro with this name')
+        self.__quick_delete_btn.clicked.connect(self.__do_quick_delete)
+        quick_box.addWidget(self.__quick_delete_btn)
+        
         # Configure template indicator
         self.templatelabel = QLabel('Template: %s' % (self.__current_template))
         self.templatelabel.setStyleSheet("QLabel {color: rgb(60,60,60); font: 16px; qproperty-alignment: AlignCenter}")
@@ -284,22 +270,11 @@ Antenna Switch Controller
     def quit(self):
         """ User hit quit """
         
-        # Close external thread
-        self.__extCmd.terminate()
-        self.__extCmd.join()
-        
-        # Close API
-        self.__api.terminate()
-        
-        # Save the current settings
-        persist.saveCfg(SETTINGS_PATH, self.__settings)
-        self.__state[WINDOW] = [self.x(), self.y(), self.width(), self.height()]
-        if self.__current_template == None:
-            template = ''
-        else:
-            template = self.__current_template
-        self.__state[TEMPLATE] = template
-        persist.saveCfg(STATE_PATH, self.__state)
+        # The core saves everything else as it changes
+        self.__core.set_window([self.x(), self.y(), self.width(), self.height()])
+        # Stop the core, or just disconnect from the daemon
+        self.__core.detach(self.__core_callback)
+        self.__core.terminate()
         # Turn relays off
         #Probably not a great idea as it could remove an antenna while TXing
         # self.__api.reset_relays()
@@ -330,6 +305,7 @@ Antenna Switch Controller
         
         self.__state[WINDOW][0] = event.pos().x()
         self.__state[WINDOW][1] = event.pos().y()
+        self.__core.set_window(self.__state[WINDOW])
     
     def __configEvnt(self, event):
         """
@@ -343,73 +319,14 @@ Antenna Switch Controller
         
         # Put the graphics into config mode
         self.__image_widget.set_mode(MODE_CONFIG)
-        # Create a temporary setting structure
-        self.__temp_settings = copy.deepcopy(self.__settings)
-        self.__temp_state = copy.deepcopy(self.__state)
+        # Edits go into transactions, nothing is copied until it is changed
+        self.__settings_tx = transaction.Transaction(self.__settings)
+        self.__state_tx = transaction.Transaction(self.__state)
+        self.__config_template = self.__current_template
+        self.__config_dialog.begin(self.__settings_tx, self.__current_template)
         # Show the dialog. This makes it non-modal
         self.__config_dialog.show()
                 
-    # Macro event handlers =============================================================================================
-    def on_set1btn(self):
-        """ Set macro button 1 """
-        
-        self.__do_setbtn(0)
-    
-    def on_set2btn(self):
-        """ Set macro button 2 """
-        
-        self.__do_setbtn(1)
-    
-    def on_set3btn(self):
-        """ Set macro button 3 """
-        
-        self.__do_setbtn(2)
-    
-    def on_set4btn(self):
-        """ Set macro button 4 """
-        
-        self.__do_setbtn(3)
-    
-    def on_set5btn(self):
-        """ Set macro button 5 """
-        
-        self.__do_setbtn(4)
-    
-    def on_set6btn(self):
-        """ Set macro button 6 """
-
-        self.__do_setbtn(5)
-    
-    def on_ex1btn(self):
-        """ Execute macro button 1 """
-
-        self.__do_exbtn(0)
-        
-    def on_ex2btn(self):
-        """ Execute macro button 2 """
-        
-        self.__do_exbtn(1)
-        
-    def on_ex3btn(self):
-        """ Execute macro button 3 """
-        
-        self.__do_exbtn(2)
-        
-    def on_ex4btn(self):
-        """ Execute macro button 4 """
-        
-        self.__do_exbtn(3)
-        
-    def on_ex5btn(self):
-        """ Execute macro button 5 """
-        
-        self.__do_exbtn(4)
-        
-    def on_ex6btn(self):
-        """ Execute macro button 6 """
-        
-        self.__do_exbtn(5)
-       
     # Callback handlers ===============================================================================================
     def __config_callback(self, what, data):
         """
@@ -422,51 +339,51 @@ Antenna Switch Controller
         """
         
         if what == CONFIG_NETWORK:
-            self.__temp_settings[ARDUINO_SETTINGS][NETWORK][IP] = data[IP]
-            self.__temp_settings[ARDUINO_SETTINGS][NETWORK][PORT] = data[PORT]
-        elif what == CONFIG_EDIT_ADD_HOTSPOT:
-            self.__temp_settings[RELAY_SETTINGS] = data
-        elif what == CONFIG_DELETE_HOTSPOT:
-            self.__temp_settings[RELAY_SETTINGS] = data
+            controller, ip, port = data
+            if controller == 0:
+                self.__settings_tx.set((ARDUINO_SETTINGS, NETWORK), [ip, port])
+            else:
+                self.__settings_tx.set((ARDUINO_SETTINGS, CONTROLLERS, controller-1), [ip, port])
+        elif what == CONFIG_CONTROLLERS:
+            self.__settings_tx.set((ARDUINO_SETTINGS, NETWORK), data[0])
+            self.__settings_tx.set((ARDUINO_SETTINGS, CONTROLLERS), data[1:])
+        elif what == CONFIG_EDIT_ADD_HOTSPOT or what == CONFIG_DELETE_HOTSPOT:
+            # The dialog has changed the hotspots in the settings transaction
+            if self.__current_template in self.__settings_tx.view[RELAY_SETTINGS]:
+                self.__image_widget.config(self.__settings_tx.view[RELAY_SETTINGS][self.__current_template], self.__state_tx.view[RELAYS][self.__current_template])
         elif what == CONFIG_ACCEPT:
-            self.__settings = copy.deepcopy(self.__temp_settings)
-            self.__state = copy.deepcopy(self.__temp_state)
-            self.__temp_settings = None
-            self.__temp_state = None
-            if self.__settings[ARDUINO_SETTINGS][NETWORK][IP] != None and self.__settings[ARDUINO_SETTINGS][NETWORK][PORT] != None:
-                self.__api.resetParams(self.__settings[ARDUINO_SETTINGS][NETWORK][IP], self.__settings[ARDUINO_SETTINGS][NETWORK][PORT])
-            persist.saveCfg(SETTINGS_PATH, self.__settings)
+            # The core makes the edits and reports them back to us, but we
+            # need them now so make them to our copy as well.
+            self.__core.configure(self.__settings_tx.changes(), self.__state_tx.changes())
+            self.__core.select_template('' if self.__current_template == None else self.__current_template)
+            self.__apply(self.__settings, self.__settings_tx)
+            self.__apply(self.__state, self.__state_tx)
+            self.__settings_tx = None
+            self.__state_tx = None
             # Back into runtime with the new settings
             self.__image_widget.set_mode(MODE_RUNTIME)
-            self.__image_widget.config(self.__settings[RELAY_SETTINGS][self.__current_template], self.__state[RELAYS][self.__current_template])
+            if self.__current_template in self.__settings[RELAY_SETTINGS]:
+                self.__image_widget.config(self.__settings[RELAY_SETTINGS][self.__current_template], self.__state[RELAYS][self.__current_template])
         elif what == CONFIG_REJECT:
             # Just forget the changes
             self.__image_widget.set_mode(MODE_RUNTIME)
-            self.__temp_settings = None
-            self.__temp_state = None
+            self.__settings_tx = None
+            self.__state_tx = None
+            if self.__current_template != self.__config_template:
+                # Back to the template we started with
+                self.__set_template(self.__config_template, self.__settings, self.__state)
+            elif self.__current_template in self.__settings[RELAY_SETTINGS]:
+                self.__image_widget.config(self.__settings[RELAY_SETTINGS][self.__current_template], self.__state[RELAYS][self.__current_template])
         elif what == CONFIG_NEW_TEMPLATE:
-            current_template, relay_settings = data
-            self.__temp_settings[RELAY_SETTINGS] = relay_settings
-            for template in relay_settings:
-                if template not in self.__temp_state[RELAYS]:
-                    self.__temp_state[RELAYS][template] = {1: 'relayoff', 2: 'relayoff', 3: 'relayoff', 4: 'relayoff', 5: 'relayoff', 6: 'relayoff', 7: 'relayoff', 8: 'relayoff', 9: 'relayoff', 10: 'relayoff', 11: 'relayoff', 12: 'relayoff', 13: 'relayoff', 14: 'relayoff', 15: 'relayoff', 16: 'relayoff'}
+            relay_count = len(controllers.get_networks(self.__settings_tx.view[ARDUINO_SETTINGS])) * MAX_RLYS
+            for template in self.__settings_tx.view[RELAY_SETTINGS]:
+                if template not in self.__state_tx.view[RELAYS]:
+                    self.__state_tx.set((RELAYS, template), {relay_id: RELAY_OFF for relay_id in range(1, relay_count + 1)})
         elif what == CONFIG_SEL_TEMPLATE:
-            current_template, relay_settings = data
-            self.__current_template = current_template
-            # Set the new image
-            self.__image_widget.set_new_image(os.path.join(self.__settings[TEMPLATE_PATH], current_template))
-            # and set the hotspots 
-            self.__image_widget.config(relay_settings[current_template], self.__temp_state[RELAYS][current_template])
-            # Change the label
-            self.templatelabel.setText('Template: %s' % (self.__current_template))
-            # Set the macro buttons
-            self.__do_config_macro_buttons()
+            self.__set_template(data, self.__settings_tx.view, self.__state_tx.view)
         elif what == CONFIG_DEL_TEMPLATE:
-            current_template, relay_settings = data
-            self.__temp_settings[RELAY_SETTINGS] = relay_settings
             # Delete the state for this template
-            if current_template in self.__temp_state[RELAYS]:
-                del self.__temp_state[RELAYS][current_template]
+            self.__state_tx.delete((RELAYS, data))
             # Another template should immediately be selected (if there is one)
             self.__current_template = ''
             
@@ -481,123 +398,256 @@ Antenna Switch Controller
         """
         
         if what == RUNTIME_RELAY_UPDATE:
-            # Set the relay
-            self.__api.set_relay(data[0], data[1])
+            # Set the relay, the engine will report completion
+            relay_id, contact_state = data
+            self.__core.set_relay(relay_id, contact_state)
             # Remove macro button highlight
             # Set default background
             for button_id in range(len(self.__ex_btn_array)):
                 self.__ex_btn_array[button_id].setStyleSheet("QPushButton {background-color: rgb(177,177,177)}")
             
-    def __api_callback(self, online, message):
+    def __core_callback(self, event, data):
         
         """
-        Callback from API. Note that this is not called from
-        the main thread and therefore we just set a status which
-        is picked up in the idle loop for display.
+        Callback from the core. Note that this is mostly not called
+        from the main thread and therefore we just emit a signal
+        which is delivered on the main thread.
         Qt calls MUST be made from the main thread.
         
         Arguments:
-            online  --  true if connected
-            message --  text to drive the status messages
+            event   --  CORE_ event type
+            data    --  associated data, event specific
             
         """
-    
-        if online:
-            self.__online = True
-        else:
-            self.__online = False
         
+        if event == CORE_SNAPSHOT:
+            # Only sent while attaching, on the main thread
+            self.__settings, self.__state = data
+        elif event == CORE_STATUS:
+            self.__signals.status.emit(*data)
+        elif event == CORE_COMPLETED:
+            self.__signals.completed.emit(*data)
+        elif event == CORE_MESSAGE:
+            self.__signals.message.emit(data)
+        elif event == CORE_CHANGE:
+            self.__signals.change.emit(*data)
+        elif event == CORE_MACRO:
+            self.__signals.macro.emit(*data)
+        elif event == CORE_TX:
+            self.__signals.tx.emit(*data)
+
+    # Signal handlers (main thread) ===================================================================================
+    def __engine_completed(self, cmd_id, success, message):
+
+        """
+        A relay command has completed.
+
+        Arguments:
+            cmd_id  --  id returned when the command was queued
+            success --  True if the Arduino acknowledged the command
+            message --  text to drive the status messages
+
+        """
+
+        if not success:
+            self.__set_status_message(message)
+
+    def __on_status(self, online, message):
+
+        """
+        Connection state or status message from the engine.
+
+        Arguments:
+            online  --  true if connected
+            message --  text to drive the status messages
+
+        """
+
+        self.__set_online(online)
         if len(message) > 0:
-            self.__statusMessage = message
+            self.__set_status_message(message)
+
+    def __on_macro(self, macro_id, switched, saved):
+
+        """
+        A macro has been executed, from here or elsewhere.
+
+        Arguments:
+            macro_id    --  0 based macro id
+            switched    --  relays it changed
+            saved       --  relays it left as they were
+
+        """
+
+        self.__set_status_message('Macro %d: %d relays switched, %d already set' % (macro_id + 1, switched, saved))
+
+        # Adjust button background
+        for button_id in range(len(self.__ex_btn_array)):
+            if button_id == macro_id:
+                # Set background to selected
+                self.__ex_btn_array[button_id].setStyleSheet("QPushButton {background-color: rgb(240,78,0)}")
+            else:
+                self.__ex_btn_array[button_id].setStyleSheet("QPushButton {background-color: rgb(177,177,177)}")
+
+    def __on_tx(self, transmitting, held, holdtime):
+
+        """
+        The transmitter state has changed.
+
+        Arguments:
+            transmitting    --  true while PTT is asserted
+            held            --  relay changes held
+            holdtime        --  seconds they have been held
+
+        """
+
+        if transmitting:
+            self.__set_status_message('Transmitting, %d relay changes held' % held)
+        elif held > 0:
+            self.__set_status_message('Receiving, %d relay changes held for %.1fs made' % (held, holdtime))
+
+    def __on_change(self, cfg, entry):
+
+        """
+        The core has changed the settings or state.
+        Keep our copy the same and show the change.
+
+        Arguments:
+            cfg     --  CORE_SETTINGS | CORE_STATE
+            entry   --  (keys, value) or (keys,) to delete
+
+        """
+
+        if cfg == CORE_SETTINGS:
+            persist.apply_change(self.__settings, entry)
+        else:
+            persist.apply_change(self.__state, entry)
+        if self.__settings_tx != None:
+            # The configurator is showing its own edits
+            return
+        keys = entry[0]
+        if cfg == CORE_SETTINGS:
+            if keys[0] == RELAY_SETTINGS and (len(keys) == 1 or keys[1] == self.__current_template):
+                self.__set_template(self.__current_template, self.__settings, self.__state)
+        elif keys[0] == TEMPLATE:
+            if entry[1] != self.__current_template:
+                self.__set_template(entry[1], self.__settings, self.__state)
+        elif keys[0] == RELAYS and (len(keys) == 1 or keys[1] == self.__current_template):
+            if len(keys) > 2 and len(entry) > 1:
+                # Our copy and the widget share the relay states
+                self.__image_widget.set_relay_state(keys[2], entry[1])
+            elif self.__current_template in self.__settings[RELAY_SETTINGS]:
+                # A new relay state dictionary
+                self.__image_widget.config(self.__settings[RELAY_SETTINGS][self.__current_template], self.__state[RELAYS][self.__current_template])
+        elif keys[0] == MACROS:
+            self.__do_config_macro_buttons()
+
+    def __on_image_dims(self, width, height):
+
+        """
+        The template image size has changed.
+        Adjust the window size to accommodate the image.
+
+        Arguments:
+            width   --  new image width
+            height  --  new image height
 
-    def __extCmdCallback(self, macroId):
-        
         """
-        Callback from the external command thread.
-        We have been asked to execute a macro switch command.
+
+        if width > 0 and height > 0:
+            current_width = self.__grid.cellRect(3,0).width()
+            current_height = self.__grid.cellRect(3,0).height()
+            if width != current_width or height != current_height:
+                self.__state[WINDOW][W] = self.width() + (width - current_width)
+                self.__state[WINDOW][H] = self.height() + (height - current_height)
+                self.setGeometry(self.__state[WINDOW][X], self.__state[WINDOW][Y], self.__state[WINDOW][W], self.__state[WINDOW][H])
+                self.setFixedSize(self.__state[WINDOW][W], self.__state[WINDOW][H])
+                self.__core.set_window(self.__state[WINDOW])
+
+    def __startup_checks(self):
+
+        """ Check we have enough configuration to run """
+
+        settings = True
+        msg = ''
+        if self.__settings[ARDUINO_SETTINGS][NETWORK][IP] == None:
+            settings = False
+            msg = 'Please configure the Arduino network settings.'
+        if len(self.__settings[RELAY_SETTINGS]) == 0:
+            settings = False
+            msg += '\nPlease configure the relay settings.'
+        if not settings:
+            # We have no settings so user must configure first
+            QMessageBox.information(self, 'Configuration Required', msg, QMessageBox.Ok)
+    
+    # Helpers =========================================================================================================
+    def __apply(self, cfg, tx):
+        """
+        Make the edits in a configuration transaction to our copy
         
         Arguments:
-            macroId --  id of the macro to execute
+            cfg     --  our settings or state
+            tx      --  the finished transaction, its values become ours
             
         """
         
-        self.__doMacro = macroId
-        
-    # Idle time processing ============================================================================================        
-    def __idleProcessing(self):
+        for change in tx.changes():
+            persist.apply_change(cfg, change)
+    
+    def __set_template(self, template, settings, state):
+        """
+        Show a template
         
+        Arguments:
+            template    --  template file name
+            settings    --  settings to take the hotspots from
+            state       --  state to take the relay states from
+            
         """
-        Idle processing.
-        Called every 100ms single shot
         
+        self.__current_template = template
+        if template == None or template not in settings[RELAY_SETTINGS]:
+            return
+        # Set the new image
+        self.__image_widget.set_new_image(os.path.join(settings[TEMPLATE_PATH], template))
+        # and set the hotspots 
+        self.__image_widget.config(settings[RELAY_SETTINGS][template], state[RELAYS][template])
+        # Change the label
+        self.templatelabel.setText('Template: %s' % (template))
+        # Set the macro buttons
+        self.__do_config_macro_buttons()
+    
+    def __set_online(self, online):
         """
+        Show the connection state
         
-        # Check if we need to clear status message
-        if (self.__lastStatus == self.__statusMessage) and len(self.__statusMessage) > 0:
-            self.__tickcount += 1
-            if self.__tickcount >= TICKS_TO_CLEAR:
-                self.__tickcount = 0
-                self.__statusMessage = ''
-        else:
-            self.__tickcount = 0
-            self.__lastStatus = self.__statusMessage
-        
-        # Main idle processing        
-        if self.__startup:
-            # Startup ====================================================
-            self.__startup = False
-            # Initialise state if required
-            
-            # Check startup conditions
-            settings = True
-            msg = ''
-            if self.__settings[ARDUINO_SETTINGS][NETWORK][IP] == None:
-                settings = False
-                msg = 'Please configure the Arduino network settings.'
-            if len(self.__settings[RELAY_SETTINGS]) == 0:
-                settings = False
-                msg += '\nPlease configure the relay settings.'
-            if not settings:
-                # We have no settings so user must configure first
-                QMessageBox.information(self, 'Configuration Required', msg, QMessageBox.Ok)
+        Arguments:
+            online  --  true if connected
             
-            # Make sure the status gets cleared and we poll straight away
-            self.__tickcount = TICKS_TO_CLEAR
-            self.__pollcount = POLL_TICKS
+        """
+        
+        if online == self.__online:
+            return
+        self.__online = online
+        if online:
+            self.statusmon.setText('Connected')
+            self.statusmon.setStyleSheet("QLabel {color: green;font: bold 12px}")
         else:
-            # Runtime ====================================================
-            # Window size
-            width, height = self.__image_widget.get_dims()
-            if width != None and height != None:
-                if width > 0 and height > 0:
-                    # We adjust the window size if necessary to accommodate the image size
-                    current_width = self.__grid.cellRect(3,0).width()
-                    current_height = self.__grid.cellRect(3,0).height()
-                    if width != current_width or height != current_height:
-                        self.__state[WINDOW][W] = self.width() + (width - current_width)
-                        self.__state[WINDOW][H] = self.height() + (height - current_height)
-                        self.setGeometry(self.__state[WINDOW][X], self.__state[WINDOW][Y], self.__state[WINDOW][W], self.__state[WINDOW][H])
-                        self.setFixedSize(self.__state[WINDOW][W], self.__state[WINDOW][H])
-                        
-            # Update online state
-            # Status bar
-            self.statusmsg.setText(self.__statusMessage)
-            if self.__online:
-                self.statusmon.setText('Connected')
-                self.statusmon.setStyleSheet("QLabel {color: green;font: bold 12px}")
-            else:
-                self.statusmon.setText('Disconnected')
-                self.statusmon.setStyleSheet("QLabel {color: red;font: bold 12px}")
-                
-            # Check for macro execution
-            if self.__doMacro != None:
-                self.__do_exbtn(self.__doMacro)
-                self.__doMacro = None
+            self.statusmon.setText('Disconnected')
+            self.statusmon.setStyleSheet("QLabel {color: red;font: bold 12px}")
+    
+    def __set_status_message(self, message):
+        """
+        Show a status message which clears itself after STATUS_CLEAR ms
+        
+        Arguments:
+            message --  text to display
             
-        # Set next idle time    
-        QTimer.singleShot(IDLE_TICKER, self.__idleProcessing)
+        """
+        
+        self.statusmsg.setText(message)
+        self.__status_timer.start(STATUS_CLEAR)
     
-    # Helpers =========================================================================================================
     def __setButtonState(self, enabled, widgets):
         """
         Set enabled/disabled state
@@ -617,134 +667,128 @@ Antenna Switch Controller
     def __do_config_macro_buttons(self, ):
         """
         Enable macro buttons if macros are defined for the current template.
-        Set the button tooltips.
+        Set the button tooltips and the quick launch names.
         
         """
         
-        if self.__current_template in self.__state[MACROS]:
-            macro_data = self.__state[MACROS][self.__current_template]
-            for macro_index in range(MAX_MACROS):
-                if macro_index in macro_data:
-                    self.__ex_btn_array[macro_index].setEnabled(True)
-                    self.__ex_btn_array[macro_index].setToolTip(macro_data[macro_index][TT])
-                else:
-                    self.__ex_btn_array[macro_index].setEnabled(False)
-                    self.__ex_btn_array[macro_index].setToolTip('')
-        else:
-            for macro_index in range(MAX_MACROS):
-                self.__ex_btn_array[macro_index].setEnabled(False)
-                self.__ex_btn_array[macro_index].setToolTip('')
+        macro_data = self.__state[MACROS].get(self.__current_template, {})
+        for macro_id in range(MAX_MACROS):
+            if macro_id in macro_data:
+                self.__ex_btn_array[macro_id].setEnabled(True)
+                self.__ex_btn_array[macro_id].setToolTip(macrolib.label(macro_data[macro_id]))
+            else:
+                self.__ex_btn_array[macro_id].setEnabled(False)
+                self.__ex_btn_array[macro_id].setToolTip('')
+        self.__macro_index = macrolib.MacroIndex(macro_data)
+        self.__quick_completer.model().setStringList([macrolib.label(macro_data[macro_id]) for macro_id in sorted(macro_data)])
            
-    def __do_setbtn(self, macro_index):
+    def __do_setbtn(self, macro_id):
         """
         Save the configuration for the given button
         
         Arguments:
-            macro_index   --  0-6 index of macro button
+            macro_id    --  0 based macro id of the button
             
         """
         
-        # We take the current relay states and save them
+        # Get the name and any tags
+        text, ok = QInputDialog.getText(self, "Configure Button", "Description #tags ")
+        if not ok:
+            text = ''
+        name, tags = macrolib.parse(text)
+        self.__ex_btn_array[macro_id].setToolTip(text)
+        # The core takes the current relay states and saves them
         # in the state record for this macro id.
-        if self.__current_template not in self.__state[MACROS]:
-            self.__state[MACROS][self.__current_template] = {}
-        # Create/update the macro data
-        self.__state[MACROS][self.__current_template][macro_index] = copy.deepcopy(self.__state[RELAYS][self.__current_template])            
-        # Set the tooltip
-        tooltip, ok = QInputDialog.getText(self, "Configure Button", "Description ")
-        if ok and len(tooltip) > 0:
-            self.__ex_btn_array[macro_index].setToolTip(tooltip)
-            self.__state[MACROS][self.__current_template][macro_index][TT] = tooltip
-        else:
-            self.__ex_btn_array[macro_index].setToolTip('')
-            self.__state[MACROS][self.__current_template][macro_index][TT] = ''
+        self.__core.set_macro(macro_id, name, tags)
         # Enable the execute button
-        self.__ex_btn_array[macro_index].setEnabled(True)
+        self.__ex_btn_array[macro_id].setEnabled(True)
         
-    def __do_exbtn(self, macro_index):
+    def __do_exbtn(self, macro_id):
         """
         Execute the configuration for the given button
         
         Arguments:
-            macro_index   --  0-6 index of macro button
+            macro_id    --  0 based macro id of the button
             
         """
         
-        # Change the relay state to agree with the macro settings
-        macro_data = self.__state[MACROS][self.__current_template][macro_index]
-        for relay_id in range(1, MAX_RLYS-1):
-            # Set relay ID n
-            if relay_id in macro_data:
-                self.__image_widget.set_relay_state(relay_id, macro_data[relay_id])
-                self.__api.set_relay(relay_id, macro_data[relay_id])
-                self.__state[RELAYS][self.__current_template][relay_id] = macro_data[relay_id]
-                sleep(0.3)
-        # Adjust button background
-        for button_id in range(len(self.__ex_btn_array)):
-            if button_id == macro_index:
-                # Set background to selected
-                self.__ex_btn_array[button_id].setStyleSheet("QPushButton {background-color: rgb(240,78,0)}")
-            else:
-                self.__ex_btn_array[button_id].setStyleSheet("QPushButton {background-color: rgb(177,177,177)}")
+        # The core changes the relay state to agree with the macro settings,
+        # then the relay states and button highlight follow from its events
+        self.__core.execute_macro(macro_id)
+        
+    def __do_quick_run(self):
+        """ Run the macro named in the quick launch box, or the first one its words find """
+        
+        name, tags = macrolib.parse(self.__quick_edit.text())
+        macro_id = self.__macro_index.find(name)
+        if macro_id == None:
+            found = self.__macro_index.search(self.__quick_edit.text())
+            if len(found) == 0:
+                self.__set_status_message('No macro matches %s' % self.__quick_edit.text())
+                return
+            macro_id = found[0]
+        self.__core.execute_macro(macro_id)
+        
+    def __do_quick_save(self):
+        """ Save the relay states as the macro named in the quick launch box """
+        
+        name, tags = macrolib.parse(self.__quick_edit.text())
+        if len(name) == 0:
+            self.__set_status_message('Type a name for the macro first')
+            return
+        # The core saves over a macro with this name or adds one
+        self.__core.set_macro(None, name, tags)
+        
+    def __do_quick_delete(self):
+        """ Delete the macro named in the quick launch box """
+        
+        name, tags = macrolib.parse(self.__quick_edit.text())
+        macro_id = self.__macro_index.find(name)
+        if macro_id == None:
+            self.__set_status_message('No macro named %s' % name)
+            return
+        self.__core.delete_macro(macro_id)
+        self.__quick_edit.clear()
         
 
 """
-
-External command thread.
-Receive switch commands from an external program.
-
+Signals from worker threads to the main thread
 """
-class ExtCmdThrd (threading.Thread):
-    
-    def __init__(self, callback):
-        """
-        Constructor
-        
-        Arguments
-            callback    -- callback here for macro execution
-        """
+class WorkerSignals(QObject):
 
-        super(ExtCmdThrd, self).__init__()
-        
-        self.__callback = callback
-        
-        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.__sock.bind((EXT_UDP_IP, EXT_UDP_PORT))
-        self.__sock.settimeout(3)
-        
-        self.__terminate = False
-    
-    def terminate(self):
-        """ Terminate thread """
-        
-        self.__terminate = True
-        
-    def run(self):
-        # We listen on UDP for switch commands
-        while not self.__terminate:
-            try:
-                data, addr = self.__sock.recvfrom(1024) # buffer size is 1024 bytes
-            except socket.timeout:
-                continue
-            asciidata = data.decode(encoding='UTF-8')
-            try:
-                if 'switch' in asciidata:
-                    _, macroId = asciidata.split(':')
-                    # The call is zero based but the UI is 1 based
-                    macroId = int(macroId) - 1
-                    self.__callback(macroId)
-            except Exception as e:
-                self.__statusMessage = 'Ext cmd failed: {0}'.format(e)   
+    # Relay command complete: cmd_id, success, message
+    completed = pyqtSignal(int, bool, str)
+    # Engine status: online, message
+    status = pyqtSignal(bool, str)
+    # Macro executed: macro id, relays switched, relays already set
+    macro = pyqtSignal(int, int, int)
+    # PTT changed: transmitting, relay changes held, seconds held
+    tx = pyqtSignal(bool, int, float)
+    # Status bar message
+    message = pyqtSignal(str)
+    # Settings or state change: CORE_SETTINGS | CORE_STATE, (keys, value) or (keys,)
+    change = pyqtSignal(str, object)
 
 #======================================================================================================================
 # Main code
 def main():
     
     try:
+        parser = argparse.ArgumentParser(description='Antenna switch')
+        parser.add_argument('--attach', metavar='IP[:PORT]', help='attach to the switch daemon rather than run the switch here')
+        # Anything else is for Qt
+        args, qt_args = parser.parse_known_args()
         # The one and only QApplication 
-        qt_app = QApplication(sys.argv)
+        qt_app = QApplication(sys.argv[:1] + qt_args)
+        # The switch
+        if args.attach == None:
+            core = switchcore.SwitchCore(error_callback = lambda message: QMessageBox.information(None, 'Configuration File', message, QMessageBox.Ok))
+        else:
+            ip, _, port = args.attach.partition(':')
+            core = coreclient.CoreClient(ip, int(port) if len(port) > 0 else CORE_PORT)
+        core.start()
         # Create instance
-        ant_sw_ui = AntSwUI(qt_app)
+        ant_sw_ui = AntSwUI(qt_app, core)
         # Run application loop
         sys.exit(ant_sw_ui.run())
         
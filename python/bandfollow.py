@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#
+# bandfollow.py
+#
+# Band following for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+import bisect
+
+"""
+
+Band index.
+Finds the rule for a frequency with one binary search. A rule is
+[low Hz, high Hz, macro name], both edges in the band. Rules may not
+overlap.
+
+"""
+class BandIndex:
+
+    def __init__(self, rules):
+        """
+        Constructor
+
+        Arguments
+            rules   --  [[low Hz, high Hz, macro name], ...] in any order
+
+        Raises ValueError if two rules overlap
+        """
+
+        self.__rules = sorted(tuple(rule) for rule in rules)
+        for previous, rule in zip(self.__rules, self.__rules[1:]):
+            if rule[0] <= previous[1]:
+                raise ValueError('Band rules %s and %s overlap' % (previous[2], rule[2]))
+        self.__lows = [rule[0] for rule in self.__rules]
+
+    def find(self, freq):
+        """
+        Return the rule as (low, high, macro name) for a frequency or None
+
+        Arguments:
+            freq    --  Hz
+
+        """
+
+        index = bisect.bisect_right(self.__lows, freq) - 1
+        if index >= 0 and freq <= self.__rules[index][1]:
+            return self.__rules[index]
+        return None
+
+"""
+
+Band follower.
+Runs a macro when the rig moves into a band, using the rules for the
+template in use from settings[BAND_SETTINGS][BAND_RULES]. The frequency
+comes from polling a rigctld, when settings[BAND_SETTINGS][BAND_RIG] gives
+one, and from datagrams on BAND_UDP_PORT holding "<Hz>" or, as rigctl
+would send it, "F <Hz>".
+
+A sweep across the bands should not chatter the relays. The band in use
+is kept until the frequency is BAND_HYSTERESIS beyond its edges, a new
+band must be held for BAND_DWELL and switches are at least
+BAND_MIN_INTERVAL apart. Between bands nothing changes.
+
+The macro is run through the external command queue so it is ordered,
+and coalesced, with every other external command.
+
+"""
+class BandFollower (threading.Thread):
+
+    def __init__(self, dispatch, message):
+        """
+        Constructor
+
+        Arguments
+            dispatch    -- dispatch(text) queues external commands
+            message     -- message(text) for the user
+        """
+
+        super(BandFollower, self).__init__()
+
+        self.__dispatch = dispatch
+        self.__message = message
+
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.bind((BAND_UDP_IP, BAND_UDP_PORT))
+        self.__sock.setblocking(False)
+        # Connection to rigctld when there is one
+        self.__rig = None
+        self.__rig_address = None
+        self.__rig_due = 0
+        # Only say once that the rig cannot be read
+        self.__rig_failed = False
+
+        # Held while the rules are changed or used
+        self.__lock = threading.Lock()
+        self.__band_settings = {BAND_RIG: None, BAND_RULES: {}}
+        self.__template = ''
+        self.__index = BandIndex([])
+        # Rule in use, the one waiting for its dwell and when it was first seen
+        self.__band = None
+        self.__candidate = None
+        self.__candidate_time = 0
+        self.__last_switch = 0
+        # Last frequency seen and bands switched to
+        self.freq = None
+        self.switches = 0
+
+        self.__terminate = False
+
+    # Core listener (any thread) ======================================================================================
+    def event(self, event, data):
+        """
+        Keep up with the rules and the template in use
+
+        Arguments:
+            event   --  CORE_ event type
+            data    --  associated data, event specific
+
+        """
+
+        if event == CORE_SNAPSHOT:
+            settings, state = data
+            with self.__lock:
+                self.__band_settings = copy.deepcopy(settings[BAND_SETTINGS])
+                self.__template = state[TEMPLATE]
+                self.__new_rules()
+        elif event == CORE_CHANGE:
+            cfg, entry = data
+            keys = entry[0]
+            with self.__lock:
+                if cfg == CORE_SETTINGS and keys[0] == BAND_SETTINGS:
+                    if len(keys) == 1:
+                        self.__band_settings = copy.deepcopy(entry[1])
+                    else:
+                        persist.apply_change(self.__band_settings, (keys[1:],) + tuple(copy.deepcopy(entry[1:])))
+                    self.__new_rules()
+                elif cfg == CORE_STATE and keys[0] == TEMPLATE:
+                    self.__template = entry[1]
+                    self.__new_rules()
+
+    # Thread entry point ==============================================================================================
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate = True
+
+    def run(self):
+        while not self.__terminate:
+            readable, _, _ = select.select([self.__sock], [], [], self.__wait())
+            if len(readable) > 0:
+                try:
+                    data, addr = self.__sock.recvfrom(1024)
+                    self.__frequency(float(data.decode(encoding='UTF-8').split()[-1]))
+                except (socket.error, ValueError, IndexError):
+                    pass
+            self.__poll_rig()
+            with self.__lock:
+                self.__switch()
+        self.__close_rig()
+        self.__sock.close()
+
+    # Helpers =========================================================================================================
+    def __new_rules(self):
+        # The rules or template have changed, lock is held
+        try:
+            self.__index = BandIndex(self.__band_settings.get(BAND_RULES, {}).get(self.__template, []))
+        except (ValueError, TypeError, IndexError) as e:
+            self.__index = BandIndex([])
+            self.__message('Band rules for %s not used: %s' % (self.__template, str(e)))
+        self.__band = None
+        self.__candidate = None
+
+    def __wait(self):
+        # Seconds until there may be something to do
+        wait = RIG_POLL_INTERVAL
+        with self.__lock:
+            if self.__candidate != None:
+                due = max(self.__candidate_time + BAND_DWELL, self.__last_switch + BAND_MIN_INTERVAL)
+                wait = min(wait, due - time.time())
+        return max(wait, 0.01)
+
+    def __frequency(self, freq):
+        """
+        A new frequency from the rig
+
+        Arguments:
+            freq    --  Hz
+
+        """
+
+        with self.__lock:
+            self.freq = freq
+            band = self.__band
+            if band != None and band[0] - BAND_HYSTERESIS <= freq <= band[1] + BAND_HYSTERESIS:
+                # Still in the band in use
+                self.__candidate = None
+                return
+            wanted = self.__index.find(freq)
+            if wanted == None:
+                # Between bands, leave the relays alone
+                self.__band = None
+                self.__candidate = None
+            elif wanted != self.__candidate:
+                self.__candidate = wanted
+                self.__candidate_time = time.time()
+
+    def __switch(self):
+        # Switch to the waiting band once it is due, lock is held
+        now = time.time()
+        if self.__candidate == None or now < self.__candidate_time + BAND_DWELL or now < self.__last_switch + BAND_MIN_INTERVAL:
+            return
+        self.__band, self.__candidate = self.__candidate, None
+        self.__last_switch = now
+        self.switches += 1
+        self.__dispatch('macro:%s' % self.__band[2])
+
+    def __poll_rig(self):
+        # Ask rigctld for the frequency when due
+        with self.__lock:
+            address = self.__band_settings.get(BAND_RIG)
+        address = tuple(address) if address != None else None
+        if address != self.__rig_address:
+            self.__close_rig()
+            self.__rig_address = address
+            self.__rig_due = 0
+            self.__rig_failed = False
+        if address == None or time.time() < self.__rig_due:
+            return
+        self.__rig_due = time.time() + RIG_POLL_INTERVAL
+        try:
+            if self.__rig == None:
+                self.__rig = socket.create_connection((address[0], int(address[1])), RIG_POLL_INTERVAL)
+            self.__rig.sendall(b'f\n')
+            reply = b''
+            while not reply.endswith(b'\n'):
+                data = self.__rig.recv(256)
+                if len(data) == 0:
+                    raise socket.error('rigctld closed the connection')
+                reply += data
+            self.__frequency(float(reply.split()[0]))
+            self.__rig_failed = False
+        except (socket.error, ValueError, IndexError) as e:
+            if not self.__rig_failed:
+                self.__message('No frequency from rigctld at %s:%s [%s]' % (address[0], address[1], str(e)))
+                self.__rig_failed = True
+            self.__close_rig()
+            self.__rig_due = time.time() + RIG_RETRY
+
+    def __close_rig(self):
+        # Drop the rigctld connection
+        if self.__rig != None:
+            try:
+                self.__rig.close()
+            except socket.error:
+                pass
+            self.__rig = None
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+#
+# benchmark.py
+#
+# Relay command benchmarks for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+import argparse
+import emulator
+
+"""
+
+Benchmarks the client stack against local Arduino emulators.
+Each scenario starts one emulator per controller, connects a
+ControllerRegistry to them and measures:
+    1.  Relay change latency, one relay at a time waiting for each to complete.
+    2.  Macro completion time, every relay on every controller in one vector.
+    3.  Throughput, single relay changes queued as fast as possible.
+
+"""
+
+# name : emulator keyword arguments
+SCENARIOS = {
+    'ideal':    {'loop_delay': 0},
+    'sketch':   {},
+    'lossy':    {'loss': 0.1},
+    'jitter':   {'latency': 0.005, 'jitter': 0.02, 'reorder': 0.1},
+}
+SCENARIO_ORDER = ['ideal', 'sketch', 'lossy', 'jitter']
+
+# Base port for the emulators
+BENCH_PORT = 18888
+# Give up waiting for a completion after
+BENCH_TIMEOUT = 10.0 # s
+
+"""
+Collects completions from the registry
+"""
+class Completions:
+
+    def __init__(self):
+        """ Constructor """
+
+        self.__cv = threading.Condition()
+        # {cmd_id: (success, time), ...}
+        self.__done = {}
+
+    def callback(self, cmd_id, success, message):
+        """ Completion callback, engine thread """
+
+        with self.__cv:
+            self.__done[cmd_id] = (success, time.time())
+            self.__cv.notify_all()
+
+    def wait(self, cmd_ids, timeout = BENCH_TIMEOUT):
+        """
+        Wait for a set of commands to complete
+
+        Arguments:
+            cmd_ids --  ids to wait for
+            timeout --  overall timeout in seconds
+
+        Returns {cmd_id: (success, time)} for those that completed
+
+        """
+
+        deadline = time.time() + timeout
+        with self.__cv:
+            while not all(cmd_id in self.__done for cmd_id in cmd_ids):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__cv.wait(remaining)
+            return {cmd_id: self.__done.pop(cmd_id) for cmd_id in cmd_ids if cmd_id in self.__done}
+
+def summary(samples):
+    """
+    Return a min/median/p95/max string for a list of seconds
+
+    Arguments:
+        samples --  list of durations
+
+    """
+
+    if len(samples) == 0:
+        return 'no samples'
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return 'min %7.1f  median %7.1f  p95 %7.1f  max %7.1f ms' % (
+        samples[0] * 1000, samples[len(samples)//2] * 1000, p95 * 1000, samples[-1] * 1000)
+
+def run_scenario(name, n_controllers, iterations):
+    """
+    Run all benchmarks for one scenario
+
+    Arguments:
+        name            --  key into SCENARIOS
+        n_controllers   --  number of emulated controllers
+        iterations      --  repeats of each measurement
+
+    """
+
+    emulators = []
+    for controller in range(n_controllers):
+        em = emulator.ArduinoEmulator(port = BENCH_PORT + controller, **SCENARIOS[name])
+        em.start()
+        emulators.append(em)
+    networks = [[emulator.EMULATOR_IP, str(BENCH_PORT + controller)] for controller in range(n_controllers)]
+    completions = Completions()
+    online = threading.Event()
+    registry = controllers.ControllerRegistry(networks, lambda state, message: online.set() if state else None, completions.callback)
+    registry.start()
+    online.wait(BENCH_TIMEOUT)
+    relay_count = registry.relay_count()
+
+    print('\n%s: %d controller(s) %s' % (name, n_controllers, SCENARIOS[name]))
+    try:
+        # Relay change latency
+        latencies = []
+        failed = 0
+        for i in range(iterations):
+            relay_id = i % relay_count + 1
+            start = time.time()
+            cmd_id = registry.set_relay(relay_id, RELAY_ON if (i // relay_count) % 2 == 0 else RELAY_OFF)
+            result = completions.wait([cmd_id])
+            if cmd_id in result and result[cmd_id][0]:
+                latencies.append(result[cmd_id][1] - start)
+            else:
+                failed += 1
+        print('  relay change    %s  (%d failed)' % (summary(latencies), failed))
+
+        # Macro completion
+        times = []
+        failed = 0
+        for i in range(iterations):
+            contact_state = RELAY_ON if i % 2 == 0 else RELAY_OFF
+            start = time.time()
+            cmd_id = registry.set_relays([(relay_id, contact_state) for relay_id in range(1, relay_count + 1)])
+            result = completions.wait([cmd_id])
+            if cmd_id in result and result[cmd_id][0]:
+                times.append(result[cmd_id][1] - start)
+            else:
+                failed += 1
+        print('  macro (%3d rly) %s  (%d failed)' % (relay_count, summary(times), failed))
+
+        # Throughput
+        executed = sum(em.executed for em in emulators)
+        start = time.time()
+        cmd_ids = []
+        for i in range(iterations * 10):
+            cmd_id = registry.set_relay(i % relay_count + 1, RELAY_ON if i % 2 == 0 else RELAY_OFF)
+            if cmd_id != None:
+                cmd_ids.append(cmd_id)
+        result = completions.wait(cmd_ids)
+        elapsed = time.time() - start
+        ok = len([r for r in result.values() if r[0]])
+        datagrams = sum(em.executed for em in emulators) - executed
+        print('  throughput      %7.1f changes/s, %d of %d completed in %d datagrams' % (ok / elapsed, ok, iterations * 10, datagrams))
+    finally:
+        registry.terminate()
+        registry.join()
+        for em in emulators:
+            em.terminate()
+        for em in emulators:
+            em.join()
+
+#======================================================================================================================
+# Main code
+def main():
+
+    try:
+        parser = argparse.ArgumentParser(description='Antenna switch relay benchmarks')
+        parser.add_argument('--scenario', choices=SCENARIO_ORDER, action='append', help='scenario to run, default all')
+        parser.add_argument('--controllers', type=int, default=1, help='number of emulated controllers')
+        parser.add_argument('--iterations', type=int, default=20, help='repeats of each measurement')
+        args = parser.parse_args()
+
+        for name in args.scenario or SCENARIO_ORDER:
+            run_scenario(name, args.controllers, args.iterations)
+
+    except Exception as e:
+        print ('Exception [%s][%s]' % (str(e), traceback.format_exc()))
+
+# Entry point
+if __name__ == '__main__':
+    main()
@@ -24,7 +24,7 @@
 #
 
 # All imports
-from imports import *
+from coreimports import *
 
 # Application imports
 
@@ -33,18 +33,29 @@ from imports import *
 
 # Constants for settings
 TEMPLATE_PATH = 'templatepath'
+BAND_SETTINGS = 'bandsettings'
+BAND_RIG = 'bandrig'
+BAND_RULES = 'bandrules'
+INTERLOCK_SETTINGS = 'interlocksettings'
+INTERLOCK_EXCLUSIVE = 'exclusive'
+INTERLOCK_FORBID = 'forbid'
 IMAGE = 'image'
 ARDUINO_SETTINGS = 'arduinosettings'
 NETWORK = 'network'
+CONTROLLERS = 'controllers'
 WINDOW = 'window'
 TEMPLATE = 'template'
 RELAYS = 'relays'
 MACROS = 'macros'
-TT = 0  # Tooltip for macro
+TT = 0  # Tooltip for macro, before version 2
+MACRO_NAME = 'name'
+MACRO_TAGS = 'tags'
+MACRO_MASK = 'mask'
+MACRO_ON = 'on'
 RELAY_OFF = 'relayoff'
 RELAY_ON = 'relayon'
-MAX_RLYS = 16
-MAX_MACROS = 6
+MAX_RLYS = 16   # Per controller
+MAX_MACROS = 6   # Macro buttons, the library has any number
 
 # Index into comms parameters
 IP = 0
@@ -58,12 +69,14 @@ H = 3
 
 # Config events
 CONFIG_NETWORK = 'confignetwork'
+CONFIG_CONTROLLERS = 'configcontrollers'
 RELAY_SETTINGS = 'relaysettings'
 CONFIG_HOTSPOT_TOPLEFT = 'confighotspottopleft'
 CONFIG_HOTSPOT_BOTTOMRIGHT = 'confighotspotbottomright'
 CONFIG_HOTSPOT_COMMON = 'confighotspotcommon'
 CONFIG_HOTSPOT_NO = 'confighotspotno'
 CONFIG_HOTSPOT_NC = 'confighotspotnc'
+CONFIG_RELAY_SETTLE = 'configrelaysettle'
 CONFIG_EDIT_ADD_HOTSPOT = 'configeditaddhotspot'
 CONFIG_DELETE_HOTSPOT = 'configdeletehotspot'
 CONFIG_ACCEPT = 'configaccept'
@@ -89,17 +102,34 @@ DEFAULT_SETTINGS = {
         NETWORK: [
             # ip, port
             ARDUINO_IP, ARDUINO_PORT,
+        ],
+        # Additional controllers, relays 17-32, 33-48 ...
+        CONTROLLERS: [
+            # [ip, port], ...
         ]
     },
     RELAY_SETTINGS: {
         # TemplateFile: {
             # Relay 0-N
-            # relay-id: {CONFIG_HOTSPOT_TOPLEFT: (x,y), CONFIG_HOTSPOT_BOTTOMRIGHT: (x,y), CONFIG_HOTSPOT_COMMON: (x,y), CONFIG_HOTSPOT_NO: (x,y), CONFIG_HOTSPOT_NC: (x,y)},
+            # relay-id: {CONFIG_HOTSPOT_TOPLEFT: (x,y), CONFIG_HOTSPOT_BOTTOMRIGHT: (x,y), CONFIG_HOTSPOT_COMMON: (x,y), CONFIG_HOTSPOT_NO: (x,y), CONFIG_HOTSPOT_NC: (x,y), CONFIG_RELAY_SETTLE: ms},
             # relay-id: {...}, ...
         # },
         # TemplateFile: {...}
         # 'default.png': {},
-    }
+    },
+    BAND_SETTINGS: {
+        # rigctld to poll for the frequency, [ip, port] or None
+        BAND_RIG: None,
+        BAND_RULES: {
+            # TemplateFile: [[low Hz, high Hz, macro name], ...], ...
+        },
+    },
+    INTERLOCK_SETTINGS: {
+        # TemplateFile: [
+            # [INTERLOCK_EXCLUSIVE, [relay-id, ...], reason],
+            # [INTERLOCK_FORBID, [energised relay-id, ...], [de-energised relay-id, ...], reason],
+        # ], ...
+    },
 }
 
 DEFAULT_STATE = {
@@ -122,22 +152,33 @@ DEFAULT_STATE = {
     },
     MACROS: {
     #            TemplateFile: {
-    #               1: {
-    #                       TT: tooltip,
-    #                       1: RELAY_STATE,
-    #                       2: RELAY_STATE,
-    #                       3: RELAY_STATE,
-    #                       4: RELAY_STATE,
-    #                       5: RELAY_STATE,
-    #                       6: RELAY_STATE,
-    #                       7: RELAY_STATE,
-    #                       8: RELAY_STATE,
+    #               0: {
+    #                       MACRO_NAME: name,
+    #                       MACRO_TAGS: [tag, ...],
+    #                       MACRO_MASK: bit n-1 set for each relay n the macro sets,
+    #                       MACRO_ON: bit n-1 set if relay n is energised,
     #               },
-    #               2: ...
+    #               1: ...
     #    
     }
 }
 
+# ======================================================================================
+# PERSISTENCE
+
+# Snapshot layout
+STORE_VERSION = 4
+STORE_VERSION_KEY = 'version'
+STORE_DATA_KEY = 'data'
+# Files before versioning were pickles, which start with this byte
+PICKLE_MAGIC = b'\x80'
+JOURNAL_EXT = '.journal'
+TMP_EXT = '.tmp'
+# Journal entries before it is compacted into a new snapshot
+JOURNAL_COMPACT = 200
+# Minimum time between writes of each file
+PERSIST_INTERVAL = 2.0 # s
+
 # ======================================================================================
 # STATE
 
@@ -151,17 +192,143 @@ OFFLINE = False
 I_TAB_ARDUINO = 0
 
 # Status messsages
-TICKS_TO_CLEAR = 50
-
-# Connected poll
-POLL_TICKS = 50
-
-# Idle ticker
-IDLE_TICKER = 100 # ms
+STATUS_CLEAR = 5000 # ms
 
 # External command port
 EXT_UDP_IP = '127.0.0.1'
 EXT_UDP_PORT = 10000
+# Longest wait for relays to switch before replying
+EXT_REPLY_TIMEOUT = 5.0 # s
+# Datagrams waiting to execute, more are refused
+EXT_QUEUE_SIZE = 64
+# Coalescing of queued datagrams
+EXT_EXECUTE_ALL = 'all'         # Every one in turn
+EXT_LATEST_MACRO = 'latest'     # Of consecutive macro only datagrams just the last
+
+# ======================================================================================
+# RELAY ENGINE
+
+# Command types
+ENGINE_RELAYS = 'enginerelays'
+ENGINE_PARAMS = 'engineparams'
+ENGINE_PING = 'engineping'
+ENGINE_STATUS = 'enginestatus'
+ENGINE_PROBE = 'engineprobe'
+
+# Max queued commands
+ENGINE_QUEUE_SIZE = 64
+# Connectivity check
+PING_INTERVAL = 5.0 # s
+
+# Reliable delivery
+SEQ_MAX = 65535         # Sequence numbers run 1..SEQ_MAX
+RETRY_TIMEOUT = 0.25    # s, first retransmit, doubles each time
+RETRY_MAX = 4           # Retransmits before a command fails
+
+# ======================================================================================
+# SEQUENCER
+
+# Time for a relay's contacts to open when not configured
+DEFAULT_SETTLE = 30 # ms
+MAX_SETTLE = 2000 # ms
+# Give up on a step that has not completed after
+SEQUENCE_TIMEOUT = 30.0 # s
+# Outcomes kept for wait()
+SEQUENCE_OUTCOMES = 64
+
+# ======================================================================================
+# CORE
+
+# Events to core listeners as (event, data)
+# The snapshot is sent on attach, the others as they happen
+CORE_SNAPSHOT = 'coresnapshot'      # (settings, state)
+CORE_STATUS = 'corestatus'          # (online, message)
+CORE_COMPLETED = 'corecompleted'    # (cmd_id, success, message)
+CORE_MESSAGE = 'coremessage'        # message
+CORE_CHANGE = 'corechange'          # (CORE_SETTINGS | CORE_STATE, (keys, value) or (keys,))
+CORE_MACRO = 'coremacro'            # (macro id, relays switched, relays already set) for a macro executed
+CORE_TX = 'coretx'                  # (transmitting, relay changes held, seconds held) when PTT or the number held changes
+CORE_EXT = 'coreext'                # {CORE_EXT_...: count, ...} when the external command queue empties
+# Configuration a change applies to
+CORE_SETTINGS = 'coresettings'
+CORE_STATE = 'corestate'
+
+# Query result keys, with TEMPLATE and RELAYS
+CORE_ONLINE = 'online'
+CORE_TRANSMITTING = 'transmitting'
+CORE_HELD = 'held'      # Relay changes waiting for PTT to drop
+CORE_HOLD_TIME = 'holdtime' # s, of this hold or the last one
+# External command datagrams
+CORE_EXT_RECEIVED = 'extreceived'
+CORE_EXT_EXECUTED = 'extexecuted'
+CORE_EXT_COALESCED = 'extcoalesced'     # Superseded by a later macro
+CORE_EXT_OVERFLOWS = 'extoverflows'     # Refused with the queue full
+CORE_EXT_MAX_WAIT = 'extmaxwait'        # ms, longest in the queue
+CORE_EXT_COUNTS = (CORE_EXT_RECEIVED, CORE_EXT_EXECUTED, CORE_EXT_COALESCED, CORE_EXT_OVERFLOWS, CORE_EXT_MAX_WAIT)
+
+# Daemon address for GUI and other clients
+CORE_IP = '127.0.0.1'
+CORE_PORT = 10001
+# WebSocket clients, 0 for none
+CORE_WS_PORT = 10002
+# Core methods a client may call
+CORE_METHODS = ('select_template', 'set_relay', 'set_relays', 'set_macro', 'delete_macro', 'execute_macro', 'set_window', 'set_tx', 'configure', 'query')
+# Server methods, events are only sent once subscribed
+CORE_SUBSCRIBE = 'subscribe'
+CORE_UNSUBSCRIBE = 'unsubscribe'
+# Message kinds from the daemon
+CORE_REPLY = 'corereply'
+CORE_EVENT = 'coreevent'
+# Longest message line or frame
+CORE_LINE_MAX = 1048576 # bytes
+# A request not answered in this time gets a failure reply
+CORE_REPLY_TIMEOUT = 1.0 # s
+# Events queued for a client before it is too slow and must start again from a snapshot
+CORE_CLIENT_QUEUE = 256
+# A client that takes no data for this long is disconnected
+CORE_CLIENT_STALL = 10.0 # s
+# Give up connecting to the daemon after
+CORE_CONNECT_TIMEOUT = 5.0 # s
+
+# ======================================================================================
+# STATE FEED
+
+# Relay changes and macros are multicast here
+FEED_GROUP = '239.255.10.3'
+FEED_PORT = 10003
+FEED_TTL = 1 # Local network only
+# A datagram holding FEED_REQUEST sent here is answered with a snapshot
+FEED_REQUEST_PORT = 10004
+FEED_REQUEST = b'snapshot'
+# Snapshots are also multicast this often
+FEED_SNAPSHOT_INTERVAL = 10.0 # s
+
+# ======================================================================================
+# BAND FOLLOWER
+
+# Frequencies pushed as "<Hz>" or "F <Hz>" datagrams
+BAND_UDP_IP = '127.0.0.1'
+BAND_UDP_PORT = 10005
+# rigctld default port and how often to ask it
+RIG_PORT = 4532
+RIG_POLL_INTERVAL = 0.5 # s
+RIG_RETRY = 5.0 # s
+# A band is left once this far beyond its edges
+BAND_HYSTERESIS = 10000 # Hz
+# A new band must hold this long before switching
+BAND_DWELL = 0.5 # s
+# and switches are at least this far apart
+BAND_MIN_INTERVAL = 2.0 # s
+
+# ======================================================================================
+# PTT
+
+# Transmitter state as "T 1" / "T 0", as rigctl sets it, or "tx" / "rx"
+PTT_UDP_IP = '127.0.0.1'
+PTT_UDP_PORT = 10006
+# Words taken as transmitting and receiving, after any "T" or "ptt:"
+PTT_ON = ('1', 'tx', 'on', 'true')
+PTT_OFF = ('0', 'rx', 'off', 'false')
 
 # ======================================================================================
 # GRAPHICS
@@ -174,4 +341,7 @@ MODE_RUNTIME = 'moderuntime'
 # Events
 EVNT_POS = 'evntpos'
 EVNT_LEFT = 'evntleft'
-EVNT_MENU = 'evntmenu'
\ No newline at end of file
+EVNT_MENU = 'evntmenu'
+
+# Hit-test grid cell size
+HOTSPOT_CELL = 32 # pixels
\ No newline at end of file
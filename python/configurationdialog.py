@@ -50,13 +50,16 @@ class ConfigurationDialog(QDialog):
         self.__current_template = current_template
         
         # Class vars
-        self.__relay_settings = copy.deepcopy(self.__settings[RELAY_SETTINGS])
+        # Edits go into the transaction given to begin(), until then this is read only
+        self.__tx = None
+        self.__relay_settings = self.__settings[RELAY_SETTINGS]
+        self.__networks = [list(network) for network in controllers.get_networks(self.__settings[ARDUINO_SETTINGS])]
         
         # Create the UI interface elements
         self.__initUI()
-                
-        # Start the idle timer
-        QTimer.singleShot(100, self.__idleProcessing)
+        
+        # Set the initial button state
+        self.__update_buttons()
     
     # UI initialisation ===============================================================================================
     def __initUI(self):
@@ -118,43 +121,60 @@ class ConfigurationDialog(QDialog):
         grid.addWidget(usagelabel, 0, 0)
         instlabel = QLabel()
         instructions = """
-Set the IP address and port to the listening IP/port of the Arduino.
+Set the IP address and port to the listening IP/port of each Arduino.
+Controller 1 drives relays 1-16, controller 2 relays 17-32 and so on.
         """
         instlabel.setText(instructions)
         instlabel.setStyleSheet("QLabel {color: rgb(0,64,128); font: 11px}")
-        grid.addWidget(instlabel, 0, 1, 1, 2)
+        grid.addWidget(instlabel, 0, 1, 1, 3)
         
         # Add control items
+        # Controller selection
+        controllerlabel = QLabel('Controller')
+        grid.addWidget(controllerlabel, 1, 0)
+        self.controllercombo = QComboBox()
+        for controller in range(len(self.__networks)):
+            self.controllercombo.addItem(str(controller + 1))
+        grid.addWidget(self.controllercombo, 1, 1)
+        self.controllercombo.activated.connect(self.__on_controller)
+        self.addcontrollerbtn = QPushButton('Add', self)
+        self.addcontrollerbtn.setToolTip('Add a controller')
+        grid.addWidget(self.addcontrollerbtn, 1, 2)
+        self.addcontrollerbtn.clicked.connect(self.__add_controller)
+        self.removecontrollerbtn = QPushButton('Remove', self)
+        self.removecontrollerbtn.setToolTip('Remove the last controller')
+        grid.addWidget(self.removecontrollerbtn, 1, 3)
+        self.removecontrollerbtn.clicked.connect(self.__remove_controller)
+        
         # IP selection
         iplabel = QLabel('Arduino IP')
-        grid.addWidget(iplabel, 1, 0)
+        grid.addWidget(iplabel, 2, 0)
         self.iptxt = QLineEdit()
         self.iptxt.setToolTip('Listening IP of Arduino')
         self.iptxt.setInputMask('000.000.000.000;_')
         self.iptxt.setMaximumWidth(100)
-        grid.addWidget(self.iptxt, 1, 1)
+        grid.addWidget(self.iptxt, 2, 1)
         self.iptxt.editingFinished.connect(self.ipChanged)
-        if len(self.__settings[ARDUINO_SETTINGS][NETWORK]) > 0:
-            self.iptxt.setText(self.__settings[ARDUINO_SETTINGS][NETWORK][IP])
         
         # Port selection
         portlabel = QLabel('Arduino Port')
-        grid.addWidget(portlabel, 2, 0)
+        grid.addWidget(portlabel, 3, 0)
         self.porttxt = QLineEdit()
         self.porttxt.setToolTip('Listening port of Arduino')
         self.porttxt.setInputMask('00000;_')
         self.porttxt.setMaximumWidth(100)
-        grid.addWidget(self.porttxt, 2, 1)
+        grid.addWidget(self.porttxt, 3, 1)
         self.porttxt.editingFinished.connect(self.portChanged)
-        if len(self.__settings[ARDUINO_SETTINGS][NETWORK]) > 0:
-            self.porttxt.setText(self.__settings[ARDUINO_SETTINGS][NETWORK][PORT])
+        
+        # Show the first controller
+        self.__on_controller()
         
         nulllabel = QLabel('')
-        grid.addWidget(nulllabel, 3, 0, 1, 2)
+        grid.addWidget(nulllabel, 4, 0, 1, 2)
         nulllabel1 = QLabel('')
-        grid.addWidget(nulllabel1, 0, 2)
-        grid.setRowStretch(3, 1)
-        grid.setColumnStretch(2, 1)
+        grid.addWidget(nulllabel1, 0, 4)
+        grid.setRowStretch(4, 1)
+        grid.setColumnStretch(4, 1)
     
     def __populateRelays(self, grid):
         """
@@ -173,6 +193,7 @@ Set the IP address and port to the listening IP/port of the Arduino.
         instructions = """
 Configure template and switch area hot spot
 and the Common/NO/NC switch contacts.
+Settle is the time the relay contacts take to open.
         """
         instlabel.setText(instructions)
         instlabel.setStyleSheet("QLabel {color: rgb(0,64,128); font: 11px}")
@@ -227,12 +248,13 @@ and the Common/NO/NC switch contacts.
                 self.relaycombo.addItem(str(key))
         grid.addWidget(self.relaycombo, 4, 1)
         self.relaycombo.activated.connect(self.__on_relay)
+        self.relaycombo.currentIndexChanged.connect(self.__update_buttons)
         
         # Relay ID
         idlabel = QLabel('Relay ID')
         grid.addWidget(idlabel, 5, 0)
         self.idsb = QSpinBox(self)
-        self.idsb.setRange(1, 16)
+        self.idsb.setRange(1, len(self.__networks) * MAX_RLYS)
         self.idsb.setValue(1)
         grid.addWidget(self.idsb, 5, 1)
         self.idsb.valueChanged.connect(self.__on_id)
@@ -277,6 +299,16 @@ and the Common/NO/NC switch contacts.
         self.__nclabel.setStyleSheet("QLabel {color: rgb(255,128,64);font: bold 12px}")
         grid.addWidget(self.__nclabel, 10, 1)
         
+        # Settle time
+        settlelabel = QLabel('Settle (ms)')
+        grid.addWidget(settlelabel, 11, 0)
+        self.settlesb = QSpinBox(self)
+        self.settlesb.setToolTip('Time for the contacts to open before other relays close')
+        self.settlesb.setRange(0, MAX_SETTLE)
+        self.settlesb.setValue(DEFAULT_SETTLE)
+        grid.addWidget(self.settlesb, 11, 1)
+        self.settlesb.valueChanged.connect(self.__on_settle)
+        
         # Populate the coordinates
         try:
             if self.relaycombo.currentIndex() != -1:
@@ -294,7 +326,7 @@ and the Common/NO/NC switch contacts.
         self.addbtn.setMinimumHeight(20)
         self.addbtn.setMinimumWidth(100)
         self.addbtn.setEnabled(True)
-        grid.addWidget(self.addbtn, 11, 1)
+        grid.addWidget(self.addbtn, 12, 1)
         self.addbtn.clicked.connect(self.__editadd)
         
         self.delbtn = QPushButton('Delete', self)
@@ -303,7 +335,7 @@ and the Common/NO/NC switch contacts.
         self.delbtn.setMinimumHeight(20)
         self.delbtn.setMinimumWidth(100)
         self.delbtn.setEnabled(True)
-        grid.addWidget(self.delbtn, 11, 2)
+        grid.addWidget(self.delbtn, 12, 2)
         self.delbtn.clicked.connect(self.__delete)       
             
     def __populateCommon(self, grid, x, y, cols, rows):
@@ -362,20 +394,21 @@ and the Common/NO/NC switch contacts.
         elif what == EVNT_LEFT:
             # Some marker point
             if self.idsb.value() not in self.__relay_settings[self.__current_template]:
-                self.__relay_settings[self.__current_template][self.idsb.value()] = {}
+                self.__set_relay((self.__current_template, self.idsb.value()), {})
             if self.toplrb.isChecked():
-                self.__relay_settings[self.__current_template][self.idsb.value()][CONFIG_HOTSPOT_TOPLEFT] = (data[0], data[1])
+                self.__set_relay((self.__current_template, self.idsb.value(), CONFIG_HOTSPOT_TOPLEFT), (data[0], data[1]))
             elif self.botrrb.isChecked():
-                self.__relay_settings[self.__current_template][self.idsb.value()][CONFIG_HOTSPOT_BOTTOMRIGHT] = (data[0], data[1])
+                self.__set_relay((self.__current_template, self.idsb.value(), CONFIG_HOTSPOT_BOTTOMRIGHT), (data[0], data[1]))
             elif self.commrb.isChecked():
-                self.__relay_settings[self.__current_template][self.idsb.value()][CONFIG_HOTSPOT_COMMON] = (data[0], data[1])
+                self.__set_relay((self.__current_template, self.idsb.value(), CONFIG_HOTSPOT_COMMON), (data[0], data[1]))
             elif self.norb.isChecked():
-                self.__relay_settings[self.__current_template][self.idsb.value()][CONFIG_HOTSPOT_NO] = (data[0], data[1])
+                self.__set_relay((self.__current_template, self.idsb.value(), CONFIG_HOTSPOT_NO), (data[0], data[1]))
             elif self.ncrb.isChecked():
-                self.__relay_settings[self.__current_template][self.idsb.value()][CONFIG_HOTSPOT_NC] = (data[0], data[1])
+                self.__set_relay((self.__current_template, self.idsb.value(), CONFIG_HOTSPOT_NC), (data[0], data[1]))
             # Set user text
             coords = self.__relay_settings[self.__current_template][self.idsb.value()]
             self.__set_coordinates(coords)
+            self.__update_buttons()
     
     # PUBLIC
     #================================================================================================
@@ -384,6 +417,41 @@ and the Common/NO/NC switch contacts.
         
         return self.__current_template
     
+    def begin(self, tx, current_template):
+        """
+        Start a configuration session, showing the settings as they are now
+        
+        Arguments:
+            tx                  --  settings Transaction to make the edits in
+            current_template    --  template in use
+            
+        """
+        
+        self.__tx = tx
+        self.__settings = tx.view
+        self.__relay_settings = tx.view[RELAY_SETTINGS]
+        # Controllers
+        self.__networks = [list(network) for network in controllers.get_networks(tx.view[ARDUINO_SETTINGS])]
+        self.controllercombo.clear()
+        for controller in range(len(self.__networks)):
+            self.controllercombo.addItem(str(controller + 1))
+        self.controllercombo.setCurrentIndex(0)
+        self.__on_controller()
+        self.idsb.setRange(1, len(self.__networks) * MAX_RLYS)
+        # Templates
+        self.__templates = sorted(self.__relay_settings.keys())
+        self.templatecombo.clear()
+        for template in self.__templates:
+            self.templatecombo.addItem(str(template))
+        if current_template in self.__relay_settings:
+            self.__current_template = current_template
+            self.templatecombo.setCurrentIndex(self.templatecombo.findText(current_template, Qt.MatchFixedString))
+            self.__show_template()
+        else:
+            self.__current_template = None
+            self.relaycombo.clear()
+            self.__update_buttons()
+    
     # Event handlers
     #================================================================================================
     # Tab event handler
@@ -402,18 +470,53 @@ and the Common/NO/NC switch contacts.
     def ipChanged(self, ):
         """ User edited IP address """
         
-        self.__config_callback(CONFIG_NETWORK, (self.iptxt.text(), self.porttxt.text()))
+        self.__network_changed()
         
     def portChanged(self, ):
         """ User edited port address """
         
-        self.__config_callback(CONFIG_NETWORK, (self.iptxt.text(), self.porttxt.text()))
+        self.__network_changed()
+    
+    def __on_controller(self, ):
+        """ Show the selected controller """
+        
+        controller = max(0, self.controllercombo.currentIndex())
+        network = self.__networks[controller]
+        if len(network) > 0:
+            self.iptxt.setText(network[IP])
+            self.porttxt.setText(network[PORT])
+        self.removecontrollerbtn.setEnabled(len(self.__networks) > 1)
+    
+    def __add_controller(self, ):
+        """ Add another controller with the default address """
+        
+        self.__networks.append([ARDUINO_IP, ARDUINO_PORT])
+        self.controllercombo.addItem(str(len(self.__networks)))
+        self.controllercombo.setCurrentIndex(len(self.__networks) - 1)
+        self.__controllers_changed()
+    
+    def __remove_controller(self, ):
+        """ Remove the last controller, the first is always kept """
+        
+        if len(self.__networks) > 1:
+            self.__networks.pop()
+            self.controllercombo.removeItem(len(self.__networks))
+            self.controllercombo.setCurrentIndex(0)
+            self.__controllers_changed()
         
     # Relay event handlers
     def __on_template(self, ):
         """ Set the selected template """
         
         self.__current_template = self.templatecombo.itemText(self.templatecombo.currentIndex())
+        self.__show_template()
+            
+        # Callback to UI to make the changes
+        self.__config_callback(CONFIG_SEL_TEMPLATE, self.__current_template)
+    
+    def __show_template(self, ):
+        """ Show the relays for the current template """
+        
         # Copy in the hotspot settings
         self.idsb.setValue(1)   # Set back to first relay
         self.relaycombo.clear()
@@ -440,9 +543,7 @@ and the Common/NO/NC switch contacts.
             self.__commlabel.setText('')
             self.__nolabel.setText('')
             self.__nclabel.setText('')
-            
-        # Callback to UI to make the changes
-        self.__config_callback(CONFIG_SEL_TEMPLATE, [self.__current_template, self.__relay_settings])
+        self.__update_buttons()
         
     def __add_template(self, ):
         """ Add a template file """
@@ -465,11 +566,11 @@ and the Common/NO/NC switch contacts.
                 # Add new template to the combo
                 self.templatecombo.addItem(item)
                 # Add an empty dict for this template
-                self.__relay_settings[item] = {}
+                self.__set_relay((item,), {})
                 # Update the template list
                 self.__templates = sorted(self.__relay_settings.keys())
                 # Callback to UI to make the changes
-                self.__config_callback(CONFIG_NEW_TEMPLATE, [self.__current_template, self.__relay_settings])
+                self.__config_callback(CONFIG_NEW_TEMPLATE, item)
                 if len(self.__relay_settings) == 1:
                     #First template so make it active
                     self.__on_template()
@@ -483,8 +584,7 @@ and the Common/NO/NC switch contacts.
             QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
             # Remove from the relay structure
-            if self.__current_template in self.__relay_settings:
-                del self.__relay_settings[self.__current_template]
+            self.__delete_relay((self.__current_template,))
             # Remove from the template list
             index = self.templatecombo.findText(self.__current_template)
             if index != -1:
@@ -492,7 +592,7 @@ and the Common/NO/NC switch contacts.
             # Update the template list
             self.__templates = sorted(self.__relay_settings.keys()) 
             # Callback to UI to make the changes
-            self.__config_callback(CONFIG_DEL_TEMPLATE, [self.__current_template, self.__relay_settings])
+            self.__config_callback(CONFIG_DEL_TEMPLATE, self.__current_template)
             # Make the now selected template active
             self.__on_template()
                     
@@ -510,13 +610,15 @@ and the Common/NO/NC switch contacts.
         coords = self.__relay_settings[self.__current_template][id]
         self.__set_coordinates(coords)
         # Create/edit temporary structure
-        self.__relay_settings[self.__current_template][id] = {
+        self.__set_relay((self.__current_template, id), {
             CONFIG_HOTSPOT_TOPLEFT: (coords[CONFIG_HOTSPOT_TOPLEFT][0], coords[CONFIG_HOTSPOT_TOPLEFT][1]),
             CONFIG_HOTSPOT_BOTTOMRIGHT: (coords[CONFIG_HOTSPOT_BOTTOMRIGHT][0], coords[CONFIG_HOTSPOT_BOTTOMRIGHT][1]),
             CONFIG_HOTSPOT_COMMON: (coords[CONFIG_HOTSPOT_COMMON][0], coords[CONFIG_HOTSPOT_COMMON][1]),
             CONFIG_HOTSPOT_NO: (coords[CONFIG_HOTSPOT_NO][0], coords[CONFIG_HOTSPOT_NO][1]),
-            CONFIG_HOTSPOT_NC: (coords[CONFIG_HOTSPOT_NC][0], coords[CONFIG_HOTSPOT_NC][1])
-        }
+            CONFIG_HOTSPOT_NC: (coords[CONFIG_HOTSPOT_NC][0], coords[CONFIG_HOTSPOT_NC][1]),
+            CONFIG_RELAY_SETTLE: coords.get(CONFIG_RELAY_SETTLE, DEFAULT_SETTLE)
+        })
+        self.__update_buttons()
     
     def __on_id(self, ):
         """
@@ -546,13 +648,25 @@ and the Common/NO/NC switch contacts.
                 self.__commlabel.setText('')
                 self.__nolabel.setText('')
                 self.__nclabel.setText('')
-                self.__relay_settings[self.__current_template][spinbox_id_selected] = {
+                self.__set_relay((self.__current_template, spinbox_id_selected), {
                     CONFIG_HOTSPOT_TOPLEFT: (None, None),
                     CONFIG_HOTSPOT_BOTTOMRIGHT: (None, None),
                     CONFIG_HOTSPOT_COMMON: (None, None),
                     CONFIG_HOTSPOT_NO: (None, None),
-                    CONFIG_HOTSPOT_NC: (None, None)
-                }
+                    CONFIG_HOTSPOT_NC: (None, None),
+                    CONFIG_RELAY_SETTLE: DEFAULT_SETTLE
+                })
+                self.__set_settle(DEFAULT_SETTLE)
+        self.__update_buttons()
+    
+    def __on_settle(self, ):
+        """ User changed the settle time """
+        
+        if self.__current_template in self.__relay_settings and self.idsb.value() in self.__relay_settings[self.__current_template]:
+            self.__set_relay((self.__current_template, self.idsb.value(), CONFIG_RELAY_SETTLE), self.settlesb.value())
+            if self.relaycombo.findText(str(self.idsb.value())) != -1:
+                # Already configured so takes effect now
+                self.__config_callback(CONFIG_EDIT_ADD_HOTSPOT, None)
     
     def __editadd(self, ):
         """ User wants to add/edit the current contents """
@@ -561,12 +675,12 @@ and the Common/NO/NC switch contacts.
         if index == -1:
             self.relaycombo.addItem(str(self.idsb.value()))
         self.relaycombo.setCurrentIndex(self.relaycombo.findText(str(self.idsb.value())))
-        self.__config_callback(CONFIG_EDIT_ADD_HOTSPOT, self.__relay_settings)
+        self.__config_callback(CONFIG_EDIT_ADD_HOTSPOT, None)
     
     def __delete(self, ):
         """ User wants to delete the selected relay and data """
         
-        del self.__relay_settings[self.__current_template][self.idsb.value()]
+        self.__delete_relay((self.__current_template, self.idsb.value()))
         self.relaycombo.removeItem(self.relaycombo.currentIndex())
         self.relaycombo.setCurrentIndex(-1)
         self.__topllabel.setText('')
@@ -574,18 +688,53 @@ and the Common/NO/NC switch contacts.
         self.__commlabel.setText('')
         self.__nolabel.setText('')
         self.__nclabel.setText('')
-        self.__config_callback(CONFIG_DELETE_HOTSPOT, self.__relay_settings)
+        self.__update_buttons()
+        self.__config_callback(CONFIG_DELETE_HOTSPOT, None)
 
-    # Idle time processing ============================================================================================        
-    def __idleProcessing(self):
+    # Helpers =========================================================================================================
+    
+    def __set_relay(self, keys, value):
+        """
+        Set an item in the relay settings
         
+        Arguments:
+            keys    --  keys below RELAY_SETTINGS
+            value   --  new value
+            
         """
-        Idle processing.
-        Called every 100ms single shot
         
+        self.__tx.set((RELAY_SETTINGS,) + tuple(keys), value)
+        self.__relay_settings = self.__tx.view[RELAY_SETTINGS]
+    
+    def __delete_relay(self, keys):
         """
+        Delete an item from the relay settings
+        
+        Arguments:
+            keys    --  keys below RELAY_SETTINGS
+            
+        """
+        
+        self.__tx.delete((RELAY_SETTINGS,) + tuple(keys))
+        self.__relay_settings = self.__tx.view[RELAY_SETTINGS]
+    
+    def __network_changed(self):
+        """ Record an address edit against the selected controller """
+        
+        controller = max(0, self.controllercombo.currentIndex())
+        self.__networks[controller] = [self.iptxt.text(), self.porttxt.text()]
+        self.__config_callback(CONFIG_NETWORK, (controller, self.iptxt.text(), self.porttxt.text()))
     
-        # Adjust buttons
+    def __controllers_changed(self):
+        """ The controller list has changed """
+        
+        self.__on_controller()
+        self.idsb.setRange(1, len(self.__networks) * MAX_RLYS)
+        self.__config_callback(CONFIG_CONTROLLERS, copy.deepcopy(self.__networks))
+    
+    def __update_buttons(self):
+        """ Adjust button state to the current selections """
+        
         if  len(self.__topllabel.text()) > 0 and\
             len(self.__botrlabel.text()) > 0 and\
             len(self.__commlabel.text()) > 0 and\
@@ -604,10 +753,6 @@ and the Common/NO/NC switch contacts.
             self.deletetemplatebtn.setEnabled(True)
         else:
             self.deletetemplatebtn.setEnabled(False)
-            
-        QTimer.singleShot(100, self.__idleProcessing)
-        
-    # Helpers =========================================================================================================
     
     def __set_coordinates(self, coords):
         """
@@ -638,4 +783,18 @@ and the Common/NO/NC switch contacts.
             self.__nclabel.setText('X:%3d Y:%3d' % (coords[CONFIG_HOTSPOT_NC][0], coords[CONFIG_HOTSPOT_NC][1]))
         else:
             self.__nclabel.setText('')
+        self.__set_settle(coords.get(CONFIG_RELAY_SETTLE, DEFAULT_SETTLE))
+    
+    def __set_settle(self, settle):
+        """
+        Show a settle time without treating it as an edit
+        
+        Arguments:
+            settle  --  settle time in ms
+            
+        """
+        
+        self.settlesb.blockSignals(True)
+        self.settlesb.setValue(settle)
+        self.settlesb.blockSignals(False)
     
\ No newline at end of file
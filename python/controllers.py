@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+#
+# controllers.py
+#
+# Controller registry for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+Utility functions for relay addressing.
+Relays are numbered globally. Controller 0 has relays 1-16,
+controller 1 has relays 17-32 and so on.
+"""
+def get_networks(arduino_settings):
+    """
+    Return the [ip, port] list for every controller
+
+    Arguments:
+        arduino_settings    --  ARDUINO_SETTINGS section of the settings
+
+    """
+
+    return [arduino_settings[NETWORK]] + list(arduino_settings.get(CONTROLLERS, []))
+
+def to_local(relay_id):
+    """
+    Return (controller index, local relay id) for a global relay id
+
+    Arguments:
+        relay_id    --  global relay id, 1 based
+
+    """
+
+    return (relay_id - 1) // MAX_RLYS, (relay_id - 1) % MAX_RLYS + 1
+
+def to_global(controller, relay_id):
+    """
+    Return the global relay id for a controller relay
+
+    Arguments:
+        controller  --  controller index, 0 based
+        relay_id    --  local relay id 1-16
+
+    """
+
+    return controller * MAX_RLYS + relay_id
+
+"""
+
+Controller registry.
+Owns one RelayEngine per Arduino and presents them as a single
+engine addressed by global relay id. A vector of relay changes is
+split by controller and handed to every engine at once so a change
+spanning several boxes completes in one round trip. Completion is
+reported once all the controllers involved have replied.
+
+"""
+class ControllerRegistry:
+
+    def __init__(self, networks, status_callback, completion_callback, read_back_callback = None, ping_interval = PING_INTERVAL):
+        """
+        Constructor
+
+        Arguments
+            networks            -- list of [ip, port], one per controller
+            status_callback     -- callback here with (online, message)
+            completion_callback -- callback here with (cmd_id, success, message)
+            read_back_callback  -- callback here with {global relay id: RELAY_ON | RELAY_OFF}
+                                   as read back from one controller, None to disable the read back
+            ping_interval       -- seconds between connectivity checks of each controller
+        """
+
+        self.__status_callback = status_callback
+        self.__completion_callback = completion_callback
+        self.__read_back_callback = read_back_callback
+        self.__ping_interval = ping_interval
+
+        # Re-entrant as completion may call back into the registry
+        self.__lock = threading.RLock()
+        self.__next_id = 0
+        # Outstanding commands
+        # {(controller, engine cmd id): cmd_id, ...}
+        self.__parts = {}
+        # {cmd_id: [parts outstanding, success, message], ...}
+        self.__pending = {}
+
+        self.__engines = []
+        self.__networks = []
+        self.__online = []
+        for network in networks:
+            self.__add_engine(network)
+
+    # Public interface (any thread) ==================================================================================
+    def start(self):
+        """ Start all engines """
+
+        for engine in self.__engines:
+            engine.start()
+
+    def terminate(self):
+        """ Terminate all engines """
+
+        for engine in self.__engines:
+            engine.terminate()
+
+    def join(self):
+        """ Wait for all engines to exit """
+
+        for engine in self.__engines:
+            if engine.is_alive():
+                engine.join()
+
+    def relay_count(self):
+        """ Total relays across all controllers """
+
+        return len(self.__engines) * MAX_RLYS
+
+    def controller_state(self):
+        """ Return a list of ([ip, port], online) per controller """
+
+        with self.__lock:
+            return [(list(network), online) for network, online in zip(self.__networks, self.__online)]
+
+    def set_relay(self, relay_id, contact_state):
+        """
+        Set a single relay
+
+        Arguments:
+            relay_id        --  global relay id
+            contact_state   --  RELAY_ON | RELAY_OFF
+
+        Returns the command id or None if the relay is not on a known controller
+
+        """
+
+        return self.set_relays([(relay_id, contact_state)])
+
+    def set_relays(self, relays):
+        """
+        Set a vector of relays, fanned out across the controllers
+
+        Arguments:
+            relays  --  list of (global relay id, RELAY_ON | RELAY_OFF)
+
+        Returns the command id or None if no relay is on a known controller
+
+        """
+
+        # Split by controller
+        split = {}
+        for relay_id, contact_state in relays:
+            controller, local_id = to_local(relay_id)
+            if controller < len(self.__engines):
+                split.setdefault(controller, []).append((local_id, contact_state))
+        if len(split) == 0:
+            return None
+
+        with self.__lock:
+            self.__next_id += 1
+            cmd_id = self.__next_id
+            self.__pending[cmd_id] = [len(split), True, '']
+            # Hold the lock so a fast reply cannot arrive before the part is recorded
+            for controller, local_relays in split.items():
+                engine_id = self.__engines[controller].set_relays(local_relays)
+                if engine_id == None:
+                    self.__part_done(cmd_id, False, 'Controller %d: queue full' % (controller + 1))
+                else:
+                    self.__parts[(controller, engine_id)] = cmd_id
+        return cmd_id
+
+    def reset_relays(self):
+        """ De-energise all relays on all controllers """
+
+        return self.set_relays([(relay_id, RELAY_OFF) for relay_id in range(1, self.relay_count() + 1)])
+
+    def resetParams(self, ip, port):
+        """
+        Change the address of the primary controller
+
+        Arguments:
+            ip      --  new IP address
+            port    --  new port
+
+        """
+
+        networks = list(self.__networks)
+        networks[0] = [ip, port]
+        self.set_networks(networks)
+
+    def set_networks(self, networks):
+        """
+        Apply a new controller list.
+        Existing controllers are re-addressed, new ones started and
+        surplus ones stopped. The primary controller is never removed.
+
+        Arguments:
+            networks    --  list of [ip, port], one per controller
+
+        """
+
+        for controller, network in enumerate(networks):
+            if controller < len(self.__engines):
+                if list(network) != list(self.__networks[controller]):
+                    self.__networks[controller] = list(network)
+                    self.__engines[controller].resetParams(network[IP], network[PORT])
+            else:
+                self.__add_engine(network).start()
+        while len(self.__engines) > max(1, len(networks)):
+            engine = self.__engines.pop()
+            engine.terminate()
+            with self.__lock:
+                self.__networks.pop()
+                self.__online.pop()
+                # Fail anything still waiting on this controller
+                controller = len(self.__engines)
+                for key in [key for key in self.__parts if key[0] == controller]:
+                    self.__part_done(self.__parts.pop(key), False, 'Controller %d: removed' % (controller + 1))
+
+    # Engine callbacks (engine threads) ===============================================================================
+    def __engine_status(self, controller, online, message):
+        """
+        Status from one engine
+
+        Arguments:
+            controller  --  controller index
+            online      --  true if connected
+            message     --  text to drive the status messages
+
+        """
+
+        with self.__lock:
+            if controller >= len(self.__online):
+                return
+            self.__online[controller] = online
+            all_online = all(self.__online)
+            several = len(self.__online) > 1
+        if several and len(message) > 0:
+            message = 'Controller %d: %s' % (controller + 1, message)
+        self.__status_callback(all_online, message)
+
+    def __engine_completed(self, controller, engine_id, success, message):
+        """
+        Completion from one engine
+
+        Arguments:
+            controller  --  controller index
+            engine_id   --  id the engine gave the command
+            success     --  True if acknowledged
+            message     --  failure text
+
+        """
+
+        with self.__lock:
+            cmd_id = self.__parts.pop((controller, engine_id), None)
+            if cmd_id == None:
+                return
+            if not success and len(self.__engines) > 1:
+                message = 'Controller %d: %s' % (controller + 1, message)
+            self.__part_done(cmd_id, success, message)
+
+    # Helpers =========================================================================================================
+    def __add_engine(self, network):
+        # Create an engine for another controller
+        controller = len(self.__engines)
+        engine = relayengine.RelayEngine(
+            network,
+            lambda online, message: self.__engine_status(controller, online, message),
+            lambda engine_id, success, message: self.__engine_completed(controller, engine_id, success, message),
+            None if self.__read_back_callback == None else lambda relays: self.__read_back(controller, relays),
+            self.__ping_interval)
+        self.__engines.append(engine)
+        self.__networks.append(list(network))
+        self.__online.append(False)
+        return engine
+
+    def __read_back(self, controller, relays):
+        # Pass on one controller's relays as read back by global id
+        self.__read_back_callback({to_global(controller, relay_id): contact_state for relay_id, contact_state in relays.items()})
+
+    def __part_done(self, cmd_id, success, message):
+        # One controller has finished its part of a command, lock is held
+        entry = self.__pending[cmd_id]
+        entry[0] -= 1
+        if not success:
+            entry[1] = False
+            entry[2] = message
+        if entry[0] == 0:
+            del self.__pending[cmd_id]
+            self.__completion_callback(cmd_id, entry[1], entry[2])
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+#
+# coreclient.py
+#
+# Client for a remote Antenna Switch core
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+
+Core client.
+Stands in for a SwitchCore running in a daemon elsewhere, through its
+CoreServer. It has the same interface so the GUI can use either. Requests
+are sent without waiting for the reply. A copy of the settings and state
+is kept up to date from the core's changes so listeners that attach here
+get a snapshot just as they would from the core itself, and queries are
+answered from it.
+
+The server sends a new snapshot if we fall behind. That is passed on to
+listeners as a change to every top level item.
+
+"""
+class CoreClient:
+
+    def __init__(self, ip = CORE_IP, port = CORE_PORT):
+        """
+        Constructor
+
+        Arguments
+            ip      -- daemon address
+            port    -- daemon port
+        """
+
+        self.__address = (ip, port)
+
+        self.__lock = threading.RLock()
+        self.__listeners = []
+        # Copy of the core's settings and state, status and counts
+        self.__settings = None
+        self.__state = None
+        self.__status = (False, '')
+        self.__tx = (False, 0, 0.0)
+        self.__tx_time = 0
+        self.__ext = dict.fromkeys(CORE_EXT_COUNTS, 0)
+        self.__ready = threading.Event()
+
+        self.__sock = None
+        self.__send_lock = threading.Lock()
+        self.__next_id = 0
+        self.__reader = threading.Thread(target=self.__read)
+
+    # Public interface (any thread) ==================================================================================
+    def start(self):
+        """ Connect and wait for the snapshot, raises an exception on failure """
+
+        self.__sock = socket.create_connection(self.__address, CORE_CONNECT_TIMEOUT)
+        self.__sock.settimeout(None)
+        self.__reader.start()
+        self.__request(CORE_SUBSCRIBE)
+        if not self.__ready.wait(CORE_CONNECT_TIMEOUT):
+            self.terminate()
+            raise RuntimeError('No response from the daemon at %s:%d' % self.__address)
+
+    def terminate(self):
+        """ Disconnect """
+
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        if self.__reader.is_alive():
+            self.__reader.join()
+        self.__sock.close()
+
+    def attach(self, listener):
+        """
+        Add a listener. Before this returns it is called on this thread
+        with CORE_SNAPSHOT, the current CORE_STATUS, the last CORE_TX and
+        the last CORE_EXT counts.
+
+        Arguments:
+            listener    --  callback here with (event, data)
+
+        """
+
+        with self.__lock:
+            self.__listeners.append(listener)
+            self.__call(listener, CORE_SNAPSHOT, (copy.deepcopy(self.__settings), copy.deepcopy(self.__state)))
+            self.__call(listener, CORE_STATUS, self.__status)
+            self.__call(listener, CORE_TX, self.__tx)
+            self.__call(listener, CORE_EXT, dict(self.__ext))
+
+    def detach(self, listener):
+        """
+        Remove a listener
+
+        Arguments:
+            listener    --  as given to attach()
+
+        """
+
+        with self.__lock:
+            if listener in self.__listeners:
+                self.__listeners.remove(listener)
+
+    def query(self):
+        """ See SwitchCore """
+
+        with self.__lock:
+            result = {
+                TEMPLATE: self.__state[TEMPLATE],
+                RELAYS: dict(self.__state[RELAYS].get(self.__state[TEMPLATE], {})),
+                CORE_ONLINE: self.__status[0],
+                CORE_TRANSMITTING: self.__tx[0],
+                CORE_HELD: self.__tx[1] if self.__tx[0] else 0,
+                # The hold goes on after the last CORE_TX while transmitting
+                CORE_HOLD_TIME: self.__tx[2] + time.time() - self.__tx_time if self.__tx[0] else self.__tx[2],
+            }
+            result.update(self.__ext)
+            return result
+
+    def select_template(self, template):
+        """ See SwitchCore """
+
+        self.__request('select_template', template)
+
+    def set_relay(self, relay_id, contact_state):
+        """ See SwitchCore """
+
+        self.__request('set_relay', relay_id, contact_state)
+
+    def set_relays(self, relays):
+        """ See SwitchCore """
+
+        self.__request('set_relays', dict(relays))
+
+    def set_macro(self, macro_id, name, tags = ()):
+        """ See SwitchCore """
+
+        self.__request('set_macro', macro_id, name, list(tags))
+
+    def delete_macro(self, macro_id):
+        """ See SwitchCore """
+
+        self.__request('delete_macro', macro_id)
+
+    def execute_macro(self, macro_id):
+        """ See SwitchCore """
+
+        self.__request('execute_macro', macro_id)
+
+    def set_tx(self, transmitting):
+        """ See SwitchCore """
+
+        self.__request('set_tx', bool(transmitting))
+
+    def set_window(self, window):
+        """ See SwitchCore """
+
+        self.__request('set_window', list(window))
+
+    def configure(self, settings_changes, state_changes):
+        """ See SwitchCore """
+
+        self.__request('configure', list(settings_changes), list(state_changes))
+
+    # Helpers =========================================================================================================
+    def __request(self, method, *args):
+        """
+        Send a request
+
+        Arguments:
+            method  --  one of CORE_METHODS
+            args    --  its arguments
+
+        """
+
+        with self.__send_lock:
+            self.__next_id += 1
+            try:
+                self.__sock.sendall((repr((self.__next_id, method, args)) + '\n').encode(encoding='UTF-8'))
+            except socket.error as e:
+                self.__notify(CORE_MESSAGE, 'Failed to send to the daemon [%s]' % str(e))
+
+    def __read(self):
+        # Reader thread, takes in events until the connection closes
+        try:
+            f = self.__sock.makefile('rb')
+            while True:
+                line = f.readline(CORE_LINE_MAX)
+                if not line.endswith(b'\n'):
+                    break
+                message = ast.literal_eval(line.decode(encoding='UTF-8'))
+                if message[0] == CORE_EVENT:
+                    self.__event(message[1], message[2])
+        except (socket.error, ValueError, SyntaxError):
+            pass
+        self.__notify(CORE_STATUS, (False, 'Lost connection to the daemon'))
+
+    def __event(self, event, data):
+        """
+        Keep our copy up to date and pass on an event
+
+        Arguments:
+            event   --  CORE_ event type
+            data    --  associated data, event specific
+
+        """
+
+        with self.__lock:
+            if event == CORE_SNAPSHOT:
+                self.__settings, self.__state = data
+                if not self.__ready.is_set():
+                    self.__ready.set()
+                    return
+                # Starting again after falling behind
+                for cfg, items in ((CORE_SETTINGS, self.__settings), (CORE_STATE, self.__state)):
+                    for key, value in items.items():
+                        self.__notify(CORE_CHANGE, (cfg, ((key,), copy.deepcopy(value))))
+                return
+            if event == CORE_CHANGE:
+                cfg, entry = data
+                persist.apply_change(self.__settings if cfg == CORE_SETTINGS else self.__state, copy.deepcopy(entry))
+            self.__notify(event, data)
+
+    def __notify(self, event, data):
+        # Call every listener
+        with self.__lock:
+            if event == CORE_STATUS:
+                self.__status = data
+            elif event == CORE_TX:
+                self.__tx = tuple(data)
+                self.__tx_time = time.time()
+            elif event == CORE_EXT:
+                self.__ext = dict(data)
+            for listener in list(self.__listeners):
+                self.__call(listener, event, data)
+
+    def __call(self, listener, event, data):
+        # A failing listener must not stop the others
+        try:
+            listener(event, data)
+        except Exception as e:
+            print ('Exception [%s][%s]' % (str(e), traceback.format_exc()))
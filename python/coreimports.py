@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# coreimports.py
+#
+# Qt free imports for Antenna switch
+# 
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#    
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#    
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#    
+#  The author can be reached by email at:   
+#     bob@bobcowdery.plus.com
+#
+
+"""
+Everything except the GUI imports from here so the switch
+can run headless without Qt installed. The GUI modules
+import from imports.py which adds Qt to these.
+"""
+
+#=====================================================
+# System imports
+import os,sys
+import traceback
+import socket
+import select
+import pickle
+import ast
+import time
+from time import sleep
+import glob
+import copy
+from os import listdir
+from os.path import isfile, join
+import string
+import threading
+import queue
+import struct
+import asyncio
+import json
+import hashlib
+import base64
+import collections
+import pprint
+pp = pprint.PrettyPrinter(indent=1)
+
+#=====================================================
+# Application imports
+from common import *
+import macrolib
+import interlock
+import persist
+import relayframe
+import relayengine
+import controllers
+import sequencer
+import transaction
+import extcmd
+import statefeed
+import bandfollow
+import pttinput
+import switchcore
+import coreserver
+import coreclient
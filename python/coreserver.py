@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+#
+# coreserver.py
+#
+# Network access to the core of the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+# WebSocket (RFC 6455)
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_TEXT = 0x1
+WS_CONTINUATION = 0x0
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+
+"""
+
+Core server.
+Lets the GUI and other programs drive a SwitchCore, any number at once,
+over TCP on CORE_PORT or WebSocket on CORE_WS_PORT. Everything runs on
+one asyncio loop on this thread.
+
+Over TCP each message is a line, over WebSocket a text message. A request
+is either a Python literal, as in the persistence journal,
+    (req_id, method, args)
+or JSON
+    {"id": req_id, "method": method, "args": [args]}
+where method is one of CORE_METHODS or CORE_SUBSCRIBE/CORE_UNSUBSCRIBE.
+Replies and events go back in the form of the request, or of the subscribe
+request for events:
+    (CORE_REPLY, req_id, success, result)   {"reply": req_id, "ok": success, "result": result}
+    (CORE_EVENT, event, data)               {"event": event, "data": data}
+result is the return value or the error text. A subscriber gets a
+CORE_SNAPSHOT first and then every event the core reports.
+
+Requests from one client are executed in order, off the loop, and each is
+answered within CORE_REPLY_TIMEOUT even if the core is still busy with it.
+Every client has its own queue and writer so a slow one holds up nobody
+else. If one falls CORE_CLIENT_QUEUE events behind, its queued events are
+dropped and it is sent a new snapshot. One that takes nothing for
+CORE_CLIENT_STALL is disconnected.
+
+"""
+class CoreServer (threading.Thread):
+
+    def __init__(self, core, ip = CORE_IP, port = CORE_PORT, ws_port = CORE_WS_PORT):
+        """
+        Constructor
+
+        Arguments
+            core    -- the SwitchCore to serve
+            ip      -- address to listen on
+            port    -- TCP port to listen on
+            ws_port -- WebSocket port to listen on, None for none
+        """
+
+        super(CoreServer, self).__init__()
+
+        self.__core = core
+
+        # Bind now so any error is seen by the caller
+        self.__sock = self.__listen(ip, port)
+        self.__ws_sock = None if ws_port == None else self.__listen(ip, ws_port)
+
+        self.__loop = asyncio.new_event_loop()
+        self.__stop = None
+        self.__connections = set()
+
+        self.__terminate = False
+
+    def address(self):
+        """ Return the (ip, port) actually bound for TCP """
+
+        return self.__sock.getsockname()
+
+    def ws_address(self):
+        """ Return the (ip, port) actually bound for WebSocket or None """
+
+        return None if self.__ws_sock == None else self.__ws_sock.getsockname()
+
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate = True
+        self.__loop.call_soon_threadsafe(self.__shutdown)
+
+    def run(self):
+        asyncio.set_event_loop(self.__loop)
+        try:
+            self.__loop.run_until_complete(self.__serve())
+        finally:
+            self.__loop.close()
+
+    # Loop thread =====================================================================================================
+    async def __serve(self):
+        # Accept clients until terminated
+        self.__stop = asyncio.Event()
+        servers = [await asyncio.start_server(self.__tcp_client, sock=self.__sock, limit=CORE_LINE_MAX)]
+        if self.__ws_sock != None:
+            servers.append(await asyncio.start_server(self.__ws_client, sock=self.__ws_sock, limit=CORE_LINE_MAX))
+        if not self.__terminate:
+            await self.__stop.wait()
+        for server in servers:
+            server.close()
+        for connection in list(self.__connections):
+            connection.close()
+        for server in servers:
+            await server.wait_closed()
+        # Let the client tasks finish
+        while len(self.__connections) > 0:
+            await asyncio.sleep(0.01)
+
+    def __shutdown(self):
+        # Stop serving
+        if self.__stop != None:
+            self.__stop.set()
+
+    async def __tcp_client(self, reader, writer):
+        """
+        Serve one TCP client
+
+        Arguments:
+            reader  --  asyncio StreamReader
+            writer  --  asyncio StreamWriter
+
+        """
+
+        connection = CoreConnection(self.__core, self.__loop, writer, lambda text: (text + '\n').encode(encoding='UTF-8'))
+        self.__connections.add(connection)
+        try:
+            while not connection.closed:
+                line = await reader.readline()
+                if not line.endswith(b'\n'):
+                    # Closed
+                    break
+                await connection.request(line.decode(encoding='UTF-8', errors='replace'))
+        except (ConnectionError, ValueError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            await connection.finish()
+            self.__connections.discard(connection)
+
+    async def __ws_client(self, reader, writer):
+        """
+        Serve one WebSocket client
+
+        Arguments:
+            reader  --  asyncio StreamReader
+            writer  --  asyncio StreamWriter
+
+        """
+
+        try:
+            if not await self.__ws_handshake(reader, writer):
+                writer.close()
+                return
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        connection = CoreConnection(self.__core, self.__loop, writer, lambda text: ws_frame(WS_TEXT, text.encode(encoding='UTF-8')))
+        self.__connections.add(connection)
+        try:
+            message = b''
+            while not connection.closed:
+                fin, opcode, payload = await ws_read_frame(reader)
+                if opcode == WS_CLOSE:
+                    connection.send(ws_frame(WS_CLOSE, payload[:2]))
+                    break
+                elif opcode == WS_PING:
+                    connection.send(ws_frame(WS_PONG, payload))
+                elif opcode in (WS_TEXT, WS_CONTINUATION):
+                    message += payload
+                    if len(message) > CORE_LINE_MAX:
+                        break
+                    if fin:
+                        await connection.request(message.decode(encoding='UTF-8', errors='replace'))
+                        message = b''
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            await connection.finish()
+            self.__connections.discard(connection)
+
+    async def __ws_handshake(self, reader, writer):
+        """
+        Answer the HTTP upgrade request, return True if it was one
+
+        Arguments:
+            reader  --  asyncio StreamReader
+            writer  --  asyncio StreamWriter
+
+        """
+
+        request = await reader.readuntil(b'\r\n\r\n')
+        headers = {}
+        for line in request.decode(encoding='latin-1').split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', '').lower() != 'websocket' or key == None:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            await writer.drain()
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode(encoding='latin-1')).digest()).decode(encoding='latin-1')
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: %s\r\n\r\n' % accept).encode(encoding='latin-1'))
+        await writer.drain()
+        return True
+
+    # Helpers =========================================================================================================
+    def __listen(self, ip, port):
+        # Return a listening TCP socket
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((ip, port))
+        sock.listen()
+        return sock
+
+"""
+
+One client connection, on the loop thread.
+Requests are executed in order, each on an executor thread. Replies and
+events wait in the queue for the writer task. Events from the core come
+in on whatever thread the core is on and are passed to the loop.
+
+"""
+class CoreConnection:
+
+    def __init__(self, core, loop, writer, framer):
+        """
+        Constructor
+
+        Arguments
+            core    -- the SwitchCore to serve
+            loop    -- the asyncio loop
+            writer  -- asyncio StreamWriter
+            framer  -- returns the bytes to send for a message string
+        """
+
+        self.__core = core
+        self.__loop = loop
+        self.__writer = writer
+        self.__framer = framer
+
+        # Waiting to be written, [(bytes, True if an event), ...]
+        self.__out = collections.deque()
+        self.__events = 0
+        self.__wake = asyncio.Event()
+        self.__write_task = loop.create_task(self.__write())
+
+        # Events go out in the form of the subscribe request, JSON or not
+        self.__json = False
+        # Each subscription has its own listener, so anything from an
+        # older one can be recognised and ignored
+        self.__listener = None
+        # Times the client has fallen too far behind
+        self.overflows = 0
+        self.closed = False
+        self.__finishing = False
+
+    def send(self, data):
+        """
+        Queue bytes already framed, e.g. a WebSocket control frame
+
+        Arguments:
+            data    --  bytes to send
+
+        """
+
+        self.__push(data, False)
+
+    def close(self):
+        """ Close the connection at once, the client task then finishes """
+
+        if not self.closed:
+            self.closed = True
+            self.__writer.close()
+            self.__wake.set()
+
+    async def request(self, text):
+        """
+        Execute one request and queue the reply
+
+        Arguments:
+            text    --  request as received
+
+        """
+
+        req_id = None
+        is_json = text.lstrip().startswith('{')
+        try:
+            if is_json:
+                request = json.loads(text)
+                req_id, method, args = request.get('id'), request['method'], tuple(request.get('args', ()))
+            else:
+                req_id, method, args = ast.literal_eval(text)
+            if method == CORE_SUBSCRIBE:
+                self.__json = is_json
+                result = await self.__subscribe()
+            elif method == CORE_UNSUBSCRIBE:
+                result = await self.__unsubscribe()
+            elif method in CORE_METHODS:
+                result = await asyncio.wait_for(self.__loop.run_in_executor(None, lambda: getattr(self.__core, method)(*args)), CORE_REPLY_TIMEOUT)
+            else:
+                raise ValueError('Unknown method %s' % str(method))
+            reply = (req_id, True, result)
+        except asyncio.TimeoutError:
+            reply = (req_id, False, 'Timeout, the request may still complete')
+        except Exception as e:
+            reply = (req_id, False, str(e))
+        if is_json:
+            self.__push(self.__framer(json.dumps({'reply': reply[0], 'ok': reply[1], 'result': reply[2]}, default=str)), False)
+        else:
+            self.__push(self.__framer(repr((CORE_REPLY,) + reply)), False)
+
+    async def finish(self):
+        """ Tidy up once the client has gone or is done """
+
+        await self.__unsubscribe()
+        # Send anything still queued, e.g. a close frame
+        self.__finishing = True
+        self.__wake.set()
+        await self.__write_task
+        self.close()
+
+    # Helpers =========================================================================================================
+    async def __subscribe(self):
+        # Start, or restart, sending events
+        await self.__unsubscribe()
+        listener = lambda event, data: self.__event(listener, event, data)
+        self.__listener = listener
+        # The snapshot is queued before this returns
+        await self.__loop.run_in_executor(None, self.__core.attach, listener)
+        return True
+
+    async def __unsubscribe(self):
+        # Stop sending events
+        if self.__listener != None:
+            listener, self.__listener = self.__listener, None
+            await self.__loop.run_in_executor(None, self.__core.detach, listener)
+        return True
+
+    def __event(self, listener, event, data):
+        # Core listener, any thread. Encode now as the data may change later.
+        if self.__json:
+            text = json.dumps({'event': event, 'data': data}, default=str)
+        else:
+            text = repr((CORE_EVENT, event, data))
+        try:
+            self.__loop.call_soon_threadsafe(self.__queue_event, listener, self.__framer(text))
+        except RuntimeError:
+            # Loop closed
+            pass
+
+    def __queue_event(self, listener, data):
+        # Queue an event from the current subscription
+        if listener is not self.__listener or self.closed:
+            return
+        if self.__events >= CORE_CLIENT_QUEUE:
+            # Too slow, drop its events and start it again from a snapshot
+            self.overflows += 1
+            self.__out = collections.deque(item for item in self.__out if not item[1])
+            self.__events = 0
+            self.__loop.create_task(self.__subscribe())
+            return
+        self.__push(data, True)
+
+    def __push(self, data, is_event):
+        # Queue for the writer
+        if self.closed:
+            return
+        self.__out.append((data, is_event))
+        if is_event:
+            self.__events += 1
+        self.__wake.set()
+
+    async def __write(self):
+        # Writer task, sends whatever is queued
+        try:
+            while True:
+                while len(self.__out) == 0 and not self.closed and not self.__finishing:
+                    self.__wake.clear()
+                    await self.__wake.wait()
+                if self.closed or len(self.__out) == 0:
+                    return
+                data, is_event = self.__out.popleft()
+                if is_event:
+                    self.__events -= 1
+                self.__writer.write(data)
+                await asyncio.wait_for(self.__writer.drain(), CORE_CLIENT_STALL)
+        except (ConnectionError, asyncio.TimeoutError):
+            self.close()
+
+#======================================================================================================================
+# WebSocket framing
+def ws_frame(opcode, payload):
+    """
+    Return a complete unmasked frame as the server sends them
+
+    Arguments:
+        opcode  --  WS_ frame type
+        payload --  frame bytes
+
+    """
+
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('>BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+async def ws_read_frame(reader):
+    """
+    Read one frame from a client, return (final, opcode, payload)
+
+    Arguments:
+        reader  --  asyncio StreamReader
+
+    """
+
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', await reader.readexactly(8))[0]
+    if length > CORE_LINE_MAX:
+        raise ValueError('Frame too long')
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask != None and length > 0:
+        # Unmask all at once as big integers
+        mask = (mask * (length // 4 + 1))[:length]
+        payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(length, 'big')
+    return bool(first & 0x80), first & 0x0F, payload
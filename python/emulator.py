@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+#
+# emulator.py
+#
+# Local stand-in for the Antenna Switch Arduino sketch
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Standalone, system imports only so this runs without Qt
+import sys
+import traceback
+import socket
+import threading
+import random
+import time
+import heapq
+import collections
+import select
+import argparse
+import relayframe
+
+# Defaults
+EMULATOR_IP = '127.0.0.1'
+EMULATOR_PORT = 8888
+EMULATOR_RELAYS = 16
+# Number of clients remembered for duplicate suppression
+EMULATOR_CLIENTS = 4
+# Sequence numbers remembered for each, as the sketch SEQ_WINDOW
+EMULATOR_SEQ_WINDOW = 8
+# The sketch loop() ends with delay(100)
+SKETCH_LOOP_DELAY = 0.1 # s
+
+"""
+
+Arduino emulator.
+Implements the sketch_udp_antsw.ino command set on a local UDP port so the
+client can be exercised without hardware. Like the sketch it handles at most
+one packet per loop followed by the loop delay, the rest wait in the socket
+buffer. Packet loss, latency, jitter and reordering can be injected. Binary
+frames can be turned off to emulate older firmware.
+
+"""
+class ArduinoEmulator (threading.Thread):
+
+    def __init__(self, ip = EMULATOR_IP, port = EMULATOR_PORT, loss = 0.0, latency = 0.0, jitter = 0.0, reorder = 0.0, loop_delay = SKETCH_LOOP_DELAY, binary = True):
+        """
+        Constructor
+
+        Arguments
+            ip          -- address to listen on
+            port        -- port to listen on
+            loss        -- probability 0-1 of dropping each packet in either direction
+            latency     -- seconds added before each reply
+            jitter      -- up to this many seconds added at random to the latency
+            reorder     -- probability 0-1 of holding a packet back behind the next one
+            loop_delay  -- seconds per loop, 0 to answer as fast as possible
+            binary      -- False to ignore binary frames as older firmware does
+        """
+
+        super(ArduinoEmulator, self).__init__()
+        self.daemon = True
+
+        self.__loss = loss
+        self.__latency = latency
+        self.__jitter = jitter
+        self.__reorder = reorder
+        self.__loop_delay = loop_delay
+        self.__binary = binary
+
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.bind((ip, port))
+        self.__sock.setblocking(False)
+
+        # Packet held back to be processed after the next one
+        self.__held = None
+        self.__overtaken = None
+        # Replies waiting for their delivery time
+        # [(due, order, data, addr), ...] as a heap
+        self.__replies = []
+        self.__reply_order = 0
+        self.__reply_cv = threading.Condition()
+        self.__sender = threading.Thread(target=self.__send_replies)
+        self.__sender.daemon = True
+
+        # Relay state, True is energised. Index 0 unused.
+        self.relays = [False] * (EMULATOR_RELAYS + 1)
+        # Packets received and commands executed
+        self.received = 0
+        self.executed = 0
+        # Duplicate suppression
+        # [(addr, deque of recent seqs), ...]
+        self.__clients = []
+
+        self.__terminate = False
+
+    def address(self):
+        """ Return the (ip, port) actually bound """
+
+        return self.__sock.getsockname()
+
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate = True
+        with self.__reply_cv:
+            self.__reply_cv.notify()
+
+    def run(self):
+        self.__sender.start()
+        while not self.__terminate:
+            if self.__loop_delay == 0:
+                # Nothing to pace so just wait for a packet, or a short while if one is held
+                if self.__held != None:
+                    select.select([self.__sock], [], [], 0.01)
+                elif self.__overtaken == None:
+                    select.select([self.__sock], [], [], 0.5)
+            packet = self.__next_packet()
+            if packet != None:
+                self.received += 1
+                self.__packet(*packet)
+            if self.__loop_delay > 0:
+                time.sleep(self.__loop_delay)
+        self.__sock.close()
+
+    def __next_packet(self):
+        # Return the next (data, addr) to process or None, applying loss and reordering
+        if self.__overtaken != None:
+            # A held packet that has now been overtaken
+            packet, self.__overtaken = self.__overtaken, None
+            return packet
+        try:
+            data, addr = self.__sock.recvfrom(1024)
+        except (BlockingIOError, socket.error):
+            # Nothing new, release anything held back
+            packet, self.__held = self.__held, None
+            return packet
+        if random.random() < self.__loss:
+            # Lost on the way in
+            return None
+        packet = (data, addr)
+        if self.__held != None:
+            # This one overtakes the held packet, which goes next
+            self.__overtaken, self.__held = self.__held, None
+            return packet
+        if random.random() < self.__reorder:
+            self.__held = packet
+            return None
+        return packet
+
+    def __packet(self, packet, addr):
+        """
+        Process one packet as the sketch loop() does
+
+        Arguments:
+            packet  --  packet bytes
+            addr    --  sender address
+
+        """
+
+        if relayframe.is_frame(packet):
+            if self.__binary:
+                self.__frame(packet, addr)
+            return
+        packet = packet.decode(encoding='UTF-8', errors='replace')
+        # Split off any sequence number, "#<seq>:<command>"
+        command = packet
+        seq = None
+        if packet.startswith('#'):
+            head, _, command = packet[1:].partition(':')
+            try:
+                seq = int(head)
+            except ValueError:
+                seq = 0
+        if seq != None and self.__is_duplicate(seq, addr):
+            # Already executed, repeat the reply
+            if command == 'ping':
+                self.__reply('awake', seq, addr)
+            elif command == 'status':
+                self.__reply(self.__status(), seq, addr)
+            elif command == relayframe.FRAME_PROBE and self.__binary:
+                self.__reply('%s=%d' % (relayframe.FRAME_PROBE, relayframe.FRAME_VERSION), seq, addr)
+        else:
+            self.__execute(command, seq, addr)
+        self.__reply('ack', seq, addr)
+
+    def __execute(self, command, seq, addr):
+        # Execute a command as the sketch execute() does
+        self.executed += 1
+        if command == 'ping':
+            self.__reply('awake', seq, addr)
+            return
+        if command == 'status':
+            self.__reply(self.__status(), seq, addr)
+            return
+        if command == relayframe.FRAME_PROBE and self.__binary:
+            self.__reply('%s=%d' % (relayframe.FRAME_PROBE, relayframe.FRAME_VERSION), seq, addr)
+            return
+        changes = {}
+        self.__parse(command, changes)
+        self.__apply(changes)
+
+    def __parse(self, command, changes):
+        # Accumulate "1e2d3e..." into {relay_id: energise}
+        value = 0
+        for c in command:
+            if c.isdigit():
+                value = value*10 + int(c)
+            elif c in ('e', 'd'):
+                if 1 <= value <= EMULATOR_RELAYS:
+                    changes[value] = (c == 'e')
+                value = 0
+
+    def __apply(self, changes):
+        # All changes at once as the sketch writes the ports
+        for relay_id, energise in changes.items():
+            self.relays[relay_id] = energise
+
+    def __frame(self, packet, addr):
+        # Execute a binary frame, the reply is a frame with the relay state
+        frame = relayframe.decode(packet)
+        if frame == None:
+            # Corrupt, say nothing and the client will retransmit
+            return
+        seq, mask_a, mask_b = frame
+        if not self.__is_duplicate(seq, addr):
+            self.executed += 1
+            changes = {}
+            for relay_id in range(1, EMULATOR_RELAYS + 1):
+                bit = 1 << (relay_id - 1)
+                if mask_a & bit:
+                    changes[relay_id] = True
+                elif mask_b & bit:
+                    changes[relay_id] = False
+            self.__apply(changes)
+        self.__queue(relayframe.encode(seq, self.__mask(), 0), addr)
+
+    def __mask(self):
+        # Energised relays, bit 0 = relay 1
+        mask = 0
+        for relay_id in range(1, EMULATOR_RELAYS + 1):
+            if self.relays[relay_id]:
+                mask |= 1 << (relay_id - 1)
+        return mask
+
+    def __status(self):
+        # Relay read back as "status=XXXX"
+        return 'status=%04X' % self.__mask()
+
+    def __is_duplicate(self, seq, addr):
+        # True if this is a repeat of a recent sequence number from this client
+        for client, recent in self.__clients:
+            if client == addr:
+                if seq in recent:
+                    return True
+                recent.append(seq)
+                return False
+        self.__clients.append((addr, collections.deque([seq], EMULATOR_SEQ_WINDOW)))
+        if len(self.__clients) > EMULATOR_CLIENTS:
+            self.__clients.pop(0)
+        return False
+
+    def __reply(self, text, seq, addr):
+        # Queue a text reply
+        if seq != None:
+            text = '%s:%d' % (text, seq)
+        self.__queue(text.encode(encoding='UTF-8'), addr)
+
+    def __queue(self, data, addr):
+        # Queue a reply subject to loss, latency, jitter and reordering
+        if random.random() < self.__loss:
+            # Lost on the way out
+            return
+        delay = self.__latency + random.uniform(0, self.__jitter)
+        if random.random() < self.__reorder:
+            # Deliver after the replies that follow it
+            delay += self.__latency + self.__jitter + 0.01
+        with self.__reply_cv:
+            self.__reply_order += 1
+            heapq.heappush(self.__replies, (time.time() + delay, self.__reply_order, data, addr))
+            self.__reply_cv.notify()
+
+    def __send_replies(self):
+        # Reply sender thread, sends each reply when it is due
+        with self.__reply_cv:
+            while not self.__terminate:
+                if len(self.__replies) == 0:
+                    self.__reply_cv.wait()
+                    continue
+                wait = self.__replies[0][0] - time.time()
+                if wait > 0:
+                    self.__reply_cv.wait(wait)
+                    continue
+                due, order, data, addr = heapq.heappop(self.__replies)
+                try:
+                    self.__sock.sendto(data, addr)
+                except socket.error:
+                    pass
+
+#======================================================================================================================
+# Main code
+def main():
+
+    try:
+        parser = argparse.ArgumentParser(description='Antenna switch Arduino emulator')
+        parser.add_argument('--ip', default=EMULATOR_IP, help='address to listen on')
+        parser.add_argument('--port', type=int, default=EMULATOR_PORT, help='port to listen on')
+        parser.add_argument('--loss', type=float, default=0.0, help='packet loss probability 0-1')
+        parser.add_argument('--latency', type=float, default=0.0, help='reply latency in ms')
+        parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency up to this in ms')
+        parser.add_argument('--reorder', type=float, default=0.0, help='packet reorder probability 0-1')
+        parser.add_argument('--loop', type=float, default=SKETCH_LOOP_DELAY * 1000.0, help='loop delay in ms, 0 for none')
+        parser.add_argument('--text-only', action='store_true', help='ignore binary frames as older firmware does')
+        args = parser.parse_args()
+
+        emulator = ArduinoEmulator(args.ip, args.port, args.loss, args.latency / 1000.0, args.jitter / 1000.0, args.reorder, args.loop / 1000.0, not args.text_only)
+        emulator.start()
+        print('Emulator listening on %s:%d' % emulator.address())
+        while emulator.is_alive():
+            emulator.join(1.0)
+
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print ('Exception [%s][%s]' % (str(e), traceback.format_exc()))
+
+# Entry point
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+#
+# extcmd.py
+#
+# External command listener for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+
+External command thread.
+Receive switch commands from an external program, e.g. a contest logger.
+
+A datagram holds one or more commands separated by ';', optionally after
+a correlation id "#<id>:" which is echoed in the reply:
+    switch:N            run macro N, 1 based so 1 to MAX_MACROS are the buttons
+    macro:NAME          run the macro named NAME, ignoring case
+    set:R[,R...]        energise relays
+    clear:R[,R...]      de-energise relays
+    query               nothing, just the reply
+    ping                nothing, answered "pong"
+The commands run in order. Once any relay changes they made have been
+acknowledged by the controllers, or have failed, one datagram goes back:
+    [#<id>:]<result>;<result>;...;latency=<wait>,<total>;state=<template>:<relays>
+with one result per command, "ok", "pong", "held" or "error=<reason>", the ms the
+datagram waited in the queue and the ms until the reply, and the relays
+of the template in use as the sketch command has them, "1e2d3d...".
+A command refused by the interlock gives the reason from its rule.
+While transmitting relay changes are held, a command making one is
+answered "held" at once and the state shows the relays as they will be.
+
+Datagrams are received on this thread and executed in order on another
+so a burst is never lost. Up to EXT_QUEUE_SIZE may wait, beyond that each
+is refused at once with "error=queue full". With EXT_LATEST_MACRO a run of
+queued datagrams that only run macros is cut to the last of them, the
+others are answered "error=superseded" with the state it left.
+Commands from within, e.g. the band follower, are queued with submit()
+and take the same path.
+
+"""
+class ExtCmdThrd (threading.Thread):
+    
+    def __init__(self, core, coalesce = EXT_EXECUTE_ALL, counts_callback = None):
+        """
+        Constructor
+        
+        Arguments
+            core            -- the SwitchCore to command
+            coalesce        -- EXT_EXECUTE_ALL | EXT_LATEST_MACRO
+            counts_callback -- callback here with counts() each time the queue empties
+        """
+
+        super(ExtCmdThrd, self).__init__()
+        
+        self.__core = core
+        self.__coalesce = coalesce
+        self.__counts_callback = counts_callback
+        
+        # Datagrams waiting to execute
+        # [(text, addr, time received), ...]
+        self.__queue = collections.deque()
+        self.__cv = threading.Condition()
+        self.__executor = threading.Thread(target=self.__execute_queue)
+        # Datagrams received, executed, superseded and refused
+        self.received = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.overflows = 0
+        # Longest ms waiting in the queue
+        self.max_wait = 0.0
+        
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.bind((EXT_UDP_IP, EXT_UDP_PORT))
+        # Short so terminate is not held up
+        self.__sock.settimeout(0.5)
+        
+        self.__terminate = False
+    
+    def submit(self, text):
+        """
+        Queue commands as if received, there is no reply
+
+        Arguments:
+            text    --  datagram text
+
+        Returns False if the queue is full
+
+        """
+
+        with self.__cv:
+            self.received += 1
+            if len(self.__queue) < EXT_QUEUE_SIZE:
+                self.__queue.append((text, None, time.time()))
+                self.__cv.notify()
+                return True
+            self.overflows += 1
+            return False
+
+    def counts(self):
+        """
+        Return {CORE_EXT_RECEIVED: n, CORE_EXT_EXECUTED: n, CORE_EXT_COALESCED: n,
+        CORE_EXT_OVERFLOWS: n, CORE_EXT_MAX_WAIT: ms}
+        """
+
+        with self.__cv:
+            return {
+                CORE_EXT_RECEIVED: self.received,
+                CORE_EXT_EXECUTED: self.executed,
+                CORE_EXT_COALESCED: self.coalesced,
+                CORE_EXT_OVERFLOWS: self.overflows,
+                CORE_EXT_MAX_WAIT: round(self.max_wait, 1),
+            }
+
+    def terminate(self):
+        """ Terminate thread """
+        
+        with self.__cv:
+            self.__terminate = True
+            self.__cv.notify()
+        
+    def run(self):
+        self.__executor.start()
+        # We listen on UDP for switch commands
+        while not self.__terminate:
+            try:
+                data, addr = self.__sock.recvfrom(1024) # buffer size is 1024 bytes
+            except socket.timeout:
+                continue
+            received = time.time()
+            text = data.decode(encoding='UTF-8', errors='replace')
+            with self.__cv:
+                self.received += 1
+                if len(self.__queue) < EXT_QUEUE_SIZE:
+                    self.__queue.append((text, addr, received))
+                    self.__cv.notify()
+                    continue
+                self.overflows += 1
+            self.__reply(text, ['error=queue full'], received, received, addr)
+        self.__executor.join()
+        self.__sock.close()
+
+    def __execute_queue(self):
+        # Executor thread, runs each datagram in turn
+        while True:
+            with self.__cv:
+                while len(self.__queue) == 0 and not self.__terminate:
+                    self.__cv.wait()
+                if self.__terminate:
+                    return
+                text, addr, received = self.__queue.popleft()
+                superseded = []
+                if self.__coalesce == EXT_LATEST_MACRO:
+                    while len(self.__queue) > 0 and self.__is_macro(text) and self.__is_macro(self.__queue[0][0]):
+                        superseded.append((text, addr, received))
+                        text, addr, received = self.__queue.popleft()
+                    self.coalesced += len(superseded)
+            started = time.time()
+            self.max_wait = max(self.max_wait, (started - received) * 1000.0)
+            self.__reply(text, self.__execute(text), received, started, addr)
+            self.executed += 1
+            for text, addr, received in superseded:
+                self.__reply(text, ['error=superseded'], received, started, addr)
+            if self.__counts_callback != None and len(self.__queue) == 0:
+                self.__counts_callback(self.counts())
+
+    # Helpers =========================================================================================================
+    def __split(self, text):
+        # Return ("#<id>:" or "", [command, ...])
+        text = text.strip()
+        if text.startswith('#'):
+            req_id, _, text = text.partition(':')
+            return req_id + ':', [command.strip() for command in text.split(';')]
+        return '', [command.strip() for command in text.split(';')]
+
+    def __is_macro(self, text):
+        # True if a datagram only runs macros
+        return all(command.partition(':')[0].strip().lower() in ('switch', 'macro') for command in self.__split(text)[1])
+
+    def __execute(self, text):
+        """
+        Execute the commands in one datagram
+
+        Arguments:
+            text    --  datagram as received
+
+        Returns [result, ...]
+
+        """
+
+        results = []
+        # Results of commands that changed relays, decided once they are made
+        switched = []
+        for command in self.__split(text)[1]:
+            try:
+                result, switching = self.__command(command)
+            except Exception as e:
+                result, switching = 'error=%s' % str(e), False
+            results.append(result)
+            if switching:
+                switched.append(len(results) - 1)
+        if len(switched) > 0:
+            if self.__core.query()[CORE_TRANSMITTING]:
+                # Made when PTT drops, no point waiting
+                for index in switched:
+                    results[index] = 'held'
+            elif not self.__core.wait(EXT_REPLY_TIMEOUT):
+                for index in switched:
+                    results[index] = 'error=relays not acknowledged'
+        return results
+
+    def __reply(self, text, results, received, started, addr):
+        """
+        Answer a datagram
+
+        Arguments:
+            text        --  datagram as received
+            results     --  [result, ...]
+            received    --  time it was received
+            started     --  time it started to execute
+            addr        --  address to answer
+
+        """
+
+        if addr == None:
+            # Submitted, nobody to answer
+            return
+        # The reply is split on ';'
+        results = [result.replace(';', ',') for result in results]
+        latency = 'latency=%.0f,%.0f' % ((started - received) * 1000.0, (time.time() - received) * 1000.0)
+        reply = self.__split(text)[0] + ';'.join(results + [latency, self.__state()])
+        try:
+            self.__sock.sendto(reply.encode(encoding='UTF-8'), addr)
+        except socket.error:
+            pass
+
+    def __command(self, command):
+        """
+        Execute one command
+
+        Arguments:
+            command --  command text
+
+        Returns (result, True if relays may change)
+
+        """
+
+        name, _, arg = command.partition(':')
+        name = name.strip().lower()
+        if name == 'switch':
+            # The call is zero based but the UI is 1 based
+            macro_id = int(arg) - 1
+            if not self.__core.execute_macro(macro_id):
+                return 'error=%s' % (self.__core.check(macro_id = macro_id) or 'no macro %d' % (macro_id + 1)), False
+            return 'ok', True
+        if name == 'macro':
+            macro_id = self.__core.find_macro(arg)
+            if macro_id == None:
+                return 'error=no macro %s' % arg.strip(), False
+            if not self.__core.execute_macro(macro_id):
+                return 'error=%s' % (self.__core.check(macro_id = macro_id) or 'no macro %s' % arg.strip()), False
+            return 'ok', True
+        if name in ('set', 'clear'):
+            contact_state = RELAY_ON if name == 'set' else RELAY_OFF
+            relays = {int(relay_id): contact_state for relay_id in arg.split(',') if len(relay_id.strip()) > 0}
+            if not self.__core.set_relays(relays):
+                return 'error=%s' % (self.__core.check(relays) or 'cannot %s relays %s' % (name, arg.strip())), False
+            return 'ok', True
+        if name == 'query':
+            return 'ok', False
+        if name == 'ping':
+            return 'pong', False
+        return 'error=unknown command %s' % command, False
+
+    def __state(self):
+        # The template in use and its relays as "state=<template>:1e2d..."
+        state = self.__core.query()
+        relays = state[RELAYS]
+        return 'state=%s:%s' % (state[TEMPLATE], ''.join('%d%s' % (relay_id, 'e' if relays[relay_id] == RELAY_ON else 'd') for relay_id in sorted(relays)))
@@ -42,6 +42,9 @@ from imports import *
 
 class HotImageWidget(QWidget):
     
+    # Emitted with (width, height) when the image size changes
+    dims_changed = pyqtSignal(int, int)
+    
     def __init__(self, image_path, runtime_callback, config_callback):
         """
         Constructor
@@ -66,6 +69,9 @@ class HotImageWidget(QWidget):
         self.__pos2 = None              # switch position end
         self.__width = None             # Width of pixmap
         self.__height = None            # Height of pixmap
+        self.__reported_dims = None     # Last dimensions sent to dims_changed
+        self.__pixmap = None            # Decoded template image
+        self.__layer = None             # Template image with the switch positions drawn on it
         
         # {
         #   relay-id: {
@@ -78,11 +84,15 @@ class HotImageWidget(QWidget):
         #   relay-id: {...}, ...
         # }
         self.__hotspots = None
+        self.__index = None                 # HotspotIndex over the hotspots
         self.__current_hotspot = None       # set to hotspot when highlight required
         self.__no_draw = False              # don't draw on the image
         self.__ignore_right = True          # ignore the right button
         self.__draw_switch_positions = {}   # switch position drawing params
         
+        # Decode the image once, painting only uses the cached copy
+        self.__load_image()
+        
         # Install the filter
         self.installEventFilter(self)
         self.setMouseTracking(True)
@@ -114,6 +124,11 @@ class HotImageWidget(QWidget):
         
         self.__hotspots = hotspot_list
         self.__relay_state = relay_state
+        # Index the hotspot areas for hit-testing
+        if self.__hotspots != None:
+            self.__index = HotspotIndex(self.__hotspots)
+        else:
+            self.__index = None
         self.__draw_switch_positions = {}
         # Now we have some hotspots we can draw the switch ID and its NC contact
         if self.__hotspots != None:
@@ -124,8 +139,11 @@ class HotImageWidget(QWidget):
                     self.__draw_switch_positions[id] = (((hotspot[CONFIG_HOTSPOT_COMMON][X], hotspot[CONFIG_HOTSPOT_COMMON][Y]), (hotspot[CONFIG_HOTSPOT_NC][X], hotspot[CONFIG_HOTSPOT_NC][Y])))
                 else:
                     self.__draw_switch_positions[id] = (((hotspot[CONFIG_HOTSPOT_COMMON][X], hotspot[CONFIG_HOTSPOT_COMMON][Y]), (hotspot[CONFIG_HOTSPOT_NO][X], hotspot[CONFIG_HOTSPOT_NO][Y])))
-                # Force a repaint
-                self.repaint()               
+        # Any highlight belonged to the old hotspots
+        self.__current_hotspot = None
+        # Redraw the switch layer
+        self.__layer = None
+        self.update()
 
     def set_new_image(self, image_path):
         """
@@ -137,8 +155,8 @@ class HotImageWidget(QWidget):
         """
         
         self.__image_path = image_path
-        # Force a repaint
-        self.repaint()
+        self.__load_image()
+        self.update()
     
     def get_dims(self):
         """ Return the pixmap dimentions """
@@ -161,7 +179,8 @@ class HotImageWidget(QWidget):
                 self.__draw_switch_positions[relay_id] = (((hotspot[CONFIG_HOTSPOT_COMMON][X], hotspot[CONFIG_HOTSPOT_COMMON][Y]), (hotspot[CONFIG_HOTSPOT_NC][X], hotspot[CONFIG_HOTSPOT_NC][Y])))
             else:
                 self.__draw_switch_positions[relay_id] = (((hotspot[CONFIG_HOTSPOT_COMMON][X], hotspot[CONFIG_HOTSPOT_COMMON][Y]), (hotspot[CONFIG_HOTSPOT_NO][X], hotspot[CONFIG_HOTSPOT_NO][Y])))
-            self.repaint()
+            self.__layer = None
+            self.update()
         
 # Private Interface
 #==========================================================================================
@@ -179,43 +198,39 @@ class HotImageWidget(QWidget):
         
         qp = QPainter()
         qp.begin(self)
-        self.drawWidget(qp)
+        self.drawWidget(qp, e.rect())
         qp.end()
 
-    def drawWidget(self, qp):
+    def drawWidget(self, qp, rect):
         """
         Custom drawing over the background image
         
         Arguments:
-            qp    --  context
+            qp      --  context
+            rect    --  area to repaint
             
         """
         
-        # The widget is just the image
-        pix = QPixmap(self.__image_path)
-        self.__width = pix.width()
-        self.__height = pix.height()
-        qp.eraseRect(QRect(0,0,self.__width,self.__height))
+        # Let the owner know if the image size has changed
+        if (self.__width, self.__height) != self.__reported_dims:
+            self.__reported_dims = (self.__width, self.__height)
+            self.dims_changed.emit(self.__width, self.__height)
         
-        # Take the whole allocated area
-        qp.drawPixmap(0,0,pix)
+        # The widget is just the image with the switch positions
+        if self.__layer == None:
+            self.__render_layer()
+        qp.eraseRect(rect)
+        # Only copy the area that needs repainting
+        qp.drawPixmap(rect, self.__layer, rect)
         
-        # See if we need to draw switch positions
-        for id, position in self.__draw_switch_positions.items():
-            pen = QPen(QColor(255, 0, 0))
-            pen.setWidth(2)
-            qp.setPen(pen)
-            if position[0][0] != None and position[0][1] != None and position[1][0] != None and position[1][1] != None:
-                qp.drawLine(position[0][0], position[0][1], position[1][0], position[1][1])               
         # See if we need to highlight a hotspot
         if self.__current_hotspot != None:
-            pen = QPen(QColor(255, 0, 0))
-            pen.setWidth(2)
-            qp.setPen(pen)
-            qp.drawRect(self.__current_hotspot[CONFIG_HOTSPOT_TOPLEFT][X] - 3,
-                        self.__current_hotspot[CONFIG_HOTSPOT_TOPLEFT][Y] - 3,
-                        self.__current_hotspot[CONFIG_HOTSPOT_BOTTOMRIGHT][X] - self.__current_hotspot[CONFIG_HOTSPOT_TOPLEFT][X] + 6,
-                        self.__current_hotspot[CONFIG_HOTSPOT_BOTTOMRIGHT][Y] - self.__current_hotspot[CONFIG_HOTSPOT_TOPLEFT][Y] + 6)
+            highlight = self.__highlight_rect(self.__current_hotspot)
+            if highlight.intersects(rect):
+                pen = QPen(QColor(255, 0, 0))
+                pen.setWidth(2)
+                qp.setPen(pen)
+                qp.drawRect(highlight)
 
     def eventFilter(self, source, event):
         """
@@ -237,11 +252,10 @@ class HotImageWidget(QWidget):
                 # See if we have entered or left a hotspot
                 if not self.__no_draw:
                     if self.__hotspots != None:
-                        self.__current_hotspot = None
                         id, hotspot = self.__locate(event.pos())
-                        if id != -1:
-                            self.__current_hotspot = hotspot
-                        self.repaint()
+                        # Only repaint when the hotspot changes
+                        if hotspot is not self.__current_hotspot:
+                            self.__set_highlight(hotspot)
         
         # Action on mouse buttons       
         if event.type() == QEvent.MouseButtonPress:
@@ -261,33 +275,140 @@ class HotImageWidget(QWidget):
                             self.__draw_switch_positions[id] = (((hotspot[CONFIG_HOTSPOT_COMMON][X], hotspot[CONFIG_HOTSPOT_COMMON][Y]), (hotspot[CONFIG_HOTSPOT_NC][X], hotspot[CONFIG_HOTSPOT_NC][Y])))
                         else:
                             self.__draw_switch_positions[id] = (((hotspot[CONFIG_HOTSPOT_COMMON][X], hotspot[CONFIG_HOTSPOT_COMMON][Y]), (hotspot[CONFIG_HOTSPOT_NO][X], hotspot[CONFIG_HOTSPOT_NO][Y])))
-                        self.repaint()
+                        self.__layer = None
+                        self.update()
                         self.__runtime_callback(RUNTIME_RELAY_UPDATE, (id, contact_state))
         return QMainWindow.eventFilter(self, source, event)
 
 # Helpers
 #==========================================================================================
+    def __load_image(self):
+        """ Decode the template image and invalidate the switch layer """
+        
+        if self.__image_path != None:
+            self.__pixmap = QPixmap(self.__image_path)
+        else:
+            self.__pixmap = QPixmap()
+        self.__width = self.__pixmap.width()
+        self.__height = self.__pixmap.height()
+        self.__layer = None
+    
+    def __render_layer(self):
+        """ Draw the switch positions onto a copy of the template image """
+        
+        self.__layer = QPixmap(self.__pixmap)
+        if self.__layer.isNull():
+            return
+        qp = QPainter()
+        qp.begin(self.__layer)
+        pen = QPen(QColor(255, 0, 0))
+        pen.setWidth(2)
+        qp.setPen(pen)
+        for id, position in self.__draw_switch_positions.items():
+            if position[0][0] != None and position[0][1] != None and position[1][0] != None and position[1][1] != None:
+                qp.drawLine(position[0][0], position[0][1], position[1][0], position[1][1])
+        qp.end()
+    
+    def __highlight_rect(self, hotspot):
+        """
+        Return the highlight rectangle for a hotspot
+        
+        Arguments:
+            hotspot --  hotspot to highlight
+                
+        """
+        
+        return QRect(hotspot[CONFIG_HOTSPOT_TOPLEFT][X] - 3,
+                     hotspot[CONFIG_HOTSPOT_TOPLEFT][Y] - 3,
+                     hotspot[CONFIG_HOTSPOT_BOTTOMRIGHT][X] - hotspot[CONFIG_HOTSPOT_TOPLEFT][X] + 6,
+                     hotspot[CONFIG_HOTSPOT_BOTTOMRIGHT][Y] - hotspot[CONFIG_HOTSPOT_TOPLEFT][Y] + 6)
+    
+    def __set_highlight(self, hotspot):
+        """
+        Move the highlight, repainting only the old and new areas
+        
+        Arguments:
+            hotspot --  hotspot to highlight or None
+                
+        """
+        
+        # Allow for the pen width
+        if self.__current_hotspot != None:
+            self.update(self.__highlight_rect(self.__current_hotspot).adjusted(-2, -2, 2, 2))
+        self.__current_hotspot = hotspot
+        if self.__current_hotspot != None:
+            self.update(self.__highlight_rect(self.__current_hotspot).adjusted(-2, -2, 2, 2))
+    
     def __locate(self, pos):
         """
-        Draw the switch ID
+        Find the hotspot under the given position
         
         Arguments:
-            x       --  top left X
-            y       --  top left Y
-            label   --  text to write
+            pos     --  QPoint position
+        
+        Returns (id, hotspot) or (-1, None)
                 
         """
+        
+        if self.__index == None:
+            return -1, None
+        return self.__index.locate(pos.x(), pos.y())
+
+"""
+
+Uniform grid index over the hotspot rectangles.
+Each grid cell holds the hotspots that overlap it so a lookup only
+tests the few candidates in one cell. Where hotspots overlap the one
+with the smallest area wins, then the lowest relay id.
+
+"""
+class HotspotIndex:
+    
+    def __init__(self, hotspots, cell = HOTSPOT_CELL):
+        """
+        Constructor
+        
+        Arguments:
+            hotspots    --  dictionary of id against hotspots
+            cell        --  grid cell size in pixels
             
-        for id, hotspot in self.__hotspots.items():
-            if  hotspot[CONFIG_HOTSPOT_TOPLEFT][X] != None and\
-                hotspot[CONFIG_HOTSPOT_TOPLEFT][Y] != None and\
-                hotspot[CONFIG_HOTSPOT_BOTTOMRIGHT][X] != None and\
-                hotspot[CONFIG_HOTSPOT_BOTTOMRIGHT][Y] != None:
-                if  pos.x() >= hotspot[CONFIG_HOTSPOT_TOPLEFT][X] and\
-                    pos.y() >= hotspot[CONFIG_HOTSPOT_TOPLEFT][Y] and\
-                    pos.x() <= hotspot[CONFIG_HOTSPOT_BOTTOMRIGHT][X] and\
-                    pos.y() <= hotspot[CONFIG_HOTSPOT_BOTTOMRIGHT][Y]:
-                
-                    return id, hotspot
+        """
+        
+        self.__cell = cell
+        # (cell-x, cell-y) : [((x1, y1, x2, y2), id, hotspot), ...] in priority order
+        self.__grid = {}
+        
+        # Only hotspots with a complete area can be hit
+        entries = []
+        for id, hotspot in hotspots.items():
+            x1, y1 = hotspot.get(CONFIG_HOTSPOT_TOPLEFT, (None, None))
+            x2, y2 = hotspot.get(CONFIG_HOTSPOT_BOTTOMRIGHT, (None, None))
+            if x1 == None or y1 == None or x2 == None or y2 == None:
+                continue
+            if x2 < x1 or y2 < y1:
+                continue
+            entries.append(((x2 - x1) * (y2 - y1), id, (x1, y1, x2, y2), hotspot))
+        entries.sort(key = lambda entry: (entry[0], entry[1]))
+        
+        for area, id, rect, hotspot in entries:
+            x1, y1, x2, y2 = rect
+            for cx in range(x1 // cell, x2 // cell + 1):
+                for cy in range(y1 // cell, y2 // cell + 1):
+                    self.__grid.setdefault((cx, cy), []).append((rect, id, hotspot))
+    
+    def locate(self, x, y):
+        """
+        Find the hotspot containing a point
+        
+        Arguments:
+            x   --  X coordinate
+            y   --  Y coordinate
+        
+        Returns (id, hotspot) or (-1, None)
+            
+        """
+        
+        for (x1, y1, x2, y2), id, hotspot in self.__grid.get((x // self.__cell, y // self.__cell), ()):
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                return id, hotspot
         return -1, None
-                                
\ No newline at end of file
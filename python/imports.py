@@ -24,41 +24,20 @@
 #
 
 #=====================================================
-# System imports
-import os,sys
-import traceback
-import socket
-import pickle
-from time import sleep
-import glob
-import copy
-from os import listdir
-from os.path import isfile, join
-import string
-import threading
-import pprint
-pp = pprint.PrettyPrinter(indent=1)
+# System and application imports that do not need Qt
+from coreimports import *
 
 #=====================================================
 # Lib imports
-from PyQt5.QtCore import Qt, QCoreApplication, QTimer, QObject, QRect, QEvent, QMargins
+from PyQt5.QtCore import Qt, QCoreApplication, QTimer, QObject, QRect, QEvent, QMargins, pyqtSignal
 from PyQt5.QtGui import QPalette, QColor, QFont, QIcon, QPainter, QPixmap, QPen
 from PyQt5.QtWidgets import QApplication, qApp
 from PyQt5.QtWidgets import QWidget, QToolTip, QStyle, QStatusBar, QMainWindow, QDialog, QAction, QMessageBox, QInputDialog, QDialogButtonBox
 from PyQt5.QtWidgets import QGridLayout, QVBoxLayout, QHBoxLayout
-from PyQt5.QtWidgets import QFrame, QLabel, QButtonGroup, QPushButton, QRadioButton, QComboBox, QCheckBox, QSpinBox, QTabWidget, QLineEdit
+from PyQt5.QtWidgets import QFrame, QLabel, QButtonGroup, QPushButton, QRadioButton, QComboBox, QCheckBox, QSpinBox, QTabWidget, QLineEdit, QCompleter
 
 #=====================================================
-# Application imports
-from common import *
+# GUI application imports
 import graphics
 import configurationdialog
-import persist
-# Common across projects
-from sys import platform
-if platform == "linux" or platform == "linux2":
-    sys.path.append(os.path.join('..','..','Common','python'))
-elif platform == "win32":
-    sys.path.append(os.path.join('..','..','..','Common','trunk','python'))
-import antcontrol
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# interlock.py
+#
+# Relay interlocks for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+
+Interlock.
+Rules that a relay vector must keep, e.g. two transmitters never on one
+antenna or a transmitter never into a receive only port. The rules for a
+template are settings[INTERLOCK_SETTINGS][template], a list of
+    [INTERLOCK_EXCLUSIVE, [relay_id, ...], reason]
+        at most one of these relays energised
+    [INTERLOCK_FORBID, [relay_id, ...], [relay_id, ...], reason]
+        never the first relays all energised with the second all de-energised
+Each rule is compiled to bitmasks once so a check is a few integer
+operations per rule.
+
+"""
+class Interlock:
+
+    def __init__(self, rules):
+        """
+        Constructor
+
+        Arguments
+            rules   --  list of rules as above
+
+        Raises ValueError if a rule cannot be understood
+        """
+
+        # [(mask, reason), ...]
+        self.__exclusive = []
+        # [(energised mask, de-energised mask, reason), ...]
+        self.__forbid = []
+        for rule in rules:
+            try:
+                if rule[0] == INTERLOCK_EXCLUSIVE:
+                    self.__exclusive.append((_mask(rule[1]), str(rule[2])))
+                elif rule[0] == INTERLOCK_FORBID:
+                    self.__forbid.append((_mask(rule[1]), _mask(rule[2]), str(rule[3])))
+                else:
+                    raise ValueError('unknown rule type')
+            except (IndexError, TypeError, ValueError) as e:
+                raise ValueError('Interlock rule %s [%s]' % (str(rule), str(e)))
+
+    def check(self, relays):
+        """
+        Return the reason a relay vector breaks a rule, None if it keeps them all
+
+        Arguments:
+            relays  --  {relay_id: RELAY_ON | RELAY_OFF, ...} as it would be
+
+        """
+
+        on = 0
+        off = 0
+        for relay_id, contact_state in relays.items():
+            if contact_state == RELAY_ON:
+                on |= 1 << (relay_id - 1)
+            elif contact_state == RELAY_OFF:
+                off |= 1 << (relay_id - 1)
+        for mask, reason in self.__exclusive:
+            both = on & mask
+            # More than one bit set
+            if both & (both - 1):
+                return reason
+        for on_mask, off_mask, reason in self.__forbid:
+            if on & on_mask == on_mask and off & off_mask == off_mask:
+                return reason
+        return None
+
+def _mask(relay_ids):
+    # Relay ids as a bitmask, bit 0 = relay 1
+    mask = 0
+    for relay_id in relay_ids:
+        if int(relay_id) < 1:
+            raise ValueError('no relay %s' % str(relay_id))
+        mask |= 1 << (int(relay_id) - 1)
+    return mask
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# macrolib.py
+#
+# Macro library for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+import bisect
+
+"""
+Macros.
+A macro is {MACRO_NAME: name, MACRO_TAGS: [tag, ...], MACRO_MASK: mask, MACRO_ON: on}
+where bit n-1 of mask is set for each relay n the macro sets and the same
+bit of on is set if that relay is energised. The library for a template
+is state[MACROS][template] = {macro_id: macro, ...}, ids 0 to MAX_MACROS-1
+are the macro buttons.
+"""
+def make(name, tags, relays):
+    """
+    Return a macro
+
+    Arguments:
+        name    --  description
+        tags    --  list of tags
+        relays  --  {relay_id: RELAY_ON | RELAY_OFF} to set
+
+    """
+
+    mask, on = _encode(relays)
+    return {MACRO_NAME: name, MACRO_TAGS: list(tags), MACRO_MASK: mask, MACRO_ON: on}
+
+def relays(macro, relay_count):
+    """
+    Return the relays a macro sets as {relay_id: RELAY_ON | RELAY_OFF}
+
+    Arguments:
+        macro       --  the macro
+        relay_count --  relays there are, any beyond are left out
+
+    """
+
+    return _decode(macro[MACRO_MASK] & ((1 << relay_count) - 1), macro[MACRO_ON])
+
+def changes(macro, current, relay_count):
+    """
+    Return just the relays a macro would change as {relay_id: RELAY_ON | RELAY_OFF}
+
+    Arguments:
+        macro       --  the macro
+        current     --  {relay_id: RELAY_ON | RELAY_OFF} as now, missing if unknown
+        relay_count --  relays there are, any beyond are left out
+
+    """
+
+    known, on = _encode(current)
+    # Those the macro sets that are unknown or not as it has them
+    changed = macro[MACRO_MASK] & ((1 << relay_count) - 1) & (~known | (on ^ macro[MACRO_ON]))
+    return _decode(changed, macro[MACRO_ON])
+
+def size(macro, relay_count):
+    """
+    Return the number of relays a macro sets
+
+    Arguments:
+        macro       --  the macro
+        relay_count --  relays there are, any beyond are left out
+
+    """
+
+    return bin(macro[MACRO_MASK] & ((1 << relay_count) - 1)).count('1')
+
+def parse(text):
+    """
+    Split "name #tag #tag" into (name, [tag, ...])
+
+    Arguments:
+        text    --  as typed
+
+    """
+
+    words = text.split()
+    tags = [word[1:] for word in words if word.startswith('#') and len(word) > 1]
+    return ' '.join(word for word in words if not word.startswith('#')), tags
+
+def label(macro):
+    """
+    Return a macro as "name #tag #tag", as parse() takes it
+
+    Arguments:
+        macro   --  the macro
+
+    """
+
+    return ' '.join([macro[MACRO_NAME]] + ['#' + tag for tag in macro[MACRO_TAGS]])
+
+def next_id(macros):
+    """
+    Return a free id after the macro buttons
+
+    Arguments:
+        macros  --  {macro_id: macro, ...}
+
+    """
+
+    return max([MAX_MACROS - 1] + list(macros)) + 1
+
+def upgrade(macros):
+    """
+    Convert a library from before version 2, where a macro was
+    {TT: tooltip, relay_id: RELAY_ON | RELAY_OFF, ...}, in place
+
+    Arguments:
+        macros  --  {macro_id: macro, ...}
+
+    """
+
+    for macro_id, macro in list(macros.items()):
+        if TT in macro:
+            name, tags = parse(macro[TT])
+            macros[macro_id] = make(name, tags, {relay_id: contact_state for relay_id, contact_state in macro.items() if relay_id != TT})
+
+def _encode(relays):
+    # {relay_id: RELAY_ON | RELAY_OFF} as (mask, on)
+    mask = 0
+    on = 0
+    for relay_id, contact_state in relays.items():
+        bit = 1 << (relay_id - 1)
+        mask |= bit
+        if contact_state == RELAY_ON:
+            on |= bit
+    return mask, on
+
+def _decode(mask, on):
+    # (mask, on) as {relay_id: RELAY_ON | RELAY_OFF}
+    relays = {}
+    while mask:
+        bit = mask & -mask
+        relays[bit.bit_length()] = RELAY_ON if on & bit else RELAY_OFF
+        mask ^= bit
+    return relays
+
+"""
+
+Macro index.
+Finds the macros of one template by name or by words of the name and tags
+without looking at each macro. Build a new one when the library changes.
+Names and words are matched ignoring case, where two macros have the same
+name the lower id is found.
+
+"""
+class MacroIndex:
+
+    def __init__(self, macros):
+        """
+        Constructor
+
+        Arguments
+            macros  --  {macro_id: macro, ...}
+        """
+
+        # {name: macro_id, ...}
+        self.__names = {}
+        # {word: [macro_id, ...], ...} and the words sorted for prefix search
+        self.__words = {}
+        for macro_id in sorted(macros):
+            macro = macros[macro_id]
+            self.__names.setdefault(macro[MACRO_NAME].strip().lower(), macro_id)
+            for word in set(label(macro).lower().replace('#', ' ').split()):
+                self.__words.setdefault(word, []).append(macro_id)
+        self.__sorted = sorted(self.__words)
+
+    def find(self, name):
+        """
+        Return the id of the macro with this name or None
+
+        Arguments:
+            name    --  macro name
+
+        """
+
+        return self.__names.get(name.strip().lower())
+
+    def search(self, text):
+        """
+        Return the ids of the macros where each word of the text starts a
+        word of the name or tags, lowest id first
+
+        Arguments:
+            text    --  words to look for, a leading '#' is ignored
+
+        """
+
+        found = None
+        for prefix in text.lower().replace('#', ' ').split():
+            ids = set()
+            index = bisect.bisect_left(self.__sorted, prefix)
+            while index < len(self.__sorted) and self.__sorted[index].startswith(prefix):
+                ids.update(self.__words[self.__sorted[index]])
+                index += 1
+            found = ids if found == None else found & ids
+        return sorted(found) if found != None else []
@@ -24,56 +24,376 @@
 #
 
 # All imports
-from imports import *
+from coreimports import *
 
 """
-Utility functions to get and save configuration and state
+Utility functions to get and save configuration and state.
+
+A configuration is saved as a snapshot file holding the Python literal
+{STORE_VERSION_KEY: version, STORE_DATA_KEY: cfg}. The snapshot is written
+to a temporary file and renamed over the old one so a crash leaves either
+the old or the new file, never a partial one.
+
+Small changes are appended to a journal, path + JOURNAL_EXT, one
+literal (keys, value) per line meaning cfg[keys[0]][keys[1]]... = value
+or (keys,) meaning delete that item.
+The journal is replayed over the snapshot on load and discarded each time
+a snapshot is written. It is compacted into a new snapshot once it reaches
+JOURNAL_COMPACT entries. A torn last line from a crash is ignored.
+
+Files written by older versions were pickles. These are still read and are
+migrated to the current version, then written in the new format on the next
+save.
+
+Changes made while running go through a PersistWriter which does the
+writing on its own thread.
+
+Errors go to an error callback if one is given, otherwise they are printed.
+There is no dialog here as this also runs headless.
 """
-def getSavedCfg(path):
+
+# Number of entries in each journal since its snapshot
+# {path: entries, ...}
+_journal_entries = {}
+
+def getSavedCfg(path, defaults = None, error_callback = None):
 	"""
 	Restore the saved configuration
 	
 	Arguments:
-		path    -- path to configuration file
+		path    		-- path to configuration file
+		defaults		-- default configuration, used to fill in anything an older version did not have
+		error_callback	-- callback here with (message) if the file cannot be read
 		
 	"""
 	
 	cfg = None
 	if os.path.exists(path):
 		try:       
-			f = open(path, 'rb')
-			cfg = pickle.load(f)
+			with open(path, 'rb') as f:
+				data = f.read()
+			if data[:1] == PICKLE_MAGIC:
+				# Older version
+				version, cfg = 0, pickle.loads(data)
+			else:
+				snapshot = ast.literal_eval(data.decode(encoding='UTF-8'))
+				version, cfg = snapshot[STORE_VERSION_KEY], snapshot[STORE_DATA_KEY]
+			# The journal was written by the same version as the snapshot
+			entries, clean = _replay(path + JOURNAL_EXT, cfg)
+			cfg = _migrate(cfg, version, defaults)
+			if clean and version == STORE_VERSION:
+				_journal_entries[path] = entries
+			else:
+				# Rewrite in the current format before anything is appended
+				_journal_entries[path] = JOURNAL_COMPACT
 		except Exception as e:
 			# Error retrieving configuration file
-			QMessageBox.information(None, 'Configuration File - Exception','Exception [%s]' % (str(e)), QMessageBox.Ok)
-		finally:
-			try:
-				f.close()
-			except:
-				pass
+			_report(error_callback, 'Configuration File - Exception [%s]' % (str(e)))
+			cfg = None
 	return cfg
 		
-def saveCfg(path, cfg):
+def saveCfg(path, cfg, error_callback = None):
 	"""
-	Save the configuration
+	Save the configuration as a new snapshot
 	
 	Arguments:
-		path    -- path to state file
-		cfg   	-- configuration to save
+		path    		-- path to state file
+		cfg   			-- configuration to save
+		error_callback	-- callback here with (message) if the file cannot be written
 		
 	"""
 	
 	try:
-		dir, file = os.path.split(path)
-		if not os.path.exists(dir):
-			os.mkdir(dir)
-		f = open(path, 'wb')
-		pickle.dump(cfg, f)
+		_write_snapshot(path, cfg)
 	except Exception as e:
 		# Error saving configuration file
-		QMessageBox.information(None, 'Configuration File - Exception','Exception [%s]' % (str(e)), QMessageBox.Ok)
-	finally:
-		try:
-			f.close()
-		except:
-			pass    
\ No newline at end of file
+		_report(error_callback, 'Configuration File - Exception [%s]' % (str(e)))
+
+def apply_change(cfg, entry):
+	"""
+	Set or delete one item in a configuration
+	
+	Arguments:
+		cfg   	-- configuration to update
+		entry  	-- (keys, value) to set or (keys,) to delete
+		
+	"""
+	
+	keys = entry[0]
+	item = cfg
+	for key in keys[:-1]:
+		item = item.setdefault(key, {})
+	if len(entry) == 1:
+		item.pop(keys[-1], None)
+	else:
+		item[keys[-1]] = entry[1]
+
+# Helpers ==============================================================================
+def _report(error_callback, message):
+	"""
+	Report an error
+	
+	Arguments:
+		error_callback	-- callback or None to print
+		message			-- text of the error
+		
+	"""
+	
+	if error_callback == None:
+		print(message)
+	else:
+		error_callback(message)
+
+def _write_snapshot(path, cfg):
+	"""
+	Atomically replace the snapshot and discard the journal
+	
+	Arguments:
+		path    -- path to state file
+		cfg   	-- configuration to save
+		
+	"""
+	
+	dir, file = os.path.split(path)
+	if len(dir) > 0 and not os.path.exists(dir):
+		os.mkdir(dir)
+	tmp_path = path + TMP_EXT
+	with open(tmp_path, 'w', encoding='UTF-8') as f:
+		f.write(pprint.pformat({STORE_VERSION_KEY: STORE_VERSION, STORE_DATA_KEY: cfg}))
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp_path, path)
+	# The journal is now in the snapshot
+	if os.path.exists(path + JOURNAL_EXT):
+		os.remove(path + JOURNAL_EXT)
+	_journal_entries[path] = 0
+
+def _replay(journal_path, cfg):
+	"""
+	Apply a journal to a configuration.
+	Return (entries applied, False if the journal ends in a torn write)
+	
+	Arguments:
+		journal_path	-- path to the journal
+		cfg   			-- configuration to update
+		
+	"""
+	
+	entries = 0
+	if not os.path.exists(journal_path):
+		return entries, True
+	with open(journal_path, 'r', encoding='UTF-8') as f:
+		for line in f:
+			try:
+				entry = ast.literal_eval(line)
+			except (SyntaxError, ValueError):
+				# Torn write, nothing after this can be trusted
+				return entries, False
+			apply_change(cfg, entry)
+			entries += 1
+	return entries, True
+
+def _append_journal(path, entries):
+	"""
+	Append changes to the journal
+	
+	Arguments:
+		path    -- path to state file
+		entries	-- list of (keys, value) or (keys,)
+		
+	"""
+	
+	with open(path + JOURNAL_EXT, 'a', encoding='UTF-8') as f:
+		for entry in entries:
+			f.write(repr(entry) + '\n')
+		# No fsync, a flush survives an application crash and is cheap
+		f.flush()
+	_journal_entries[path] = _journal_entries.get(path, 0) + len(entries)
+
+def _migrate(cfg, version, defaults):
+	"""
+	Bring a configuration from an older version up to date
+	
+	Arguments:
+		cfg   		-- configuration as loaded
+		version   	-- version it was saved with
+		defaults	-- default configuration or None
+		
+	"""
+	
+	if version > STORE_VERSION:
+		raise ValueError('Saved with a newer version (%d), this version understands up to %d' % (version, STORE_VERSION))
+	if version < STORE_VERSION and defaults != None:
+		# Anything added since, e.g. the additional controllers
+		# or the band settings, is missing so take the defaults.
+		_fill_defaults(cfg, defaults)
+	if version < 2 and MACROS in cfg:
+		# Macros became bitmasks
+		for macros in cfg[MACROS].values():
+			macrolib.upgrade(macros)
+	return cfg
+
+def _fill_defaults(cfg, defaults):
+	"""
+	Add any missing keys from the defaults, recursively
+	
+	Arguments:
+		cfg   		-- configuration to update
+		defaults	-- default configuration
+		
+	"""
+	
+	for key, value in defaults.items():
+		if key not in cfg:
+			cfg[key] = copy.deepcopy(value)
+		elif isinstance(value, dict) and isinstance(cfg[key], dict):
+			_fill_defaults(cfg[key], value)
+
+"""
+
+Background writer.
+Changes are recorded from the GUI thread without touching the disk.
+Bursts are coalesced, the first change after a quiet spell is written
+straight away and any that follow within the interval are written
+together when it expires, so there is at most one write per interval.
+The writer keeps its own copy of the configuration, updated with each
+change, so it can compact the journal without sharing the live one.
+Errors are reported through a callback rather than a dialog.
+
+"""
+class PersistWriter (threading.Thread):
+	
+	def __init__(self, path, cfg, interval, error_callback):
+		"""
+		Constructor
+		
+		Arguments
+			path			-- path to the file
+			cfg				-- the configuration as loaded
+			interval		-- seconds, minimum time between writes
+			error_callback	-- callback here with (message) if a write fails
+		"""
+		
+		super(PersistWriter, self).__init__()
+		
+		self.__path = path
+		self.__interval = interval
+		self.__error_callback = error_callback
+		
+		# Our own copy of the configuration
+		self.__cfg = copy.deepcopy(cfg)
+		
+		self.__cv = threading.Condition()
+		# Changes waiting to be written, in the order of their latest change
+		# {keys: (keys, value) or (keys,), ...}
+		self.__entries = {}
+		# A whole configuration waiting to be written or None
+		self.__snapshot = None
+		# The next write must be a snapshot, set after a failed write
+		self.__snapshot_due = False
+		self.__last_write = 0
+		
+		self.__terminate = False
+	
+	# Public interface (any thread) ==================================================================================
+	def journal(self, keys, value):
+		"""
+		Record one change
+		
+		Arguments:
+			keys   	-- tuple of keys leading to the changed item
+			value   -- new value of the item
+			
+		"""
+		
+		# Copy now, the caller goes on changing its configuration
+		self.__record((tuple(keys), copy.deepcopy(value)))
+	
+	def delete(self, keys):
+		"""
+		Record the removal of an item
+		
+		Arguments:
+			keys   	-- tuple of keys leading to the item
+			
+		"""
+		
+		self.__record((tuple(keys),))
+	
+	def save(self, cfg):
+		"""
+		Record a whole new configuration
+		
+		Arguments:
+			cfg   	-- configuration to save
+			
+		"""
+		
+		with self.__cv:
+			self.__snapshot = copy.deepcopy(cfg)
+			self.__entries = {}
+			self.__cv.notify()
+	
+	def terminate(self):
+		""" Write anything outstanding and terminate thread """
+		
+		with self.__cv:
+			self.__terminate = True
+			self.__cv.notify()
+	
+	# Thread entry point ==============================================================================================
+	def run(self):
+		while True:
+			with self.__cv:
+				while not self.__pending() and not self.__terminate:
+					self.__cv.wait()
+				if not self.__pending():
+					return
+				# Wait out the interval, more changes may arrive meanwhile
+				while not self.__terminate:
+					remaining = self.__last_write + self.__interval - time.time()
+					if remaining <= 0:
+						break
+					self.__cv.wait(remaining)
+				snapshot, self.__snapshot = self.__snapshot, None
+				entries, self.__entries = list(self.__entries.values()), {}
+			try:
+				self.__write(snapshot, entries)
+			except Exception as e:
+				# Our copy holds the changes, so write it all next time
+				self.__snapshot_due = True
+				self.__error_callback('Failed to save %s [%s]' % (os.path.basename(self.__path), str(e)))
+			self.__last_write = time.time()
+	
+	# Helpers =========================================================================================================
+	def __record(self, entry):
+		# Add a change, replacing any earlier change to the same item
+		with self.__cv:
+			self.__entries.pop(entry[0], None)
+			self.__entries[entry[0]] = entry
+			self.__cv.notify()
+	
+	def __pending(self):
+		# True if there is anything to write, lock is held
+		return self.__snapshot != None or len(self.__entries) > 0
+	
+	def __write(self, snapshot, entries):
+		"""
+		Write a snapshot and/or changes
+		
+		Arguments:
+			snapshot	-- whole configuration or None
+			entries		-- list of (keys, value) or (keys,) made after any snapshot
+			
+		"""
+		
+		if snapshot != None:
+			self.__cfg = snapshot
+		for entry in entries:
+			apply_change(self.__cfg, entry)
+		if snapshot != None or self.__snapshot_due or not os.path.exists(self.__path) or\
+			_journal_entries.get(self.__path, 0) + len(entries) > JOURNAL_COMPACT:
+			_write_snapshot(self.__path, self.__cfg)
+			self.__snapshot_due = False
+		else:
+			_append_journal(self.__path, entries)
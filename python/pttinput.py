@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# pttinput.py
+#
+# Transmitter state input for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+
+PTT input.
+Takes the transmitter state from datagrams on PTT_UDP_PORT, from a rig
+control program or a sequencer watching the PTT line, and passes it to
+the core which holds relay changes while transmitting. A datagram holds
+"T 1" or "T 0" as rigctl would send it, "tx" or "rx", "ptt:1" or "ptt:0",
+"on" or "off". Anything else is ignored.
+
+"""
+class PttInput (threading.Thread):
+
+    def __init__(self, set_tx):
+        """
+        Constructor
+
+        Arguments
+            set_tx  -- set_tx(transmitting) passes the state on
+        """
+
+        super(PttInput, self).__init__()
+
+        self.__set_tx = set_tx
+
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.bind((PTT_UDP_IP, PTT_UDP_PORT))
+        # Short so terminate is not held up
+        self.__sock.settimeout(0.5)
+        # Datagrams received and not understood
+        self.received = 0
+        self.rejected = 0
+
+        self.__terminate = False
+
+    # Thread entry point ==============================================================================================
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate = True
+
+    def run(self):
+        while not self.__terminate:
+            try:
+                data, addr = self.__sock.recvfrom(256)
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            self.received += 1
+            transmitting = parse(data.decode(encoding='UTF-8', errors='replace'))
+            if transmitting == None:
+                self.rejected += 1
+            else:
+                self.__set_tx(transmitting)
+        self.__sock.close()
+
+"""
+Parse a transmitter state datagram.
+"""
+def parse(text):
+    """
+    Return True for transmitting, False for receiving or None if not understood
+
+    Arguments:
+        text    --  datagram text
+
+    """
+
+    words = text.replace(':', ' ').lower().split()
+    if len(words) > 0 and words[0] in ('t', 'ptt'):
+        words = words[1:]
+    if len(words) != 1:
+        return None
+    if words[0] in PTT_ON:
+        return True
+    if words[0] in PTT_OFF:
+        return False
+    return None
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+#
+# relayengine.py
+#
+# Relay command engine for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+
+Relay command engine.
+The engine is the only owner of the UDP socket to the Arduino. Commands are
+accepted from any thread onto a bounded queue. The engine thread drains the
+queue and coalesces all pending relay changes into a single command.
+
+Every datagram carries a sequence number, "#<seq>:<command>", and the
+Arduino replies "ack:<seq>" ("awake:<seq>" as well for a ping). Commands
+waiting for a reply are held in the in-flight table and retransmitted with
+exponential backoff until acknowledged or the retries are exhausted. Only
+one relay command is in flight at a time so they cannot be reordered by a
+retransmit; anything queued meanwhile is coalesced into the next one.
+Completion is reported through a callback which is called on the engine thread.
+
+After every (re)connect the relay outputs are read back with "status", which
+the Arduino answers "status=XXXX:<seq>" with a hex mask of energised relays.
+The relays as read back go to the read back callback, which puts right any
+that differ through the sequencer so corrections are planned like any other
+change. Once the Arduino is known to answer "status" it is also used for the
+connectivity check so a reboot between checks is caught. Older firmware only
+acknowledges it and the engine falls back to "ping".
+
+On connect the engine also asks if the Arduino understands the binary
+frame in relayframe.py. If so relay commands and read backs are sent as
+fixed size frames carrying set and clear masks, otherwise as text.
+
+"""
+class RelayEngine (threading.Thread):
+
+    def __init__(self, network, status_callback, completion_callback, read_back_callback = None, ping_interval = PING_INTERVAL):
+        """
+        Constructor
+
+        Arguments
+            network             -- [ip, port] of the Arduino
+            status_callback     -- callback here with (online, message)
+            completion_callback -- callback here with (cmd_id, success, message)
+            read_back_callback  -- callback here with {relay_id: RELAY_ON | RELAY_OFF} as read back,
+                                   None to disable the read back
+            ping_interval       -- seconds between connectivity checks
+        """
+
+        super(RelayEngine, self).__init__()
+
+        self.__ip = network[IP]
+        self.__port = network[PORT]
+        self.__status_callback = status_callback
+        self.__completion_callback = completion_callback
+        self.__read_back_callback = read_back_callback
+        self.__ping_interval = ping_interval
+
+        # Command queue, bounded so a stalled Arduino cannot grow it without limit
+        self.__q = queue.Queue(ENGINE_QUEUE_SIZE)
+        # Wakes the engine when a command is queued
+        self.__wake_r, self.__wake_w = socket.socketpair()
+        # Command ids
+        self.__id_lock = threading.Lock()
+        self.__next_id = 0
+
+        # In flight commands
+        # {seq: InFlight, ...}
+        self.__in_flight = {}
+        self.__seq = 0
+
+        # Relay read back
+        # None until we know if the Arduino answers "status"
+        self.__has_status = None
+        self.__sync_due = False
+        # None until we know if the Arduino understands binary frames
+        self.__binary = None
+
+        self.__online = False
+        self.__sock = None
+        self.__terminate = False
+
+    # Public interface (any thread) ==================================================================================
+    def set_relay(self, relay_id, contact_state):
+        """
+        Set a single relay
+
+        Arguments:
+            relay_id        --  1-16
+            contact_state   --  RELAY_ON | RELAY_OFF
+
+        Returns the command id or None if the queue is full
+
+        """
+
+        return self.set_relays([(relay_id, contact_state)])
+
+    def set_relays(self, relays):
+        """
+        Set a vector of relays in one command
+
+        Arguments:
+            relays  --  list of (relay_id, RELAY_ON | RELAY_OFF)
+
+        Returns the command id or None if the queue is full
+
+        """
+
+        cmd_id = self.__new_id()
+        if self.__put((ENGINE_RELAYS, cmd_id, list(relays))):
+            return cmd_id
+        return None
+
+    def reset_relays(self):
+        """ De-energise all relays """
+
+        return self.set_relays([(relay_id, RELAY_OFF) for relay_id in range(1, MAX_RLYS+1)])
+
+    def resetParams(self, ip, port):
+        """
+        Change the Arduino address
+
+        Arguments:
+            ip      --  new IP address
+            port    --  new port
+
+        """
+
+        self.__put((ENGINE_PARAMS, None, (ip, port)))
+
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate = True
+        self.__wake()
+
+    # Thread entry point ==============================================================================================
+    def run(self):
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.setblocking(False)
+        # Ping straight away
+        next_ping = 0
+        while not self.__terminate:
+            if self.__sync_due and not self.__busy(ENGINE_STATUS):
+                if self.__binary == None and not self.__busy(ENGINE_PROBE):
+                    self.__send(ENGINE_PROBE, relayframe.FRAME_PROBE, [])
+                if self.__read_back():
+                    self.__send_status()
+                self.__sync_due = False
+            if time.time() >= next_ping and not self.__busy(ENGINE_PING) and not self.__busy(ENGINE_STATUS):
+                if self.__read_back() and self.__has_status:
+                    self.__send_status()
+                else:
+                    self.__send(ENGINE_PING, 'ping', [])
+                next_ping = time.time() + self.__ping_interval
+            # Hold relay commands while a read back or probe is outstanding
+            # so the sync sees a settled state and the format is known
+            if not self.__busy(ENGINE_RELAYS) and not self.__busy(ENGINE_STATUS) and not self.__busy(ENGINE_PROBE):
+                self.__dispatch()
+            # Wait for a reply, a retransmit deadline, the next ping or new work
+            deadlines = [next_ping] + [entry.deadline for entry in self.__in_flight.values()]
+            timeout = max(0, min(deadlines) - time.time())
+            readable, _, _ = select.select([self.__sock, self.__wake_r], [], [], timeout)
+            if self.__wake_r in readable:
+                self.__wake_r.recv(1024)
+            if self.__sock in readable:
+                self.__receive()
+            self.__check_timeouts()
+        self.__sock.close()
+        self.__wake_r.close()
+        self.__wake_w.close()
+
+    # Helpers =========================================================================================================
+    def __new_id(self):
+        # Return the next command id
+        with self.__id_lock:
+            self.__next_id += 1
+            return self.__next_id
+
+    def __put(self, cmd):
+        # Queue a command without blocking the caller
+        try:
+            self.__q.put_nowait(cmd)
+        except queue.Full:
+            self.__status_callback(self.__online, 'Relay command dropped, engine queue full')
+            return False
+        self.__wake()
+        return True
+
+    def __wake(self):
+        # Break the engine out of select
+        try:
+            self.__wake_w.send(b'w')
+        except socket.error:
+            pass
+
+    def __read_back(self):
+        # True if the relay state should be read back
+        return self.__read_back_callback != None and self.__has_status != False
+
+    def __busy(self, kind):
+        # True if a command of this kind is in flight
+        for entry in self.__in_flight.values():
+            if entry.kind == kind:
+                return True
+        return False
+
+    def __dispatch(self):
+        """ Take everything queued, coalesce it and send one relay command """
+
+        # Later settings of the same relay override earlier ones
+        relays = {}
+        cmd_ids = []
+        while True:
+            try:
+                what, cmd_id, data = self.__q.get_nowait()
+            except queue.Empty:
+                break
+            if what == ENGINE_RELAYS:
+                for relay_id, contact_state in data:
+                    # Re-insert so the order follows the latest change
+                    relays.pop(relay_id, None)
+                    relays[relay_id] = contact_state
+                cmd_ids.append(cmd_id)
+            elif what == ENGINE_PARAMS:
+                self.__ip, self.__port = data
+                # May be a different Arduino
+                self.__has_status = None
+                self.__binary = None
+                self.__set_online(False, '')
+        if len(relays) == 0:
+            # Nothing to change, done already
+            for cmd_id in cmd_ids:
+                self.__completion_callback(cmd_id, True, '')
+            return
+        if self.__binary:
+            mask_a, mask_b = relayframe.to_masks({relay_id: contact_state == RELAY_ON for relay_id, contact_state in relays.items()})
+            self.__send_frame(ENGINE_RELAYS, mask_a, mask_b, cmd_ids)
+            return
+        # Build the command e.g. "1e2d3e"
+        cmd = ''
+        for relay_id, contact_state in relays.items():
+            if contact_state == RELAY_ON:
+                cmd += '%de' % relay_id
+            else:
+                cmd += '%dd' % relay_id
+        self.__send(ENGINE_RELAYS, cmd, cmd_ids)
+
+    def __send(self, kind, cmd, cmd_ids):
+        """
+        Send a new sequenced command and add it to the in-flight table
+
+        Arguments:
+            kind    --  ENGINE_RELAYS | ENGINE_PING | ENGINE_STATUS | ENGINE_PROBE
+            cmd     --  command text without the sequence number
+            cmd_ids --  ids to complete when acknowledged
+
+        """
+
+        self.__seq = self.__seq % SEQ_MAX + 1
+        entry = InFlight(kind, ('#%d:%s' % (self.__seq, cmd)).encode(encoding='UTF-8'), cmd_ids)
+        self.__in_flight[self.__seq] = entry
+        self.__transmit(entry)
+
+    def __send_frame(self, kind, mask_a, mask_b, cmd_ids):
+        """
+        Send a new binary frame and add it to the in-flight table
+
+        Arguments:
+            kind    --  ENGINE_RELAYS | ENGINE_STATUS
+            mask_a  --  relays to energise
+            mask_b  --  relays to de-energise
+            cmd_ids --  ids to complete when acknowledged
+
+        """
+
+        self.__seq = self.__seq % SEQ_MAX + 1
+        entry = InFlight(kind, relayframe.encode(self.__seq, mask_a, mask_b), cmd_ids)
+        self.__in_flight[self.__seq] = entry
+        self.__transmit(entry)
+
+    def __send_status(self):
+        # Read back the relay state in whichever format the Arduino understands
+        if self.__binary:
+            self.__send_frame(ENGINE_STATUS, 0, 0, [])
+        else:
+            self.__send(ENGINE_STATUS, 'status', [])
+
+    def __transmit(self, entry):
+        # (Re)send an in-flight command and set its next deadline
+        entry.attempts += 1
+        entry.deadline = time.time() + RETRY_TIMEOUT * (2 ** (entry.attempts - 1))
+        try:
+            self.__sock.sendto(entry.datagram, (self.__ip, int(self.__port)))
+        except (socket.error, ValueError):
+            # Treat as lost, the retransmit will try again
+            pass
+
+    def __receive(self):
+        """ Match all waiting replies against the in-flight table """
+
+        while True:
+            try:
+                data, addr = self.__sock.recvfrom(1024)
+            except (BlockingIOError, socket.error):
+                return
+            if relayframe.is_frame(data):
+                self.__receive_frame(data)
+                continue
+            try:
+                reply, seq = data.decode(encoding='UTF-8').rsplit(':', 1)
+                seq = int(seq)
+            except ValueError:
+                continue
+            # Anything not in flight is a duplicate or a late reply
+            entry = self.__in_flight.get(seq)
+            if entry == None:
+                continue
+            if entry.kind == ENGINE_PING and reply in ('awake', 'ack'):
+                del self.__in_flight[seq]
+                self.__set_online(True, '')
+            elif entry.kind == ENGINE_RELAYS and reply == 'ack':
+                del self.__in_flight[seq]
+                self.__set_online(True, '')
+                for cmd_id in entry.cmd_ids:
+                    self.__completion_callback(cmd_id, True, '')
+            elif entry.kind == ENGINE_STATUS and reply.startswith('status='):
+                del self.__in_flight[seq]
+                self.__has_status = True
+                self.__set_online(True, '')
+                try:
+                    self.__relays_read(int(reply[len('status='):], 16))
+                except ValueError:
+                    pass
+            elif entry.kind == ENGINE_PROBE and reply.startswith(relayframe.FRAME_PROBE + '='):
+                del self.__in_flight[seq]
+                self.__binary = reply == '%s=%d' % (relayframe.FRAME_PROBE, relayframe.FRAME_VERSION)
+                self.__set_online(True, '')
+            elif entry.kind in (ENGINE_STATUS, ENGINE_PROBE) and reply == 'ack' and not entry.acked:
+                # The answer is sent first but may be lost or overtaken.
+                # Give it a little longer before deciding this firmware does not understand.
+                entry.acked = True
+                entry.deadline = time.time() + RETRY_TIMEOUT
+                self.__set_online(True, '')
+
+    def __receive_frame(self, data):
+        """
+        Handle a binary reply, the mask is the relays now energised
+
+        Arguments:
+            data    --  datagram bytes
+
+        """
+
+        frame = relayframe.decode(data)
+        if frame == None:
+            # Corrupt, the retransmit will recover
+            return
+        seq, mask, _ = frame
+        entry = self.__in_flight.get(seq)
+        if entry == None:
+            return
+        del self.__in_flight[seq]
+        self.__set_online(True, '')
+        if entry.kind == ENGINE_STATUS:
+            self.__relays_read(mask)
+        for cmd_id in entry.cmd_ids:
+            self.__completion_callback(cmd_id, True, '')
+
+    def __relays_read(self, mask):
+        """
+        Pass on the relays as read back
+
+        Arguments:
+            mask    --  energised relays, bit 0 = relay 1
+
+        """
+
+        self.__read_back_callback({relay_id: RELAY_ON if (mask >> (relay_id - 1)) & 1 else RELAY_OFF for relay_id in range(1, MAX_RLYS + 1)})
+
+    def __check_timeouts(self):
+        """ Retransmit or fail in-flight commands past their deadline """
+
+        now = time.time()
+        for seq, entry in list(self.__in_flight.items()):
+            if now < entry.deadline:
+                continue
+            if entry.acked:
+                # Acknowledged but never answered, older firmware
+                del self.__in_flight[seq]
+                if entry.kind == ENGINE_STATUS:
+                    self.__has_status = False
+                else:
+                    self.__binary = False
+                continue
+            if entry.attempts <= RETRY_MAX:
+                self.__transmit(entry)
+                continue
+            # Out of retries
+            del self.__in_flight[seq]
+            self.__set_online(False, 'No response from Arduino')
+            for cmd_id in entry.cmd_ids:
+                self.__completion_callback(cmd_id, False, 'Relay command failed: no response from Arduino')
+
+    def __set_online(self, online, message):
+        # Report status changes only
+        if online and not self.__online:
+            # (Re)connected, the relays may not be as we left them
+            self.__sync_due = True
+        if online != self.__online or len(message) > 0:
+            self.__online = online
+            self.__status_callback(online, message)
+
+"""
+A command waiting for its reply
+"""
+class InFlight:
+
+    def __init__(self, kind, datagram, cmd_ids):
+        """
+        Constructor
+
+        Arguments
+            kind        -- ENGINE_RELAYS | ENGINE_PING | ENGINE_STATUS | ENGINE_PROBE
+            datagram    -- bytes as sent including the sequence number
+            cmd_ids     -- ids to complete when acknowledged
+        """
+
+        self.kind = kind
+        self.datagram = datagram
+        self.cmd_ids = cmd_ids
+        self.attempts = 0
+        self.deadline = 0
+        # Acknowledged but waiting for a further reply
+        self.acked = False
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# relayframe.py
+#
+# Binary relay frame for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# System imports only so the emulator can use this without Qt
+import struct
+
+"""
+
+Binary relay frame.
+A fixed 8 byte frame, all fields big endian:
+    version     1 byte      FRAME_VERSION, outside ASCII so it cannot be mistaken for text
+    seq         2 bytes     sequence number as for the text protocol
+    mask_a      2 bytes     command: relays to energise, reply: relays now energised
+    mask_b      2 bytes     command: relays to de-energise, reply: 0
+    crc         1 byte      CRC-8 (poly 0x07) of the first 7 bytes
+Bit 0 of a mask is relay 1. A command with both masks 0 changes nothing and
+so reads back the relay state. The reply to every frame is a frame with the
+same sequence number.
+
+The Arduino is asked if it understands frames with the text command "binary"
+and answers "binary=<version>". Older firmware only acknowledges it.
+
+"""
+
+FRAME_VERSION = 0xA1
+FRAME_FORMAT = '>BHHH'
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT) + 1
+FRAME_PROBE = 'binary'
+
+def crc8(data):
+    """
+    Return the CRC-8 (poly 0x07, initial 0) of some bytes
+
+    Arguments:
+        data    --  bytes to check
+
+    """
+
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x07) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+    return crc
+
+def encode(seq, mask_a, mask_b):
+    """
+    Return a frame as bytes
+
+    Arguments:
+        seq     --  sequence number 0-65535
+        mask_a  --  relays to energise, or energised in a reply
+        mask_b  --  relays to de-energise
+
+    """
+
+    body = struct.pack(FRAME_FORMAT, FRAME_VERSION, seq, mask_a, mask_b)
+    return body + bytes([crc8(body)])
+
+def is_frame(data):
+    """
+    True if a datagram looks like a frame rather than text
+
+    Arguments:
+        data    --  datagram bytes
+
+    """
+
+    return len(data) == FRAME_SIZE and data[0] == FRAME_VERSION
+
+def decode(data):
+    """
+    Return (seq, mask_a, mask_b) or None if not a valid frame
+
+    Arguments:
+        data    --  datagram bytes
+
+    """
+
+    if not is_frame(data) or crc8(data[:-1]) != data[-1]:
+        return None
+    version, seq, mask_a, mask_b = struct.unpack(FRAME_FORMAT, data[:-1])
+    return seq, mask_a, mask_b
+
+def to_masks(relays):
+    """
+    Return (energise mask, de-energise mask) for a relay dictionary
+
+    Arguments:
+        relays  --  {relay_id: True to energise, ...}, relay ids 1-16
+
+    """
+
+    mask_a = mask_b = 0
+    for relay_id, energise in relays.items():
+        if energise:
+            mask_a |= 1 << (relay_id - 1)
+        else:
+            mask_b |= 1 << (relay_id - 1)
+    return mask_a, mask_b
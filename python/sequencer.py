@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+#
+# sequencer.py
+#
+# Break-before-make relay sequencer for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+Plan a transition between two relay vectors.
+De-energising a relay is the break, energising it the make.
+"""
+def plan(current, target, get_settle):
+    """
+    Return the steps to move the relays from one vector to another
+    as [(relays, settle), ...]. Each step is a list of (relay_id, state)
+    sent as one command, settle is the seconds to wait once it is
+    acknowledged before the next step goes.
+
+    All the relays that open go together, then after the longest of their
+    settle times all the relays that close go together. With nothing to
+    open or nothing to close there is one step and no wait.
+
+    Arguments:
+        current     --  {relay_id: RELAY_ON | RELAY_OFF} as now, missing if unknown
+        target      --  {relay_id: RELAY_ON | RELAY_OFF} as wanted
+        get_settle  --  returns the settle time in seconds for a relay_id
+
+    """
+
+    breaks = []
+    makes = []
+    for relay_id, contact_state in sorted(target.items()):
+        if current.get(relay_id) == contact_state:
+            continue
+        if contact_state == RELAY_OFF:
+            breaks.append((relay_id, contact_state))
+        else:
+            makes.append((relay_id, contact_state))
+    if len(breaks) > 0 and len(makes) > 0:
+        return [(breaks, max(get_settle(relay_id) for relay_id, _ in breaks)), (makes, 0)]
+    if len(breaks) + len(makes) > 0:
+        return [(breaks + makes, 0)]
+    return []
+
+"""
+
+Relay sequencer.
+Every relay change goes through here so transitions are applied in order.
+Each transition is planned with plan() and the steps sent to the controllers
+one after the other, the next step going once the previous one has been
+acknowledged and its settle time has passed. Transitions queued while one is
+running are merged into one. If a step fails the rest of that transition is
+abandoned rather than risk closing onto contacts that may not have opened.
+wait() lets a caller know when the transitions it queued have been made.
+The relays read back from the controllers come to resync(), which queues
+a transition to put right any that differ from what was last sent.
+While hold() is on nothing is sent and read backs are ignored. The rest
+of a transition already started goes back on the queue, so on release it
+goes as one with everything queued meanwhile.
+
+"""
+class Sequencer (threading.Thread):
+
+    def __init__(self, send, get_settle, completion_callback):
+        """
+        Constructor
+
+        Arguments
+            send                -- send(relays) queues a relay vector, returns a command id or None
+            get_settle          -- returns the settle time in seconds for a relay_id
+            completion_callback -- callback here with (cmd_id, success, message)
+        """
+
+        super(Sequencer, self).__init__()
+
+        self.__send = send
+        self.__get_settle = get_settle
+        self.__completion_callback = completion_callback
+
+        # Transitions waiting to run
+        # [(current, target), ...]
+        self.__transitions = []
+        # Completions seen while a step is outstanding
+        # {cmd_id: (success, message), ...}
+        self.__results = {}
+        self.__waiting = False
+        # True while a transition is being made
+        self.__running = False
+        # The relays as last acknowledged, missing if never sent or a step failed
+        # {relay_id: RELAY_ON | RELAY_OFF, ...}
+        self.__sent = {}
+        # Transitions are numbered as queued, finished is the last one made or abandoned
+        self.__queued = 0
+        self.__finished = 0
+        # Recent outcomes as (last transition number, success)
+        self.__outcomes = collections.deque(maxlen=SEQUENCE_OUTCOMES)
+        # Nothing is sent while held
+        self.__held = False
+        self.__cv = threading.Condition()
+
+        self.__terminate = False
+
+    # Public interface (any thread) ==================================================================================
+    def transition(self, current, target):
+        """
+        Queue a change of relay vector
+
+        Arguments:
+            current     --  {relay_id: RELAY_ON | RELAY_OFF} before the change
+            target      --  {relay_id: RELAY_ON | RELAY_OFF} after the change
+
+        """
+
+        with self.__cv:
+            self.__transitions.append((dict(current), dict(target)))
+            self.__queued += 1
+            self.__cv.notify_all()
+
+    def hold(self, held):
+        """
+        Hold relay changes back, e.g. while transmitting
+
+        Arguments:
+            held    --  True to hold, False to send what is waiting
+
+        """
+
+        with self.__cv:
+            self.__held = held
+            self.__cv.notify_all()
+
+    def waiting(self):
+        """ Return the number of relay changes queued and not yet made """
+
+        with self.__cv:
+            current, target = self.__merged()
+            return len([relay_id for relay_id, contact_state in target.items() if current.get(relay_id) != contact_state])
+
+    def resync(self, actual, wanted):
+        """
+        Put right relays that differ from what was last sent. Ignored while a
+        transition is queued or being made as the read back may predate it,
+        and while held as nothing may switch.
+
+        Arguments:
+            actual  --  {relay_id: RELAY_ON | RELAY_OFF} as read back
+            wanted  --  {relay_id: RELAY_ON | RELAY_OFF} as they should be, for
+                        relays not sent since the start or since a failure
+
+        Returns the number of relays put right
+
+        """
+
+        with self.__cv:
+            if self.__held or self.__running or len(self.__transitions) > 0:
+                return 0
+            expected = dict(wanted)
+            expected.update((relay_id, contact_state) for relay_id, contact_state in self.__sent.items() if relay_id in wanted)
+            target = {relay_id: contact_state for relay_id, contact_state in expected.items() if actual.get(relay_id, contact_state) != contact_state}
+            if len(target) > 0:
+                self.__transitions.append(({relay_id: actual[relay_id] for relay_id in target}, target))
+                self.__queued += 1
+                self.__cv.notify_all()
+            return len(target)
+
+    def wait(self, timeout):
+        """
+        Wait until every transition queued so far has been made
+
+        Arguments:
+            timeout --  seconds to wait at most
+
+        Returns True if they all completed, False if one failed or timed out
+
+        """
+
+        with self.__cv:
+            number = self.__queued
+            deadline = time.time() + timeout
+            while self.__finished < number and not self.__terminate:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.__cv.wait(remaining)
+            if self.__finished < number:
+                return False
+            # The outcome of the merged transition that included ours
+            return next((success for last, success in self.__outcomes if last >= number), True)
+
+    def completed(self, cmd_id, success, message):
+        """
+        Completion of a relay command, all completions pass through here
+
+        Arguments:
+            cmd_id  --  id returned when the command was queued
+            success --  True if acknowledged
+            message --  failure text
+
+        """
+
+        with self.__cv:
+            if self.__waiting:
+                self.__results[cmd_id] = (success, message)
+                self.__cv.notify_all()
+        self.__completion_callback(cmd_id, success, message)
+
+    def terminate(self):
+        """ Terminate thread """
+
+        with self.__cv:
+            self.__terminate = True
+            self.__cv.notify_all()
+
+    # Thread entry point ==============================================================================================
+    def run(self):
+        while True:
+            with self.__cv:
+                while (len(self.__transitions) == 0 or self.__held) and not self.__terminate:
+                    self.__cv.wait()
+                if self.__terminate:
+                    return
+                current, target = self.__merge()
+                number = self.__queued
+                self.__running = True
+            success = True
+            paused = False
+            # The relays as this transition has left them so far
+            made = dict(current)
+            for relays, settle in plan(current, target, self.__get_settle):
+                with self.__cv:
+                    if self.__held and not self.__terminate:
+                        # The rest goes with whatever is queued while held
+                        self.__transitions.insert(0, (made, target))
+                        self.__running = False
+                        paused = True
+                        break
+                if self.__terminate or not self.__step(relays):
+                    success = False
+                    break
+                made.update(relays)
+                with self.__cv:
+                    self.__sent.update(relays)
+                if settle > 0:
+                    time.sleep(settle)
+            if paused:
+                continue
+            with self.__cv:
+                if not success:
+                    # Not known what the relays not acknowledged did
+                    for relay_id in target:
+                        if self.__sent.get(relay_id) != target[relay_id]:
+                            self.__sent.pop(relay_id, None)
+                self.__running = False
+                self.__outcomes.append((number, success))
+                self.__finished = number
+                self.__cv.notify_all()
+
+    # Helpers =========================================================================================================
+    def __merge(self):
+        # Take all queued transitions as one, lock is held
+        current, target = self.__merged()
+        self.__transitions = []
+        return current, target
+
+    def __merged(self):
+        # All queued transitions as one, lock is held
+        current = {}
+        target = {}
+        for this_current, this_target in self.__transitions:
+            for relay_id, contact_state in this_current.items():
+                # The state before the first change to each relay
+                if relay_id not in target:
+                    current.setdefault(relay_id, contact_state)
+            target.update(this_target)
+        return current, target
+
+    def __step(self, relays):
+        """
+        Send one step and wait for it to complete
+
+        Arguments:
+            relays  --  list of (relay_id, state)
+
+        Returns True if acknowledged
+
+        """
+
+        with self.__cv:
+            self.__waiting = True
+            self.__results = {}
+        # Not under the lock, a completion may call back before send returns
+        cmd_id = self.__send(relays)
+        with self.__cv:
+            try:
+                if cmd_id == None:
+                    return False
+                deadline = time.time() + SEQUENCE_TIMEOUT
+                while cmd_id not in self.__results and not self.__terminate:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.__cv.wait(remaining)
+                return self.__results.get(cmd_id, (False, ''))[0]
+            finally:
+                self.__waiting = False
+                self.__results = {}
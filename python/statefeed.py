@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+# statefeed.py
+#
+# Relay state feed for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+import argparse
+
+"""
+
+State feed.
+Publishes the relay states of the template in use, and each macro run, by
+UDP multicast to FEED_GROUP:FEED_PORT so logging and SDR programs can tell
+which antenna is selected. Each datagram is a JSON object:
+    {"seq": n, "time": t, "type": "relays", "template": name, "relays": {relay_id: state, ...}}
+    {"seq": n, "time": t, "type": "macro", "template": name, "macro": macro_id, "switched": n, "saved": n}
+    {"seq": n, "time": t, "type": "tx", "template": name, "transmitting": bool, "held": n, "holdtime": s}
+    {"seq": n, "time": t, "type": "snapshot", "template": name, "relays": {relay_id: state, ...}, "ext": {...}}
+"relays" carries only the relays that changed. "switched" is how many
+relays a macro changed and "saved" how many it found already set. "tx"
+goes when PTT changes and while transmitting as relay changes are held,
+"held" is how many relay changes wait and "holdtime" for how long. While transmitting "relays" shows relay
+changes as made though they are held until PTT drops. seq goes up by one with
+each of these and time is when it happened, in seconds since the epoch.
+A snapshot holds every relay as of the seq it carries, and in "ext" the
+external command counts, see extcmd.ExtCmdThrd.counts(). One sent for a
+change of template takes the next seq, one sent every
+FEED_SNAPSHOT_INTERVAL carries the seq of the last change. A follower
+that joins late, or sees a gap in seq, need not wait for it, it can send
+FEED_REQUEST to FEED_REQUEST_PORT and the snapshot comes straight back.
+After a snapshot with seq S only messages with seq > S apply.
+
+The feed is a core listener so it sees every change whoever makes it.
+
+"""
+class StateFeed (threading.Thread):
+
+    def __init__(self, group = FEED_GROUP, port = FEED_PORT, request_port = FEED_REQUEST_PORT, interval = FEED_SNAPSHOT_INTERVAL):
+        """
+        Constructor
+
+        Arguments
+            group           -- multicast group to publish to
+            port            -- port to publish to
+            request_port    -- port to take snapshot requests on
+            interval        -- seconds between multicast snapshots
+        """
+
+        super(StateFeed, self).__init__()
+
+        self.__address = (group, port)
+        self.__interval = interval
+
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, FEED_TTL)
+        self.__sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.__sock.bind(('', request_port))
+        # A datagram that cannot go at once is dropped, the seq shows the gap
+        self.__sock.setblocking(False)
+
+        self.__lock = threading.Lock()
+        self.__seq = 0
+        self.__last_snapshot = 0
+        # As the core has them
+        self.__template = ''
+        # {template: {relay_id: state, ...}, ...}
+        self.__relays = {}
+        # {CORE_EXT_...: count, ...}
+        self.__ext = dict.fromkeys(CORE_EXT_COUNTS, 0)
+
+        self.__terminate = False
+
+    # Core listener (any thread) ======================================================================================
+    def event(self, event, data):
+        """
+        Publish anything that changes the relays
+
+        Arguments:
+            event   --  CORE_ event type
+            data    --  associated data, event specific
+
+        """
+
+        with self.__lock:
+            if event == CORE_SNAPSHOT:
+                settings, state = data
+                self.__template = state[TEMPLATE]
+                self.__relays = {template: dict(relays) for template, relays in state[RELAYS].items()}
+                self.__send(self.__snapshot())
+            elif event == CORE_CHANGE and data[0] == CORE_STATE:
+                entry = data[1]
+                keys = entry[0]
+                if keys[0] == TEMPLATE:
+                    self.__template = entry[1]
+                    self.__send(self.__snapshot(True))
+                elif keys[0] == RELAYS:
+                    self.__relay_change(entry)
+            elif event == CORE_MACRO:
+                macro_id, switched, saved = data
+                self.__send(self.__message('macro', macro = macro_id, switched = switched, saved = saved))
+            elif event == CORE_TX:
+                transmitting, held, holdtime = data
+                self.__send(self.__message('tx', transmitting = transmitting, held = held, holdtime = round(holdtime, 3)))
+            elif event == CORE_EXT:
+                self.__ext = dict(data)
+
+    # Thread entry point ==============================================================================================
+    def terminate(self):
+        """ Terminate thread """
+
+        self.__terminate = True
+
+    def run(self):
+        while not self.__terminate:
+            with self.__lock:
+                wait = self.__last_snapshot + self.__interval - time.time()
+                if wait <= 0:
+                    self.__send(self.__snapshot())
+                    wait = self.__interval
+            # Wake now and then to see if we are done
+            readable, _, _ = select.select([self.__sock], [], [], min(wait, 1.0))
+            if len(readable) == 0:
+                continue
+            try:
+                data, addr = self.__sock.recvfrom(1024)
+            except socket.error:
+                continue
+            if data.strip() == FEED_REQUEST:
+                with self.__lock:
+                    self.__send(self.__snapshot(), addr)
+        self.__sock.close()
+
+    # Helpers =========================================================================================================
+    def __relay_change(self, entry):
+        """
+        Record a change to the relays and publish what is different, lock is held
+
+        Arguments:
+            entry   --  (keys, value) or (keys,) to delete, keys[0] is RELAYS
+
+        """
+
+        keys = entry[0]
+        if len(keys) == 1:
+            # Every template at once
+            changes = {template: dict(relays) for template, relays in entry[1].items()} if len(entry) > 1 else {}
+            old, self.__relays = self.__relays.get(self.__template, {}), changes
+        elif len(keys) == 2:
+            old = self.__relays.pop(keys[1], {})
+            if len(entry) > 1:
+                self.__relays[keys[1]] = dict(entry[1])
+        else:
+            relays = self.__relays.setdefault(keys[1], {})
+            old = dict(relays)
+            if len(entry) > 1:
+                relays[keys[2]] = entry[1]
+            else:
+                relays.pop(keys[2], None)
+        if len(keys) > 1 and keys[1] != self.__template:
+            return
+        relays = self.__relays.get(self.__template, {})
+        changed = {relay_id: state for relay_id, state in relays.items() if old.get(relay_id) != state}
+        if len(changed) > 0:
+            self.__send(self.__message('relays', relays = changed))
+
+    def __message(self, kind, **fields):
+        # A new message with the next seq, lock is held
+        self.__seq += 1
+        message = {'seq': self.__seq, 'time': time.time(), 'type': kind, 'template': self.__template}
+        message.update(fields)
+        return message
+
+    def __snapshot(self, advance = False):
+        # A snapshot as of the current seq or as the next one, lock is held
+        self.__last_snapshot = time.time()
+        if advance:
+            return self.__message('snapshot', relays = dict(self.__relays.get(self.__template, {})), ext = dict(self.__ext))
+        return {'seq': self.__seq, 'time': self.__last_snapshot, 'type': 'snapshot', 'template': self.__template,
+                'relays': dict(self.__relays.get(self.__template, {})), 'ext': dict(self.__ext)}
+
+    def __send(self, message, addr = None):
+        # Send to the group or one address, lock is held
+        try:
+            self.__sock.sendto(json.dumps(message).encode(encoding='UTF-8'), self.__address if addr == None else addr)
+        except socket.error:
+            pass
+
+#======================================================================================================================
+# Main code
+def main():
+    """ Follow the feed and print the relay states as they change """
+
+    try:
+        parser = argparse.ArgumentParser(description='Antenna switch state feed follower')
+        parser.add_argument('--group', default=FEED_GROUP, help='multicast group')
+        parser.add_argument('--port', type=int, default=FEED_PORT, help='multicast port')
+        parser.add_argument('--switch', default='127.0.0.1', help='address of the switch, for snapshots')
+        args = parser.parse_args()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', args.port))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, struct.pack('4s4s', socket.inet_aton(args.group), socket.inet_aton('0.0.0.0')))
+        # Catch up now rather than wait for the next snapshot
+        request = (args.switch, FEED_REQUEST_PORT)
+        sock.sendto(FEED_REQUEST, request)
+        seq = None
+        relays = {}
+        while True:
+            message = json.loads(sock.recv(65536).decode(encoding='UTF-8'))
+            if message['type'] == 'snapshot':
+                if seq != None and message['seq'] < seq:
+                    continue
+                seq, relays = message['seq'], message['relays']
+            elif seq == None or message['seq'] <= seq:
+                continue
+            elif message['seq'] != seq + 1:
+                # Missed something
+                seq = None
+                sock.sendto(FEED_REQUEST, request)
+                continue
+            else:
+                seq = message['seq']
+                if message['type'] == 'relays':
+                    relays.update(message['relays'])
+                elif message['type'] == 'tx':
+                    print('%.3f %s, %d held for %.1fs' % (message['time'], 'tx' if message['transmitting'] else 'rx', message['held'], message['holdtime']))
+                else:
+                    print('%.3f macro %d, %d switched %d saved' % (message['time'], message['macro'] + 1, message['switched'], message['saved']))
+            print('%.3f #%d %s %s' % (message['time'], seq, message['template'],
+                ' '.join('%s:%s' % (relay_id, 'on' if state == RELAY_ON else 'off') for relay_id, state in sorted(relays.items(), key=lambda item: int(item[0])))))
+
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print ('Exception [%s][%s]' % (str(e), traceback.format_exc()))
+
+# Entry point
+if __name__ == '__main__':
+    main()
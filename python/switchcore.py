@@ -0,0 +1,647 @@
+#!/usr/bin/env python
+#
+# switchcore.py
+#
+# Qt free core of the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+
+Switch core.
+Everything the switch does apart from drawing it. Holds the settings and
+state, saves changes as they happen and owns the relay sequencer, the
+controllers, the external command listener, the state feed, the band
+follower and the PTT input. There is no Qt here so the same core runs
+headless in the daemon (antswd.py) or inside the GUI.
+
+Every change to the settings or state is made here and goes out to the
+listeners as a CORE_CHANGE holding (keys, value) or (keys,), the same form
+as the journal. A listener gets a snapshot when it attaches and can keep an
+exact copy by applying the changes that follow.
+
+All methods may be called from any thread. Listeners are called on the
+thread that caused the event, in order, and must not block.
+
+"""
+class SwitchCore:
+
+    def __init__(self, settings_path = SETTINGS_PATH, state_path = STATE_PATH, error_callback = None, ext_coalesce = EXT_EXECUTE_ALL, ping_interval = PING_INTERVAL):
+        """
+        Constructor
+
+        Arguments
+            settings_path   -- path to the settings file
+            state_path      -- path to the state file
+            error_callback  -- callback here with (message) if a file cannot be read
+            ext_coalesce    -- EXT_EXECUTE_ALL | EXT_LATEST_MACRO for external commands
+            ping_interval   -- seconds between connectivity checks and relay read backs
+        """
+
+        # Retrieve settings and state ( see common.py DEFAULTS for structure)
+        self.__settings = persist.getSavedCfg(settings_path, DEFAULT_SETTINGS, error_callback)
+        if self.__settings == None: self.__settings = copy.deepcopy(DEFAULT_SETTINGS)
+        self.__state = persist.getSavedCfg(state_path, DEFAULT_STATE, error_callback)
+        if self.__state == None: self.__state = copy.deepcopy(DEFAULT_STATE)
+
+        # Held while the settings or state are read or changed
+        self.__lock = threading.RLock()
+        # Held while listeners are called. Engine threads only ever take this
+        # one so they cannot be held up by a change in progress.
+        self.__listener_lock = threading.RLock()
+        self.__listeners = []
+        # Last (online, message) for listeners that attach later
+        self.__status = (False, '')
+        # Last CORE_TX, when transmitting started or how long the last hold was
+        self.__tx = (False, 0, 0.0)
+        self.__tx_start = 0
+        # Macro indexes built as needed, dropped when the library changes
+        # {template: macrolib.MacroIndex, ...}
+        self.__macro_indexes = {}
+        # Interlocks compiled as needed, dropped when the rules change
+        # {template: interlock.Interlock, ...}
+        self.__interlocks = {}
+
+        # Changes are saved as they happen on these threads
+        self.__writers = {
+            CORE_SETTINGS: persist.PersistWriter(settings_path, self.__settings, PERSIST_INTERVAL, self.__message),
+            CORE_STATE: persist.PersistWriter(state_path, self.__state, PERSIST_INTERVAL, self.__message),
+        }
+
+        # The sequencer, all relay changes go through here
+        self.__sequencer = sequencer.Sequencer(lambda relays: self.__api.set_relays(relays), self.__get_settle, self.__completed)
+
+        # The relay command engines, one per controller
+        self.__api = controllers.ControllerRegistry(controllers.get_networks(self.__settings[ARDUINO_SETTINGS]), self.__api_status, self.__sequencer.completed, self.__read_back, ping_interval)
+
+        # The external command listener
+        self.__ext_cmd = extcmd.ExtCmdThrd(self, ext_coalesce, lambda counts: self.__notify(CORE_EXT, counts))
+
+        # Relay changes and macros are multicast from here
+        self.__feed = statefeed.StateFeed()
+
+        # Macros follow the rig frequency
+        self.__band_follower = bandfollow.BandFollower(self.__ext_cmd.submit, self.__message)
+
+        # Relays are held while transmitting
+        self.__ptt_input = pttinput.PttInput(self.set_tx)
+
+    # Public interface (any thread) ==================================================================================
+    def start(self):
+        """ Start all threads """
+
+        for writer in self.__writers.values():
+            writer.start()
+        self.__sequencer.start()
+        self.__api.start()
+        self.__ext_cmd.start()
+        self.attach(self.__feed.event)
+        self.__feed.start()
+        self.attach(self.__band_follower.event)
+        self.__band_follower.start()
+        self.__ptt_input.start()
+
+    def terminate(self):
+        """ Terminate all threads, anything not yet saved is written first """
+
+        # Close external thread, PTT input, band follower and feed,
+        # all told first so they wind down together
+        self.detach(self.__band_follower.event)
+        self.detach(self.__feed.event)
+        inputs = (self.__ext_cmd, self.__ptt_input, self.__band_follower, self.__feed)
+        for thread in inputs:
+            thread.terminate()
+        for thread in inputs:
+            thread.join()
+
+        # Close sequencer and API
+        self.__sequencer.terminate()
+        self.__sequencer.join()
+        self.__api.terminate()
+        self.__api.join()
+
+        # The writers flush before they exit
+        for writer in self.__writers.values():
+            writer.terminate()
+        for writer in self.__writers.values():
+            writer.join()
+
+    def attach(self, listener):
+        """
+        Add a listener. Before this returns it is called on this thread
+        with CORE_SNAPSHOT, the current CORE_STATUS, the last CORE_TX and
+        the CORE_EXT counts.
+
+        Arguments:
+            listener    --  callback here with (event, data)
+
+        """
+
+        with self.__lock:
+            with self.__listener_lock:
+                self.__listeners.append(listener)
+                self.__call(listener, CORE_SNAPSHOT, (copy.deepcopy(self.__settings), copy.deepcopy(self.__state)))
+                self.__call(listener, CORE_STATUS, self.__status)
+                self.__call(listener, CORE_TX, self.__tx)
+                self.__call(listener, CORE_EXT, self.__ext_cmd.counts())
+
+    def detach(self, listener):
+        """
+        Remove a listener
+
+        Arguments:
+            listener    --  as given to attach()
+
+        """
+
+        with self.__listener_lock:
+            if listener in self.__listeners:
+                self.__listeners.remove(listener)
+
+    def query(self):
+        """
+        Return {TEMPLATE: template in use, RELAYS: {relay_id: state, ...}, CORE_ONLINE: online,
+        CORE_TRANSMITTING: transmitting, CORE_HELD: relay changes held, CORE_HOLD_TIME: seconds held,
+        CORE_EXT_...: external command counts, see extcmd.ExtCmdThrd.counts()}
+        """
+
+        with self.__lock:
+            with self.__listener_lock:
+                transmitting = self.__tx[0]
+                result = {
+                    TEMPLATE: self.__state[TEMPLATE],
+                    RELAYS: dict(self.__state[RELAYS].get(self.__state[TEMPLATE], {})),
+                    CORE_ONLINE: self.__status[0],
+                    CORE_TRANSMITTING: transmitting,
+                    CORE_HELD: self.__sequencer.waiting() if transmitting else 0,
+                    CORE_HOLD_TIME: time.time() - self.__tx_start if transmitting else self.__tx[2],
+                }
+                result.update(self.__ext_cmd.counts())
+                return result
+
+    def select_template(self, template):
+        """
+        Make a template the one in use
+
+        Arguments:
+            template    --  template file name, empty for none
+
+        """
+
+        with self.__lock:
+            if template != self.__state[TEMPLATE]:
+                # The relays follow the template
+                if template in self.__state[RELAYS]:
+                    self.__sequencer.transition(self.__state[RELAYS].get(self.__state[TEMPLATE], {}), self.__state[RELAYS][template])
+                self.__change(CORE_STATE, (TEMPLATE,), template)
+                self.__held()
+
+    def set_relay(self, relay_id, contact_state):
+        """
+        Set one relay in the template in use
+
+        Arguments:
+            relay_id        --  global relay id
+            contact_state   --  RELAY_ON | RELAY_OFF
+
+        Returns True if there is a template in use, the relay exists and the
+        interlock allows it
+
+        """
+
+        relay_id = int(relay_id)
+        with self.__lock:
+            template = self.__state[TEMPLATE]
+            if template not in self.__state[RELAYS]:
+                self.__message('No template selected')
+                return False
+            if self.__invalid({relay_id: contact_state}):
+                return False
+            if self.__refuse(template, {relay_id: contact_state}):
+                # Whoever asked may be showing the relay as changed already
+                current = self.__state[RELAYS][template].get(relay_id)
+                if current != None:
+                    self.__notify(CORE_CHANGE, (CORE_STATE, ((RELAYS, template, relay_id), current)))
+                return False
+            # Set the relay, the engine will report completion
+            self.__sequencer.transition({relay_id: RELAY_OFF if contact_state == RELAY_ON else RELAY_ON}, {relay_id: contact_state})
+            self.__change(CORE_STATE, (RELAYS, template, relay_id), contact_state)
+            self.__held()
+            return True
+
+    def set_relays(self, relays):
+        """
+        Set several relays in the template in use together
+
+        Arguments:
+            relays  --  {relay_id: RELAY_ON | RELAY_OFF, ...}, ids may be text as JSON has them
+
+        Returns True if there is a template in use, the relays exist and the
+        interlock allows it
+
+        """
+
+        relays = {int(relay_id): contact_state for relay_id, contact_state in relays.items()}
+        with self.__lock:
+            template = self.__state[TEMPLATE]
+            if template not in self.__state[RELAYS]:
+                self.__message('No template selected')
+                return False
+            if self.__invalid(relays):
+                return False
+            if self.__refuse(template, relays):
+                return False
+            current = self.__state[RELAYS][template]
+            if len(relays) > 0:
+                self.__sequencer.transition({relay_id: current.get(relay_id) for relay_id in relays}, relays)
+                current = dict(current)
+                current.update(relays)
+                self.__change(CORE_STATE, (RELAYS, template), current)
+                self.__held()
+            return True
+
+    def set_macro(self, macro_id, name, tags = ()):
+        """
+        Save the relay states of the template in use as a macro
+
+        Arguments:
+            macro_id    --  0 based macro id, below MAX_MACROS for a button,
+                            None for the macro with this name or a new one
+            name        --  description of the macro
+            tags        --  list of tags
+
+        """
+
+        with self.__lock:
+            template = self.__state[TEMPLATE]
+            if template not in self.__state[RELAYS]:
+                self.__message('No template selected')
+                return
+            if macro_id == None:
+                macro_id = self.__macro_index(template).find(name)
+                if macro_id == None:
+                    macro_id = macrolib.next_id(self.__state[MACROS].get(template, {}))
+            macro = macrolib.make(name, tags, self.__state[RELAYS][template])
+            self.__change(CORE_STATE, (MACROS, template, macro_id), macro)
+
+    def delete_macro(self, macro_id):
+        """
+        Remove a macro from the template in use
+
+        Arguments:
+            macro_id    --  0 based macro id
+
+        """
+
+        with self.__lock:
+            template = self.__state[TEMPLATE]
+            if macro_id in self.__state[MACROS].get(template, {}):
+                self.__change(CORE_STATE, (MACROS, template, macro_id))
+
+    def execute_macro(self, macro_id):
+        """
+        Set the relays of the template in use as a macro has them
+
+        Arguments:
+            macro_id    --  0 based macro id
+
+        Returns True if there is such a macro and the interlock allows it
+
+        """
+
+        with self.__lock:
+            template = self.__state[TEMPLATE]
+            macros = self.__state[MACROS].get(template, {})
+            if macro_id not in macros:
+                self.__message('No macro %d for template %s' % (macro_id + 1, template))
+                return False
+            if self.__refuse(template, macrolib.relays(macros[macro_id], self.__api.relay_count())):
+                return False
+            # Change the relays that do not agree with the macro settings,
+            # a band change usually moves two or three of them
+            relay_count = self.__api.relay_count()
+            relays = self.__state[RELAYS][template]
+            target = macrolib.changes(macros[macro_id], relays, relay_count)
+            current = {relay_id: relays.get(relay_id) for relay_id in target}
+            # The sequencer opens contacts first, waits for them to settle and then
+            # closes the rest. Each step is one command applied in one go by each
+            # controller so there is no need to pace individual relays from here.
+            # Nobody is held up waiting for the ack.
+            if len(target) > 0:
+                self.__sequencer.transition(current, target)
+                relays = dict(relays)
+                relays.update(target)
+                self.__change(CORE_STATE, (RELAYS, template), relays)
+                self.__held()
+            self.__notify(CORE_MACRO, (macro_id, len(target), macrolib.size(macros[macro_id], relay_count) - len(target)))
+            return True
+
+    def find_macro(self, name):
+        """
+        Find a macro of the template in use by its name, ignoring case
+
+        Arguments:
+            name    --  name given when the macro was saved
+
+        Returns the 0 based macro id or None
+
+        """
+
+        with self.__lock:
+            return self.__macro_index(self.__state[TEMPLATE]).find(name)
+
+    def check(self, relays = {}, macro_id = None):
+        """
+        Say why the template in use may not be switched like this
+
+        Arguments:
+            relays      --  {relay_id: RELAY_ON | RELAY_OFF, ...} to set
+            macro_id    --  0 based id of a macro to run first, or None
+
+        Returns the reason or None if the interlock allows it
+
+        """
+
+        with self.__lock:
+            template = self.__state[TEMPLATE]
+            target = {}
+            macros = self.__state[MACROS].get(template, {})
+            if macro_id in macros:
+                target = macrolib.relays(macros[macro_id], self.__api.relay_count())
+            target.update((int(relay_id), contact_state) for relay_id, contact_state in relays.items())
+            return self.__interlock_reason(template, target)
+
+    def wait(self, timeout = SEQUENCE_TIMEOUT):
+        """
+        Wait until every relay change asked for so far has been made, do
+        not call from a listener
+
+        Arguments:
+            timeout --  seconds to wait at most
+
+        Returns True if the controllers acknowledged them all
+
+        """
+
+        return self.__sequencer.wait(timeout)
+
+    def set_tx(self, transmitting):
+        """
+        The transmitter state. While transmitting relay changes are held,
+        the relay state shows them as made, and they are all made together
+        when transmitting stops so nothing is switched under RF. Listeners
+        get CORE_TX as PTT changes and as the number held changes.
+
+        Arguments:
+            transmitting    --  True when PTT is asserted
+
+        """
+
+        with self.__lock:
+            transmitting = bool(transmitting)
+            if transmitting == self.__tx[0]:
+                return
+            if transmitting:
+                self.__tx_start = time.time()
+                self.__sequencer.hold(True)
+                self.__notify(CORE_TX, (True, 0, 0.0))
+            else:
+                held = self.__sequencer.waiting()
+                self.__sequencer.hold(False)
+                self.__notify(CORE_TX, (False, held, time.time() - self.__tx_start))
+
+    def set_window(self, window):
+        """
+        Record the GUI window geometry
+
+        Arguments:
+            window  --  [x, y, w, h]
+
+        """
+
+        with self.__lock:
+            if list(window) != self.__state[WINDOW]:
+                self.__change(CORE_STATE, (WINDOW,), list(window))
+
+    def configure(self, settings_changes, state_changes):
+        """
+        Apply the edits from a configuration session
+
+        Arguments:
+            settings_changes    --  list of (keys, value) or (keys,) to the settings
+            state_changes       --  list of (keys, value) or (keys,) to the state
+
+        """
+
+        with self.__lock:
+            relay_count = self.__api.relay_count()
+            for entry in settings_changes:
+                self.__change(CORE_SETTINGS, *entry)
+            for entry in state_changes:
+                self.__change(CORE_STATE, *entry)
+            arduino_settings = self.__settings[ARDUINO_SETTINGS]
+            if arduino_settings[NETWORK][IP] != None and arduino_settings[NETWORK][PORT] != None:
+                self.__api.set_networks(controllers.get_networks(arduino_settings))
+            # Relays on any new controllers start off
+            for template in self.__state[RELAYS]:
+                for relay_id in range(relay_count + 1, self.__api.relay_count() + 1):
+                    if relay_id not in self.__state[RELAYS][template]:
+                        self.__change(CORE_STATE, (RELAYS, template, relay_id), RELAY_OFF)
+
+    # Callbacks (engine and writer threads) ===========================================================================
+    def __api_status(self, online, message):
+        """
+        Connection state from the controllers
+
+        Arguments:
+            online  --  true if all connected
+            message --  text to drive the status messages
+
+        """
+
+        self.__notify(CORE_STATUS, (online, message))
+
+    def __completed(self, cmd_id, success, message):
+        """
+        A relay command has completed
+
+        Arguments:
+            cmd_id  --  id returned when the command was queued
+            success --  True if the Arduino acknowledged the command
+            message --  failure text
+
+        """
+
+        self.__notify(CORE_COMPLETED, (cmd_id, success, message))
+
+    def __message(self, message):
+        """
+        Pass on a message for the user
+
+        Arguments:
+            message --  text to display
+
+        """
+
+        self.__notify(CORE_MESSAGE, message)
+
+    def __read_back(self, relays):
+        """
+        Callback from API with the relays of a controller as read back
+        on (re)connect and with each connectivity check. Any that differ
+        are put right through the sequencer.
+
+        Arguments:
+            relays  --  {relay_id: RELAY_ON | RELAY_OFF, ...}
+
+        """
+
+        with self.__lock:
+            template = self.__state[TEMPLATE]
+            if template not in self.__state[RELAYS]:
+                return
+            wanted = {relay_id: contact_state for relay_id, contact_state in self.__state[RELAYS][template].items() if relay_id in relays}
+            count = self.__sequencer.resync(relays, wanted)
+        if count > 0:
+            self.__message('Resynchronised %d relay(s)' % count)
+
+    def __get_settle(self, relay_id):
+        """
+        Callback from the sequencer for the time in seconds a relay
+        takes for its contacts to open.
+
+        Arguments:
+            relay_id    --  relay to look up
+
+        """
+
+        with self.__lock:
+            relays = self.__settings[RELAY_SETTINGS].get(self.__state[TEMPLATE], {})
+            return relays.get(relay_id, {}).get(CONFIG_RELAY_SETTLE, DEFAULT_SETTLE) / 1000.0
+
+    # Helpers =========================================================================================================
+    def __change(self, cfg, keys, *value):
+        """
+        Make, save and announce one change, lock is held
+
+        Arguments:
+            cfg     --  CORE_SETTINGS | CORE_STATE
+            keys    --  tuple of keys leading to the item
+            value   --  new value, none to delete the item
+
+        """
+
+        # Our own copy, the caller may go on using the value
+        entry = (tuple(keys),) + copy.deepcopy(value)
+        persist.apply_change(self.__settings if cfg == CORE_SETTINGS else self.__state, entry)
+        if cfg == CORE_STATE and entry[0][0] == MACROS:
+            if len(entry[0]) > 1:
+                self.__macro_indexes.pop(entry[0][1], None)
+            else:
+                self.__macro_indexes = {}
+        if cfg == CORE_SETTINGS and entry[0][0] == INTERLOCK_SETTINGS:
+            if len(entry[0]) > 1:
+                self.__interlocks.pop(entry[0][1], None)
+            else:
+                self.__interlocks = {}
+        if len(value) == 0:
+            self.__writers[cfg].delete(entry[0])
+        else:
+            self.__writers[cfg].journal(entry[0], entry[1])
+        self.__notify(CORE_CHANGE, (cfg, copy.deepcopy(entry)))
+
+    def __interlock_reason(self, template, target):
+        """
+        Check the relays of a template as they would be after a change, lock is held
+
+        Arguments:
+            template    --  template file name
+            target      --  {relay_id: RELAY_ON | RELAY_OFF, ...} to set
+
+        Returns the reason the interlock refuses it or None
+
+        """
+
+        if template not in self.__interlocks:
+            try:
+                self.__interlocks[template] = interlock.Interlock(self.__settings[INTERLOCK_SETTINGS].get(template, []))
+            except ValueError as e:
+                # Better nothing switches than the rules are ignored
+                return str(e)
+        relays = dict(self.__state[RELAYS].get(template, {}))
+        relays.update(target)
+        return self.__interlocks[template].check(relays)
+
+    def __invalid(self, relays):
+        # Report and return True if a relay does not exist or a state is not one, lock is held
+        relay_count = self.__api.relay_count()
+        for relay_id, contact_state in relays.items():
+            if not 1 <= relay_id <= relay_count or contact_state not in (RELAY_ON, RELAY_OFF):
+                self.__message('Cannot set relay %d to %s' % (relay_id, str(contact_state)))
+                return True
+        return False
+
+    def __refuse(self, template, target):
+        # Report and return True if the interlock refuses a change, lock is held
+        reason = self.__interlock_reason(template, target)
+        if reason != None:
+            self.__message('Interlock: %s' % reason)
+        return reason != None
+
+    def __macro_index(self, template):
+        # The index of a template's macros, lock is held
+        if template not in self.__macro_indexes:
+            self.__macro_indexes[template] = macrolib.MacroIndex(self.__state[MACROS].get(template, {}))
+        return self.__macro_indexes[template]
+
+    def __held(self):
+        # While transmitting tell listeners when the relay changes held change, lock is held
+        if self.__tx[0]:
+            held = self.__sequencer.waiting()
+            if held != self.__tx[1]:
+                self.__notify(CORE_TX, (True, held, time.time() - self.__tx_start))
+
+    def __notify(self, event, data):
+        """
+        Call every listener
+
+        Arguments:
+            event   --  CORE_ event type
+            data    --  associated data, event specific
+
+        """
+
+        with self.__listener_lock:
+            if event == CORE_STATUS:
+                self.__status = data
+            elif event == CORE_TX:
+                self.__tx = data
+            for listener in list(self.__listeners):
+                self.__call(listener, event, data)
+
+    def __call(self, listener, event, data):
+        # A failing listener must not stop the others
+        try:
+            listener(event, data)
+        except Exception as e:
+            print ('Exception [%s][%s]' % (str(e), traceback.format_exc()))
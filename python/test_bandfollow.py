@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# test_bandfollow.py
+#
+# Tests of band following
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import unittest
+
+TEST_TEMPLATE = 'test.png'
+# 40m split in two so one band starts where the other ends
+TEST_RULES = [[14000000, 14350000, '20m'], [7000000, 7100000, '40m cw'], [7100001, 7200000, '40m ssb']]
+
+"""
+Rules found by frequency
+"""
+class BandIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = bandfollow.BandIndex(TEST_RULES)
+
+    def test_edges(self):
+        self.assertEqual(self.index.find(7000000)[2], '40m cw')
+        self.assertEqual(self.index.find(7100000)[2], '40m cw')
+        self.assertEqual(self.index.find(7100001)[2], '40m ssb')
+        self.assertEqual(self.index.find(14350000)[2], '20m')
+
+    def test_outside(self):
+        for freq in (0, 6999999, 7200001, 13999999, 14350001, 30000000):
+            self.assertIsNone(self.index.find(freq), freq)
+
+    def test_empty(self):
+        self.assertIsNone(bandfollow.BandIndex([]).find(7000000))
+
+    def test_overlap(self):
+        # Both edges are in the band so a shared edge overlaps
+        with self.assertRaises(ValueError):
+            bandfollow.BandIndex([[7000000, 7100000, 'a'], [7100000, 7200000, 'b']])
+
+"""
+A follower fed frequencies by UDP, with the real dwell and intervals
+"""
+class BandFollowerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatched = []
+        self.messages = []
+        self.follower = bandfollow.BandFollower(self.dispatched.append, self.messages.append)
+        self.follower.event(CORE_SNAPSHOT, ({BAND_SETTINGS: {BAND_RIG: None, BAND_RULES: {TEST_TEMPLATE: TEST_RULES}}}, {TEMPLATE: TEST_TEMPLATE}))
+        self.follower.start()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.sock.close()
+        self.follower.terminate()
+        self.follower.join()
+
+    def tune(self, freq):
+        # Send a frequency, return once the follower has it
+        self.sock.sendto(('F %d' % freq).encode(), (BAND_UDP_IP, BAND_UDP_PORT))
+        deadline = time.time() + 5
+        while self.follower.freq != freq:
+            self.assertLess(time.time(), deadline, 'frequency not taken')
+            time.sleep(0.01)
+        return time.time()
+
+    def wait_switches(self, switches):
+        # Return when the follower has switched this often
+        deadline = time.time() + BAND_MIN_INTERVAL + 5
+        while len(self.dispatched) < switches:
+            self.assertLess(time.time(), deadline, 'no switch')
+            time.sleep(0.01)
+        return time.time()
+
+    def test_dwell(self):
+        tuned = self.tune(7050000)
+        switched = self.wait_switches(1)
+        self.assertGreaterEqual(switched - tuned, BAND_DWELL - 0.05)
+        self.assertEqual(self.dispatched, ['macro:40m cw'])
+
+    def test_passing_through(self):
+        # A band left before its dwell is not switched to
+        self.tune(14100000)
+        self.tune(10100000)
+        self.tune(7050000)
+        self.wait_switches(1)
+        time.sleep(BAND_DWELL)
+        self.assertEqual(self.dispatched, ['macro:40m cw'])
+
+    def test_between_bands(self):
+        self.tune(7050000)
+        self.wait_switches(1)
+        self.tune(10100000)
+        time.sleep(BAND_DWELL * 2)
+        self.assertEqual(len(self.dispatched), 1)
+
+    def test_hysteresis(self):
+        self.tune(7050000)
+        first = self.wait_switches(1)
+        # In the next band but not far enough beyond this one
+        self.tune(7100000 + BAND_HYSTERESIS)
+        time.sleep(BAND_DWELL * 2)
+        self.assertEqual(len(self.dispatched), 1)
+        # Then far enough, no sooner than the minimum interval
+        self.tune(7100001 + BAND_HYSTERESIS)
+        second = self.wait_switches(2)
+        self.assertGreaterEqual(second - first, BAND_MIN_INTERVAL - 0.05)
+        self.assertEqual(self.dispatched, ['macro:40m cw', 'macro:40m ssb'])
+
+    def test_bad_rules(self):
+        self.follower.event(CORE_CHANGE, (CORE_SETTINGS, ((BAND_SETTINGS, BAND_RULES, TEST_TEMPLATE), [[7000000, 7100000, 'a'], [7050000, 7200000, 'b']])))
+        self.assertEqual(len(self.messages), 1)
+        self.tune(7050000)
+        time.sleep(BAND_DWELL * 2)
+        self.assertEqual(self.dispatched, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# test_emulator.py
+#
+# Tests of the Arduino emulator protocol
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import unittest
+import emulator
+
+"""
+Raw datagrams to an emulator
+"""
+class EmulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = emulator.ArduinoEmulator(port = 0, loop_delay = 0)
+        self.emulator.start()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(5)
+
+    def tearDown(self):
+        self.sock.close()
+        self.emulator.terminate()
+
+    def command(self, text):
+        # Send a command and return its last reply
+        self.sock.sendto(text.encode(), self.emulator.address())
+        while True:
+            reply = self.sock.recv(1024).decode()
+            if reply.startswith('ack'):
+                return reply
+
+    def test_sequenced_command(self):
+        self.assertEqual(self.command('#1:1e2e'), 'ack:1')
+        self.assertEqual([relay_id for relay_id in range(1, 5) if self.emulator.relays[relay_id]], [1, 2])
+
+    def test_retransmit_after_ping(self):
+        # The ack for relay command 1 is lost and a ping goes out before the retransmit
+        self.command('#1:1e')
+        self.emulator.relays[1] = False
+        self.command('#2:ping')
+        self.assertEqual(self.command('#1:1e'), 'ack:1')
+        self.assertEqual(self.emulator.executed, 2)
+        self.assertFalse(self.emulator.relays[1])
+
+    def test_window(self):
+        # Beyond the window a sequence number is new again
+        for seq in range(1, emulator.EMULATOR_SEQ_WINDOW + 2):
+            self.command('#%d:ping' % seq)
+        self.command('#1:ping')
+        self.assertEqual(self.emulator.executed, emulator.EMULATOR_SEQ_WINDOW + 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# test_extcmd.py
+#
+# Tests of the external command listener
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import unittest
+import re
+from test_switchcore import CoreTestCase, TEST_TEMPLATE
+
+"""
+Datagrams to the external command port of a running core
+"""
+class ExtCmdTest(CoreTestCase):
+
+    def setUp(self):
+        super(ExtCmdTest, self).setUp()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(EXT_REPLY_TIMEOUT + 2)
+        # Macro 1 with relays 3 and 4 on
+        self.core.set_relays({3: RELAY_ON, 4: RELAY_ON})
+        self.core.set_macro(0, 'Beam North', ['hf'])
+        self.core.set_relays({3: RELAY_OFF, 4: RELAY_OFF})
+        self.assertTrue(self.core.wait(5))
+
+    def tearDown(self):
+        self.sock.close()
+        super(ExtCmdTest, self).tearDown()
+
+    def send(self, text):
+        # Return the reply as (id prefix, [result, ...], state)
+        self.sock.sendto(text.encode(), (EXT_UDP_IP, EXT_UDP_PORT))
+        reply = self.sock.recv(1024).decode()
+        match = re.match(r'^(#[^:]*:)?(.*);latency=\d+,\d+;state=(.*)$', reply)
+        self.assertIsNotNone(match, reply)
+        return match.group(1), match.group(2).split(';'), match.group(3)
+
+    def energised(self):
+        return [relay_id for relay_id in range(1, 17) if self.emulator.relays[relay_id]]
+
+    def test_ping(self):
+        self.assertEqual(self.send('ping'), (None, ['pong'], '%s:%s' % (TEST_TEMPLATE, ''.join('%dd' % relay_id for relay_id in range(1, 17)))))
+
+    def test_correlation_id(self):
+        prefix, results, state = self.send('#abc:query')
+        self.assertEqual((prefix, results), ('#abc:', ['ok']))
+
+    def test_set_and_clear(self):
+        prefix, results, state = self.send('set:1,2;clear:2;query')
+        self.assertEqual(results, ['ok', 'ok', 'ok'])
+        self.assertTrue(state.startswith('%s:1e2d3d' % TEST_TEMPLATE))
+        # Replied once the relays have switched
+        self.assertEqual(self.energised(), [1])
+
+    def test_switch(self):
+        self.assertEqual(self.send('switch:1')[1], ['ok'])
+        self.assertEqual(self.energised(), [3, 4])
+
+    def test_macro_by_name(self):
+        self.assertEqual(self.send('macro:beam north')[1], ['ok'])
+        self.assertEqual(self.energised(), [3, 4])
+
+    def test_errors(self):
+        prefix, results, state = self.send('switch:9;macro:nowhere;set:99;bogus;ping')
+        self.assertEqual(results, ['error=no macro 9', 'error=no macro nowhere', 'error=cannot set relays 99', 'error=unknown command bogus', 'pong'])
+
+    def wait_executed(self, source, executed):
+        # Counts are passed on just after the reply goes
+        deadline = time.time() + 5
+        while source.query()[CORE_EXT_EXECUTED] < executed:
+            self.assertLess(time.time(), deadline, 'counts not passed on')
+            time.sleep(0.05)
+        return source.query()
+
+    def test_counts(self):
+        counts = []
+        self.core.attach(lambda event, data: counts.append(data) if event == CORE_EXT else None)
+        self.assertEqual(counts[-1][CORE_EXT_RECEIVED], 0)
+        self.send('ping')
+        self.send('#1:query')
+        state = self.wait_executed(self.core, 2)
+        self.assertEqual((state[CORE_EXT_RECEIVED], state[CORE_EXT_COALESCED], state[CORE_EXT_OVERFLOWS]), (2, 0, 0))
+        self.assertGreaterEqual(state[CORE_EXT_MAX_WAIT], 0)
+        self.assertEqual(counts[-1][CORE_EXT_EXECUTED], 2)
+
+    def test_counts_at_client(self):
+        server = coreserver.CoreServer(self.core, '127.0.0.1', 0, 0)
+        server.start()
+        client = coreclient.CoreClient(*server.address())
+        try:
+            client.start()
+            self.send('ping')
+            state = self.wait_executed(client, 1)
+            self.assertEqual((state[CORE_EXT_RECEIVED], state[CORE_EXT_EXECUTED]), (1, 1))
+        finally:
+            client.terminate()
+            server.terminate()
+            server.join()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# test_interlock.py
+#
+# Tests of the interlock
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import unittest
+from test_switchcore import CoreTestCase, TEST_TEMPLATE
+
+TEST_RULES = [
+    [INTERLOCK_EXCLUSIVE, [1, 2], 'Both transmitters on the beam'],
+    [INTERLOCK_FORBID, [5], [6], 'Receive port without the preamp bypassed'],
+]
+
+"""
+Rules compiled and checked without a core
+"""
+class InterlockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.interlock = interlock.Interlock(TEST_RULES)
+
+    def test_allowed(self):
+        self.assertIsNone(self.interlock.check({}))
+        self.assertIsNone(self.interlock.check({1: RELAY_ON, 2: RELAY_OFF, 5: RELAY_ON, 6: RELAY_ON}))
+        # A relay not in the vector is not known to be de-energised
+        self.assertIsNone(self.interlock.check({5: RELAY_ON}))
+
+    def test_exclusive(self):
+        self.assertEqual(self.interlock.check({1: RELAY_ON, 2: RELAY_ON}), 'Both transmitters on the beam')
+
+    def test_forbid(self):
+        self.assertEqual(self.interlock.check({5: RELAY_ON, 6: RELAY_OFF}), 'Receive port without the preamp bypassed')
+
+    def test_bad_rules(self):
+        for rule in ([INTERLOCK_EXCLUSIVE, [0], 'no relay'], [INTERLOCK_FORBID, [1], 'short'], ['sometimes', [1], 'unknown']):
+            with self.assertRaises(ValueError):
+                interlock.Interlock([rule])
+
+"""
+Changes refused by a running core
+"""
+class CoreInterlockTest(CoreTestCase):
+
+    def setUp(self):
+        super(CoreInterlockTest, self).setUp()
+        # Saved before the rules so running it is refused later
+        self.core.set_relays({1: RELAY_ON, 2: RELAY_ON})
+        self.core.set_macro(0, 'Both', [])
+        self.core.set_relays({1: RELAY_ON, 2: RELAY_OFF})
+        self.assertTrue(self.core.wait(5))
+        self.core.configure([((INTERLOCK_SETTINGS, TEST_TEMPLATE), TEST_RULES)], [])
+        self.events = []
+        self.core.attach(lambda event, data: self.events.append((event, data)) if event in (CORE_CHANGE, CORE_MESSAGE, CORE_MACRO) else None)
+
+    def assertUnchanged(self):
+        self.assertTrue(self.core.wait(5))
+        self.assertEqual((self.core.query()[RELAYS][1], self.core.query()[RELAYS][2]), (RELAY_ON, RELAY_OFF))
+        self.assertEqual(self.emulator.relays[1:3], [True, False])
+        self.assertIn((CORE_MESSAGE, 'Interlock: Both transmitters on the beam'), self.events)
+
+    def test_set_relay(self):
+        self.assertEqual(self.core.check({2: RELAY_ON}), 'Both transmitters on the beam')
+        self.assertFalse(self.core.set_relay(2, RELAY_ON))
+        self.assertUnchanged()
+        # The GUI has shown the relay as changed, this puts it back
+        self.assertIn((CORE_CHANGE, (CORE_STATE, ((RELAYS, TEST_TEMPLATE, 2), RELAY_OFF))), self.events)
+
+    def test_set_relays(self):
+        self.assertFalse(self.core.set_relays({2: RELAY_ON, 3: RELAY_ON}))
+        self.assertUnchanged()
+        self.assertEqual(self.core.query()[RELAYS][3], RELAY_OFF)
+
+    def test_execute_macro(self):
+        self.assertEqual(self.core.check(macro_id = 0), 'Both transmitters on the beam')
+        self.assertFalse(self.core.execute_macro(0))
+        self.assertUnchanged()
+        self.assertNotIn(CORE_MACRO, [event for event, data in self.events])
+
+    def test_allowed(self):
+        self.assertTrue(self.core.set_relays({1: RELAY_OFF, 2: RELAY_ON}))
+        self.assertTrue(self.core.wait(5))
+        self.assertEqual(self.emulator.relays[1:3], [False, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# test_macrolib.py
+#
+# Tests of the macro library
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import unittest
+
+"""
+Macros as masks, without a core
+"""
+class MacroTest(unittest.TestCase):
+
+    def setUp(self):
+        # Relays 1 and 3 on, 2 off, 4 left alone
+        self.macro = macrolib.make('Beam North', ['hf', '20m'], {1: RELAY_ON, 2: RELAY_OFF, 3: RELAY_ON})
+
+    def test_make(self):
+        self.assertEqual(self.macro, {MACRO_NAME: 'Beam North', MACRO_TAGS: ['hf', '20m'], MACRO_MASK: 0b111, MACRO_ON: 0b101})
+        self.assertEqual(macrolib.relays(self.macro, 16), {1: RELAY_ON, 2: RELAY_OFF, 3: RELAY_ON})
+        self.assertEqual(macrolib.size(self.macro, 16), 3)
+
+    def test_changes(self):
+        current = {1: RELAY_ON, 2: RELAY_ON, 3: RELAY_OFF, 4: RELAY_ON}
+        self.assertEqual(macrolib.changes(self.macro, current, 16), {2: RELAY_OFF, 3: RELAY_ON})
+
+    def test_changes_none(self):
+        current = {1: RELAY_ON, 2: RELAY_OFF, 3: RELAY_ON, 4: RELAY_OFF}
+        self.assertEqual(macrolib.changes(self.macro, current, 16), {})
+
+    def test_changes_unknown(self):
+        # A relay not known is always set
+        self.assertEqual(macrolib.changes(self.macro, {1: RELAY_ON}, 16), {2: RELAY_OFF, 3: RELAY_ON})
+
+    def test_changes_relay_count(self):
+        # Relays beyond those there are are left out
+        self.assertEqual(macrolib.changes(self.macro, {}, 2), {1: RELAY_ON, 2: RELAY_OFF})
+        self.assertEqual(macrolib.size(self.macro, 2), 2)
+
+    def test_label(self):
+        self.assertEqual(macrolib.label(self.macro), 'Beam North #hf #20m')
+        self.assertEqual(macrolib.parse('Beam  #hf North #20m #'), ('Beam North', ['hf', '20m']))
+
+    def test_next_id(self):
+        self.assertEqual(macrolib.next_id({}), MAX_MACROS)
+        self.assertEqual(macrolib.next_id({0: self.macro, MAX_MACROS + 2: self.macro}), MAX_MACROS + 3)
+
+    def test_upgrade(self):
+        macros = {0: {TT: 'Vertical #40m', 1: RELAY_ON, 2: RELAY_OFF}, 1: dict(self.macro)}
+        macrolib.upgrade(macros)
+        self.assertEqual(macros[0], macrolib.make('Vertical', ['40m'], {1: RELAY_ON, 2: RELAY_OFF}))
+        # Already upgraded is left alone
+        self.assertEqual(macros[1], self.macro)
+
+"""
+Macros found by name and by words
+"""
+class MacroIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = macrolib.MacroIndex({
+            0: macrolib.make('Beam North', ['hf'], {}),
+            1: macrolib.make('Beam South', ['hf', '20m'], {}),
+            2: macrolib.make('Vertical', ['40m'], {}),
+            7: macrolib.make('beam north', [], {}),
+        })
+
+    def test_find(self):
+        self.assertEqual(self.index.find('Vertical'), 2)
+        self.assertEqual(self.index.find('  VERTICAL '), 2)
+        self.assertIsNone(self.index.find('Vert'))
+
+    def test_find_lowest_id(self):
+        self.assertEqual(self.index.find('Beam North'), 0)
+
+    def test_search(self):
+        self.assertEqual(self.index.search('beam'), [0, 1, 7])
+        self.assertEqual(self.index.search('be no'), [0, 7])
+        self.assertEqual(self.index.search('#hf 20'), [1])
+        self.assertEqual(self.index.search('4'), [2])
+        self.assertEqual(self.index.search('yagi'), [])
+        self.assertEqual(self.index.search(''), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# test_persist.py
+#
+# Tests of configuration and state persistence
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+"""
+Snapshots, journals and migration in a scratch directory
+"""
+class PersistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'state.cfg')
+        self.errors = []
+        self.state = copy.deepcopy(DEFAULT_STATE)
+        self.state[TEMPLATE] = 'a.png'
+        self.state[RELAYS]['a.png'] = {1: RELAY_OFF, 2: RELAY_OFF}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors = True)
+
+    def load(self):
+        return persist.getSavedCfg(self.path, DEFAULT_STATE, self.errors.append)
+
+    def write(self, version, cfg):
+        # A snapshot as an older version would have written it
+        with open(self.path, 'w', encoding='UTF-8') as f:
+            f.write(repr({STORE_VERSION_KEY: version, STORE_DATA_KEY: cfg}))
+
+    def test_round_trip(self):
+        persist.saveCfg(self.path, self.state)
+        self.assertEqual(self.load(), self.state)
+        self.assertEqual(self.errors, [])
+
+    def test_journal_replay_after_crash(self):
+        persist.saveCfg(self.path, self.state)
+        writer = persist.PersistWriter(self.path, copy.deepcopy(self.state), 0.05, self.errors.append)
+        writer.start()
+        try:
+            writer.journal((RELAYS, 'a.png', 1), RELAY_ON)
+            writer.journal((WINDOW,), [1, 2, 3, 4])
+            writer.delete((RELAYS, 'a.png', 2))
+            deadline = time.time() + 5
+            while not os.path.exists(self.path + JOURNAL_EXT) or open(self.path + JOURNAL_EXT).read().count('\n') < 3:
+                self.assertLess(time.time(), deadline, 'journal not written')
+                time.sleep(0.01)
+            # Read as if the process died here, the snapshot is the old one
+            cfg = self.load()
+        finally:
+            writer.terminate()
+            writer.join()
+        self.assertEqual(cfg[RELAYS]['a.png'], {1: RELAY_ON})
+        self.assertEqual(cfg[WINDOW], [1, 2, 3, 4])
+
+    def test_torn_journal(self):
+        persist.saveCfg(self.path, self.state)
+        with open(self.path + JOURNAL_EXT, 'w', encoding='UTF-8') as f:
+            f.write(repr(((RELAYS, 'a.png', 1), RELAY_ON)) + '\n')
+            f.write("((RELAYS, 'a.png', 2), 'relay")
+        cfg = self.load()
+        self.assertEqual(cfg[RELAYS]['a.png'], {1: RELAY_ON, 2: RELAY_OFF})
+
+    def test_pickle_migration(self):
+        old = {TEMPLATE: 'a.png', RELAYS: {'a.png': {1: RELAY_ON}}, MACROS: {'a.png': {0: {TT: 'Dipole #hf', 1: RELAY_ON, 2: RELAY_OFF}}}}
+        with open(self.path, 'wb') as f:
+            f.write(pickle.dumps(old))
+        cfg = self.load()
+        self.assertEqual(cfg[MACROS]['a.png'][0], macrolib.make('Dipole', ['hf'], {1: RELAY_ON, 2: RELAY_OFF}))
+        # Anything added since comes from the defaults
+        self.assertEqual(cfg[WINDOW], DEFAULT_STATE[WINDOW])
+        persist.saveCfg(self.path, cfg)
+        with open(self.path, 'rb') as f:
+            self.assertNotEqual(f.read(1), PICKLE_MAGIC)
+        self.assertEqual(self.load(), cfg)
+
+    def test_version_steps(self):
+        old_macro = {TT: 'Beam', 3: RELAY_ON}
+        new_macro = macrolib.make('Beam', [], {3: RELAY_ON})
+        for version in range(1, STORE_VERSION + 1):
+            with self.subTest(version = version):
+                self.write(version, {TEMPLATE: 'a.png', MACROS: {'a.png': {0: old_macro if version < 2 else new_macro}}})
+                cfg = self.load()
+                self.assertEqual(cfg[MACROS]['a.png'][0], new_macro)
+                if version < STORE_VERSION:
+                    # Defaults for anything added since
+                    for key in DEFAULT_STATE:
+                        self.assertIn(key, cfg)
+
+    def test_journal_before_migration(self):
+        # The journal is in the format of its snapshot, replayed before the upgrade
+        self.write(1, {TEMPLATE: 'a.png', MACROS: {'a.png': {}}})
+        with open(self.path + JOURNAL_EXT, 'w', encoding='UTF-8') as f:
+            f.write(repr(((MACROS, 'a.png', 0), {TT: 'Beam', 3: RELAY_ON})) + '\n')
+        self.assertEqual(self.load()[MACROS]['a.png'][0], macrolib.make('Beam', [], {3: RELAY_ON}))
+
+    def test_newer_version(self):
+        self.write(STORE_VERSION + 1, self.state)
+        self.assertIsNone(self.load())
+        self.assertEqual(len(self.errors), 1)
+
+    def test_atomic_replace(self):
+        persist.saveCfg(self.path, self.state)
+        changed = copy.deepcopy(self.state)
+        changed[TEMPLATE] = 'b.png'
+        # Killed before the rename, the old snapshot is untouched
+        with unittest.mock.patch('persist.os.replace', side_effect=OSError('killed')):
+            persist.saveCfg(self.path, changed, self.errors.append)
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(self.load(), self.state)
+        # The next save replaces it
+        persist.saveCfg(self.path, changed)
+        self.assertEqual(self.load(), changed)
+        self.assertEqual(os.listdir(self.dir), ['state.cfg'])
+
+if __name__ == '__main__':
+    unittest.main()
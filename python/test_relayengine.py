@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# test_relayengine.py
+#
+# Tests of the relay command engine against the Arduino emulator
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import unittest
+import emulator
+
+"""
+A RelayEngine connected to an emulator
+"""
+class RelayEngineTest(unittest.TestCase):
+
+    # False for firmware that only understands text
+    binary = True
+
+    def setUp(self):
+        self.emulator = emulator.ArduinoEmulator(port = 0, loop_delay = 0, binary = self.binary)
+        self.emulator.start()
+        self.online = threading.Event()
+        self.cv = threading.Condition()
+        # {cmd_id: success, ...}
+        self.completed = {}
+        self.engine = relayengine.RelayEngine(list(self.emulator.address()), self.status, self.completion)
+        self.engine.start()
+        self.assertTrue(self.online.wait(5), 'emulator not connected')
+
+    def tearDown(self):
+        self.engine.terminate()
+        self.engine.join()
+        self.emulator.terminate()
+
+    def status(self, online, message):
+        if online:
+            self.online.set()
+
+    def completion(self, cmd_id, success, message):
+        with self.cv:
+            self.completed[cmd_id] = success
+            self.cv.notify_all()
+
+    def wait_completed(self, cmd_id):
+        with self.cv:
+            self.assertTrue(self.cv.wait_for(lambda: cmd_id in self.completed, 5), 'command not completed')
+            return self.completed[cmd_id]
+
+    def test_set_relays(self):
+        cmd_id = self.engine.set_relays([(1, RELAY_ON), (2, RELAY_ON)])
+        self.assertTrue(self.wait_completed(cmd_id))
+        self.assertEqual([relay_id for relay_id in range(1, 5) if self.emulator.relays[relay_id]], [1, 2])
+
+    def test_empty_command_not_sent(self):
+        # Let the connect probe and read back finish
+        self.assertTrue(self.wait_completed(self.engine.set_relays([(1, RELAY_ON)])))
+        received = self.emulator.received
+        self.assertTrue(self.wait_completed(self.engine.set_relays([])))
+        self.assertEqual(self.emulator.received, received)
+
+"""
+The same against older firmware, the engine falls back to text
+"""
+class TextRelayEngineTest(RelayEngineTest):
+
+    binary = False
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# test_relayframe.py
+#
+# Tests of the binary relay frame
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import unittest
+
+"""
+Frames encoded and decoded without a controller
+"""
+class RelayFrameTest(unittest.TestCase):
+
+    def test_crc8(self):
+        # The CRC-8 check value for poly 0x07, initial 0
+        self.assertEqual(relayframe.crc8(b'123456789'), 0xF4)
+
+    def test_round_trip(self):
+        for seq, mask_a, mask_b in ((0, 0, 0), (1, 0x0001, 0x8000), (65535, 0xFFFF, 0xFFFF), (300, 0x00F0, 0x0F00)):
+            frame = relayframe.encode(seq, mask_a, mask_b)
+            self.assertEqual(len(frame), relayframe.FRAME_SIZE)
+            self.assertTrue(relayframe.is_frame(frame))
+            self.assertEqual(relayframe.decode(frame), (seq, mask_a, mask_b))
+
+    def test_corrupt(self):
+        frame = relayframe.encode(7, 0x0003, 0x000C)
+        for index in range(1, relayframe.FRAME_SIZE):
+            corrupt = bytearray(frame)
+            corrupt[index] ^= 0x10
+            self.assertIsNone(relayframe.decode(bytes(corrupt)))
+
+    def test_text_is_not_a_frame(self):
+        for text in (b'#12:1e2d', b'ping', b'status=0003:4', b'12345678'):
+            self.assertFalse(relayframe.is_frame(text))
+            self.assertIsNone(relayframe.decode(text))
+
+    def test_to_masks(self):
+        self.assertEqual(relayframe.to_masks({1: True, 2: False, 16: True}), (0x8001, 0x0002))
+        self.assertEqual(relayframe.to_masks({}), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#
+# test_switchcore.py
+#
+# Tests of the switch core against the Arduino emulator
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import json
+import shutil
+import tempfile
+import unittest
+import emulator
+
+# Template used by the tests
+TEST_TEMPLATE = 'test.png'
+# Read backs come this often rather than every PING_INTERVAL
+TEST_PING_INTERVAL = 0.2 # s
+
+"""
+Runs a SwitchCore against an emulator with every relay off
+"""
+class CoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = emulator.ArduinoEmulator(port = 0, loop_delay = 0)
+        self.emulator.start()
+        self.path = tempfile.mkdtemp()
+        settings = copy.deepcopy(DEFAULT_SETTINGS)
+        settings[ARDUINO_SETTINGS][NETWORK] = list(map(str, self.emulator.address()))
+        state = copy.deepcopy(DEFAULT_STATE)
+        state[TEMPLATE] = TEST_TEMPLATE
+        state[RELAYS][TEST_TEMPLATE] = {relay_id: RELAY_OFF for relay_id in range(1, emulator.EMULATOR_RELAYS + 1)}
+        persist.saveCfg(os.path.join(self.path, 'settings.cfg'), settings)
+        persist.saveCfg(os.path.join(self.path, 'state.cfg'), state)
+        self.core = switchcore.SwitchCore(os.path.join(self.path, 'settings.cfg'), os.path.join(self.path, 'state.cfg'), ping_interval = TEST_PING_INTERVAL)
+        self.core.start()
+        self.wait_online()
+
+    def tearDown(self):
+        self.core.terminate()
+        self.emulator.terminate()
+        shutil.rmtree(self.path, ignore_errors = True)
+
+    def wait_online(self):
+        deadline = time.time() + 5
+        while not self.core.query()[CORE_ONLINE]:
+            self.assertLess(time.time(), deadline, 'emulator not connected')
+            time.sleep(0.05)
+
+"""
+The sequencer with a controller that acknowledges at once
+"""
+class SequencerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        # Hold once this many steps have been sent
+        self.hold_after = None
+        self.sequencer = sequencer.Sequencer(self.send, lambda relay_id: 0, lambda cmd_id, success, message: None)
+
+    def tearDown(self):
+        self.sequencer.terminate()
+        if self.sequencer.is_alive():
+            self.sequencer.join()
+
+    def send(self, relays):
+        self.sent.append(relays)
+        if self.hold_after != None and len(self.sent) == self.hold_after:
+            self.sequencer.hold(True)
+        self.sequencer.completed(len(self.sent), True, '')
+        return len(self.sent)
+
+    def test_resync_is_planned(self):
+        self.sequencer.start()
+        self.assertEqual(self.sequencer.resync({1: RELAY_ON, 2: RELAY_OFF}, {1: RELAY_OFF, 2: RELAY_ON}), 2)
+        self.assertTrue(self.sequencer.wait(1))
+        # Break before make
+        self.assertEqual(self.sent, [[(1, RELAY_OFF)], [(2, RELAY_ON)]])
+
+    def test_resync_ignored_while_queued(self):
+        self.sequencer.transition({3: RELAY_OFF}, {3: RELAY_ON})
+        self.assertEqual(self.sequencer.resync({1: RELAY_ON}, {1: RELAY_OFF}), 0)
+
+    def test_resync_against_sent(self):
+        self.sequencer.start()
+        self.sequencer.transition({1: RELAY_OFF}, {1: RELAY_ON})
+        self.assertTrue(self.sequencer.wait(1))
+        self.assertEqual(self.sequencer.resync({1: RELAY_ON}, {1: RELAY_OFF}), 0)
+        self.assertEqual(self.sequencer.resync({1: RELAY_OFF}, {1: RELAY_OFF}), 1)
+
+    def test_resync_ignored_while_held(self):
+        self.sequencer.start()
+        self.sequencer.hold(True)
+        self.assertEqual(self.sequencer.resync({1: RELAY_ON}, {1: RELAY_OFF}), 0)
+
+    def test_waiting_counts_relays(self):
+        self.sequencer.hold(True)
+        self.sequencer.transition({relay_id: RELAY_OFF for relay_id in range(1, 7)}, {relay_id: RELAY_ON for relay_id in range(1, 7)})
+        self.sequencer.transition({7: RELAY_OFF, 1: RELAY_ON}, {7: RELAY_ON, 1: RELAY_ON})
+        self.assertEqual(self.sequencer.waiting(), 7)
+
+    def test_hold_merges_started_plan(self):
+        # Held once the break has gone, the make waits for the release
+        self.hold_after = 1
+        self.sequencer.start()
+        self.sequencer.transition({1: RELAY_ON, 2: RELAY_OFF}, {1: RELAY_OFF, 2: RELAY_ON})
+        deadline = time.time() + 1
+        while self.sequencer.waiting() != 1:
+            self.assertLess(time.time(), deadline, 'plan not held')
+            time.sleep(0.01)
+        self.sequencer.transition({3: RELAY_OFF}, {3: RELAY_ON})
+        self.assertEqual(self.sequencer.waiting(), 2)
+        self.sequencer.hold(False)
+        self.assertTrue(self.sequencer.wait(1))
+        self.assertEqual(self.sent, [[(1, RELAY_OFF)], [(2, RELAY_ON), (3, RELAY_ON)]])
+
+"""
+Relays read back from the emulator
+"""
+class ResyncTest(CoreTestCase):
+
+    def test_resync(self):
+        self.assertTrue(self.core.set_relays({1: RELAY_ON}))
+        self.assertTrue(self.core.wait(5))
+        # Changed behind our back
+        self.emulator.relays[1] = False
+        self.emulator.relays[3] = True
+        deadline = time.time() + 5
+        while not self.emulator.relays[1] or self.emulator.relays[3]:
+            self.assertLess(time.time(), deadline, 'relays not put right')
+            time.sleep(0.1)
+
+"""
+Relay changes held while transmitting
+"""
+class TransmitTest(CoreTestCase):
+
+    def test_held_while_transmitting(self):
+        self.assertTrue(self.core.set_relays({1: RELAY_ON}))
+        self.assertTrue(self.core.wait(5))
+        before = list(self.emulator.relays)
+        self.core.set_tx(True)
+        self.assertTrue(self.core.set_relay(3, RELAY_ON))
+        self.assertTrue(self.core.set_relays({1: RELAY_OFF, 2: RELAY_ON}))
+        self.assertEqual(self.core.query()[CORE_HELD], 3)
+        # A read back during the hold must not put this right either
+        self.emulator.relays[5] = True
+        before[5] = True
+        deadline = time.time() + TEST_PING_INTERVAL * 5
+        while time.time() < deadline:
+            self.assertEqual(self.emulator.relays, before, 'relay switched while transmitting')
+            time.sleep(0.05)
+        self.core.set_tx(False)
+        self.assertTrue(self.core.wait(5))
+        self.assertEqual([relay_id for relay_id in range(1, 6) if self.emulator.relays[relay_id]], [2, 3, 5])
+
+    def test_held_reported(self):
+        tx = []
+        self.core.attach(lambda event, data: tx.append(data[:2]) if event == CORE_TX else None)
+        self.core.set_tx(True)
+        self.core.set_relay(3, RELAY_ON)
+        self.core.set_relays({3: RELAY_ON, 4: RELAY_ON})
+        self.core.set_tx(False)
+        self.assertEqual(tx, [(False, 0), (True, 0), (True, 1), (True, 2), (False, 2)])
+
+    def test_held_at_client(self):
+        server = coreserver.CoreServer(self.core, '127.0.0.1', 0, 0)
+        server.start()
+        client = coreclient.CoreClient(*server.address())
+        try:
+            client.start()
+            self.core.set_tx(True)
+            self.core.set_relays({3: RELAY_ON, 4: RELAY_ON})
+            deadline = time.time() + 5
+            while client.query()[CORE_HELD] != 2:
+                self.assertLess(time.time(), deadline, 'held count not passed on')
+                time.sleep(0.05)
+            self.assertGreater(client.query()[CORE_HOLD_TIME], 0)
+            self.core.set_tx(False)
+            while client.query()[CORE_TRANSMITTING]:
+                self.assertLess(time.time(), deadline, 'release not passed on')
+                time.sleep(0.05)
+            self.assertEqual(client.query()[CORE_HELD], 0)
+        finally:
+            client.terminate()
+            server.terminate()
+            server.join()
+
+"""
+Requests through the core server
+"""
+class ServerTest(CoreTestCase):
+
+    def setUp(self):
+        super(ServerTest, self).setUp()
+        self.server = coreserver.CoreServer(self.core, '127.0.0.1', 0, 0)
+        self.server.start()
+        self.sock = socket.create_connection(self.server.address(), 5)
+        self.reader = self.sock.makefile('rb')
+
+    def tearDown(self):
+        self.reader.close()
+        self.sock.close()
+        self.server.terminate()
+        self.server.join()
+        super(ServerTest, self).tearDown()
+
+    def request(self, method, *args):
+        self.sock.sendall((json.dumps({'id': 1, 'method': method, 'args': args}) + '\n').encode())
+        return json.loads(self.reader.readline().decode())
+
+    def test_set_relay(self):
+        reply = self.request('set_relay', 3, RELAY_ON)
+        self.assertTrue(reply['ok'])
+        self.assertTrue(reply['result'])
+        self.assertEqual(self.core.query()[RELAYS][3], RELAY_ON)
+
+    def test_set_relay_bad_relay(self):
+        before = self.core.query()
+        reply = self.request('set_relay', 99, RELAY_ON)
+        self.assertFalse(reply['result'])
+        self.assertEqual(self.core.query(), before)
+
+    def test_set_relay_bad_state(self):
+        before = self.core.query()
+        reply = self.request('set_relay', 3, 'garbage')
+        self.assertFalse(reply['result'])
+        self.assertEqual(self.core.query(), before)
+
+if __name__ == '__main__':
+    unittest.main()
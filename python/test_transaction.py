@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# test_transaction.py
+#
+# Tests of copy-on-write configuration transactions
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# Run from here or from the repository root
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# All imports
+from coreimports import *
+import unittest
+
+"""
+Edits through a Transaction leave the original alone
+"""
+class TransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base = {
+            TEMPLATE: 'a.png',
+            RELAYS: {'a.png': {1: RELAY_OFF, 2: RELAY_OFF}, 'b.png': {1: RELAY_ON}},
+            WINDOW: [1, 2, 3, 4],
+        }
+        self.original = copy.deepcopy(self.base)
+
+    def test_set(self):
+        tx = transaction.Transaction(self.base)
+        tx.set((RELAYS, 'a.png', 1), RELAY_ON)
+        result = tx.commit()
+        self.assertEqual(result[RELAYS]['a.png'], {1: RELAY_ON, 2: RELAY_OFF})
+        self.assertEqual(self.base, self.original)
+
+    def test_shares_what_is_not_edited(self):
+        tx = transaction.Transaction(self.base)
+        tx.set((RELAYS, 'a.png', 1), RELAY_ON)
+        result = tx.commit()
+        # Only the path to the edit is copied
+        self.assertIsNot(result, self.base)
+        self.assertIsNot(result[RELAYS], self.base[RELAYS])
+        self.assertIsNot(result[RELAYS]['a.png'], self.base[RELAYS]['a.png'])
+        self.assertIs(result[RELAYS]['b.png'], self.base[RELAYS]['b.png'])
+        self.assertIs(result[WINDOW], self.base[WINDOW])
+
+    def test_copies_once(self):
+        tx = transaction.Transaction(self.base)
+        tx.set((RELAYS, 'a.png', 1), RELAY_ON)
+        relays = tx.view[RELAYS]['a.png']
+        tx.set((RELAYS, 'a.png', 2), RELAY_ON)
+        self.assertIs(tx.view[RELAYS]['a.png'], relays)
+        self.assertEqual(relays, {1: RELAY_ON, 2: RELAY_ON})
+
+    def test_delete(self):
+        tx = transaction.Transaction(self.base)
+        tx.delete((RELAYS, 'b.png'))
+        tx.delete((RELAYS, 'c.png'))
+        self.assertEqual(list(tx.commit()[RELAYS]), ['a.png'])
+        self.assertEqual(self.base, self.original)
+        self.assertEqual(tx.changes(), [((RELAYS, 'b.png'),)])
+
+    def test_owns_new_values(self):
+        tx = transaction.Transaction(self.base)
+        tx.set((RELAYS, 'c.png'), {1: RELAY_OFF})
+        tx.set((RELAYS, 'c.png', 1), RELAY_ON)
+        self.assertEqual(tx.commit()[RELAYS]['c.png'], {1: RELAY_ON})
+
+    def test_changes_replay(self):
+        # The changes bring a copy of the original to the result, as the journal does
+        tx = transaction.Transaction(self.base)
+        tx.set((TEMPLATE,), 'b.png')
+        tx.set((WINDOW,), [5, 6, 7, 8])
+        tx.delete((RELAYS, 'a.png', 2))
+        replayed = copy.deepcopy(self.original)
+        for entry in tx.changes():
+            persist.apply_change(replayed, entry)
+        self.assertEqual(replayed, tx.commit())
+
+    def test_abandon(self):
+        tx = transaction.Transaction(self.base)
+        tx.set((WINDOW,), [0, 0, 0, 0])
+        del tx
+        self.assertEqual(self.base, self.original)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# transaction.py
+#
+# Copy-on-write configuration transactions for the Antenna Switch application
+#
+# Copyright (C) 2019 by G3UKB Bob Cowdery
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#  The author can be reached by email at:
+#     bob@bobcowdery.plus.com
+#
+
+# All imports
+from coreimports import *
+
+"""
+
+Configuration transaction.
+Edits a settings or state tree without copying it. The first write under
+a dict or list copies just that container and those above it, everything
+else stays shared with the original, so starting, committing or abandoning
+a transaction costs only as much as the edits made. The original is never
+changed. All writes must go through set() and delete(), view is for reading.
+
+"""
+class Transaction:
+
+    def __init__(self, base):
+        """
+        Constructor
+
+        Arguments
+            base    -- settings or state tree to edit
+        """
+
+        self.__root = base
+        # Containers copied by this transaction which may be changed in place
+        # {id: container, ...}, holding them keeps the ids unique
+        self.__private = {}
+        # Edits in order as (keys, value) or (keys,) for a delete
+        self.__changes = []
+
+    @property
+    def view(self):
+        """ The tree as edited so far, read only """
+
+        return self.__root
+
+    def set(self, keys, value):
+        """
+        Set an item, the transaction takes ownership of the value
+
+        Arguments:
+            keys    --  tuple of keys leading to the item
+            value   --  new value
+
+        """
+
+        keys = tuple(keys)
+        self.__writable(keys[:-1])[keys[-1]] = value
+        if isinstance(value, (dict, list)):
+            self.__private[id(value)] = value
+        self.__changes.append((keys, value))
+
+    def delete(self, keys):
+        """
+        Delete an item if present
+
+        Arguments:
+            keys    --  tuple of keys leading to the item
+
+        """
+
+        keys = tuple(keys)
+        container = self.__writable(keys[:-1])
+        if keys[-1] in container:
+            del container[keys[-1]]
+            self.__changes.append((keys,))
+
+    def changes(self):
+        """ Return the edits in order as (keys, value) or (keys,) for a delete """
+
+        return list(self.__changes)
+
+    def commit(self):
+        """ Return the edited tree """
+
+        return self.__root
+
+    # Helpers =========================================================================================================
+    def __writable(self, keys):
+        """
+        Return the container at keys, copying it and its parents if shared
+
+        Arguments:
+            keys    --  tuple of keys leading to the container
+
+        """
+
+        self.__root = self.__own(self.__root)
+        node = self.__root
+        for key in keys:
+            child = self.__own(node[key])
+            node[key] = child
+            node = child
+        return node
+
+    def __own(self, container):
+        # Return a private version of a container
+        if id(container) in self.__private:
+            return container
+        container = copy.copy(container)
+        self.__private[id(container)] = container
+        return container